@@ -0,0 +1,167 @@
+"""The benchmarks. Each takes a size scale (1.0 = realistic sizes: 10k users, 100k violations, 50k usernotes)
+and returns a summary dict (see harness.summarize)."""
+
+from __future__ import annotations
+
+import json
+import random
+
+from drbot.agents import CommentAgent, ModlogAgent
+from drbot.handlers import AutobanHandler, PointsHandler, ModNotesHandler, PollHandler
+from drbot.offline import FakeReddit
+from drbot.stores import DataStore, WikiStore
+from drbot.tools import BlobDecoder
+
+from bench import fixtures
+from bench.harness import use_backend, scratch_data_store, run_agent, repeat
+
+USERS = 10000
+VIOLATIONS = 100000
+USERNOTES = 50000
+
+
+def _n(count: int, scale: float) -> int:
+    return max(1, int(count * scale))
+
+
+def autoban(scale: float) -> dict:
+    """CommentAgent + AutobanHandler over a day of comments, every commenter has a history to check."""
+    fixture = fixtures.traffic(users=_n(USERS, scale), comments=_n(2000, scale), history=20, monitored_share=0.05)
+    backend = FakeReddit.from_fixture(fixture)
+    use_backend(backend)
+    with scratch_data_store() as data_store:
+        agent = CommentAgent(data_store)
+        agent.register(AutobanHandler())
+        return run_agent(agent, backend, fixture["end"])
+
+
+def points(scale: float) -> dict:
+    """ModlogAgent + PointsHandler on removals, with a data store already holding 100k violations."""
+    fixture = fixtures.traffic(users=_n(USERS, scale), comments=_n(1000, scale), history=0, removal_share=0.3)
+    backend = FakeReddit.from_fixture(fixture)
+    records = fixtures.point_records(_n(USERS, scale), _n(VIOLATIONS, scale))
+    fixtures.add_violations(backend, records, fixture["start"] - 86400)
+    use_backend(backend)
+    with scratch_data_store() as data_store:
+        agent = ModlogAgent(data_store)
+        handler = PointsHandler()
+        agent.register(handler)
+        agent.data_store[handler.name] = records
+        return run_agent(agent, backend, fixture["end"])
+
+
+def modnotes(scale: float) -> dict:
+    """ModlogAgent + ModNotesHandler on new TB and mod notes, with 50k notes in Toolbox."""
+    users = _n(USERS, scale)
+    fixture = fixtures.traffic(users=users, comments=_n(200, scale), history=0, removal_share=0)
+    decoded = fixtures.usernotes(users, _n(USERNOTES, scale))
+    fixture["wiki"]["usernotes"] = fixtures.usernotes_page(decoded)
+    rnd = random.Random(0)
+    noted = sorted(decoded)
+    for i in range(_n(300, scale)):
+        created = rnd.uniform(fixture["start"], fixture["end"])
+        username = rnd.choice(noted)
+        if i % 2 == 0:
+            # Note added with Toolbox, to be copied to mod notes
+            fixture["modlog"].append({"action": "wikirevise", "mod": "mod_1", "created_utc": created,
+                                      "details": "Page usernotes edited",
+                                      "description": f"\"create new note on user {username}\" via toolbox"})
+        else:
+            # Mod note added on new reddit, to be written back to Toolbox
+            fixture["modnotes"].append({"user": username, "label": "ABUSE_WARNING", "note": f"Manual note {i}",
+                                        "operator": "mod_2", "created_at": created})
+            fixture["modlog"].append({"action": "addnote", "mod": "mod_2", "created_utc": created, "target_author": username})
+    backend = FakeReddit.from_fixture(fixture)
+    use_backend(backend)
+    with scratch_data_store() as data_store:
+        agent = ModlogAgent(data_store)
+        agent.register(ModNotesHandler())
+        return run_agent(agent, backend, fixture["end"], step=600)
+
+
+def poll(scale: float) -> dict:
+    """PollHandler.tally_poll on a thread with 2k votes (p50/p99 are per tally)."""
+    fixture = fixtures.traffic(users=_n(USERS, scale), comments=0, history=0)
+    backend = FakeReddit.from_fixture(fixture)
+    options = ["Oui", "Non", "Blanc"]
+    thread = backend.add_thing("t3", {"author": "mod_0", "title": "Poll", "created_utc": fixture["start"]})
+    rnd = random.Random(0)
+    votes = _n(2000, scale)
+    for i in range(votes):
+        backend.add_thing("t1", {"author": f"user_{rnd.randrange(_n(USERS, scale)):05d}", "body": f"Je vote {rnd.choice(options)}",
+                                 "link_id": thread["name"], "created_utc": fixture["start"] + i})
+    use_backend(backend)
+    with scratch_data_store() as data_store:
+        agent = CommentAgent(data_store)
+        handler = PollHandler()
+        agent.register(handler)
+        result = repeat(lambda: handler.tally_poll({"thread_id": thread["id"], "options": options, "duration": "1y"}), 3)
+    result["items"] = votes * 3
+    result["items_per_second"] = round(result["items"] / result["seconds"], 2) if result["seconds"] > 0 else None
+    result["api_calls_per_item"] = round(result["api_calls"] / result["items"], 3)
+    return result
+
+
+def _points_data_store(scale: float) -> DataStore:
+    data_store = DataStore()
+    data_store["ModlogAgent"] = {"_meta": {"last_processed": None},
+                                 "PointsHandler": fixtures.point_records(_n(USERS, scale), _n(VIOLATIONS, scale))}
+    return data_store
+
+
+def datastore_to_json(scale: float) -> dict:
+    """DataStore.to_json with 100k violations of 10k users (p50/p99 are per dump)."""
+    data_store = _points_data_store(scale)
+    result = repeat(data_store.to_json, 5)
+    result["bytes"] = len(data_store.to_json())
+    return result
+
+
+def datastore_from_json(scale: float) -> dict:
+    """DataStore.from_json of the same data (p50/p99 are per load)."""
+    dump = _points_data_store(scale).to_json()
+    result = repeat(lambda: DataStore().from_json(dump), 5)
+    result["bytes"] = len(dump)
+    return result
+
+
+def blob_decode(scale: float) -> dict:
+    """BlobDecoder.blob_to_string of 50k Toolbox notes (p50/p99 are per decode)."""
+    decoded = fixtures.usernotes(_n(USERS, scale), _n(USERNOTES, scale))
+    blob = json.loads(fixtures.usernotes_page(decoded))["blob"]
+    result = repeat(lambda: BlobDecoder().blob_to_string(blob), 5)
+    result["blob_bytes"] = len(blob)
+    return result
+
+
+def wiki_save(scale: float) -> dict:
+    """WikiStore.save_data_store of the 100k violations data store (p50/p99 are per save)."""
+    fixture = fixtures.traffic(users=10, comments=1, history=0)
+    backend = FakeReddit.from_fixture(fixture)
+    use_backend(backend)
+    data_store = _points_data_store(scale)
+    wiki_store = WikiStore(DataStore())
+    wiki_store.data_store = data_store
+    counter = iter(range(1000000))
+
+    def save():
+        # Change something every time so the page is actually written
+        data_store["_meta"]["bench"] = next(counter)
+        wiki_store.save_data_store()
+
+    result = repeat(save, 3)
+    result["bytes"] = len(data_store.to_json())
+    result["fits_in_wiki"] = result["bytes"] < WikiStore.MAX_PAGE_SIZE
+    return result
+
+
+BENCHMARKS = {
+    "autoban": autoban,
+    "points": points,
+    "modnotes": modnotes,
+    "poll": poll,
+    "datastore_to_json": datastore_to_json,
+    "datastore_from_json": datastore_from_json,
+    "blob_decode": blob_decode,
+    "wiki_save": wiki_save,
+}
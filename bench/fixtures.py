@@ -0,0 +1,71 @@
+"""Synthetic data at realistic sizes for the benchmarks."""
+
+from __future__ import annotations
+
+import json
+import random
+from datetime import datetime, timedelta
+
+from drbot import settings
+from drbot.offline import TrafficGenerator
+from drbot.tools import BlobEncoder
+
+TB_WARNINGS = ["spamwatch", "spamwarning", "abusewarning", "ban", "permban", "botban", "gooduser"]
+
+
+def traffic(users: int, comments: int, history: int, duration: int = 6 * 3600, seed: int = 0, **kwargs) -> dict:
+    generator = TrafficGenerator(settings.subreddit,
+                                 monitored_subs=[s["id"] for s in settings.monitored_subs],
+                                 removal_reasons=[r["id"] for r in settings.point_config],
+                                 wiki_page=settings.wiki_page,
+                                 seed=seed)
+    return generator.generate(users=users, comments=comments, submissions=max(1, comments // 25), duration=duration,
+                              history=history, **kwargs)
+
+
+def point_records(users: int, violations: int, seed: int = 0) -> dict:
+    """PointsHandler's slice of the data store: users -> removed items and their cost."""
+    rnd = random.Random(seed)
+    now = datetime.now()
+    records = {}
+    for i in range(violations):
+        username = f"user_{rnd.randrange(users):05d}"
+        if username not in records:
+            records[username] = {"violations": {}}
+        violation = {"cost": rnd.randint(1, 3)}
+        if rnd.random() < 0.5:
+            violation["expires"] = now + timedelta(days=rnd.randint(1, 365))
+        records[username]["violations"][f"t1_v{i:07d}"] = violation
+    return records
+
+
+def add_violations(backend, records: dict, created_utc: float) -> None:
+    """Put the removed items of point records on the backend, the handler fetches them when scanning a user."""
+    for username, record in records.items():
+        for fullname in record["violations"]:
+            backend.add_thing("t1", {"id": fullname[3:], "author": username, "removed": True, "created_utc": created_utc})
+
+
+def usernotes(users: int, notes: int, seed: int = 0) -> dict:
+    """Decoded Toolbox usernotes: username -> {"ns": [notes, newest first]}."""
+    rnd = random.Random(seed)
+    decoded = {}
+    for i in range(notes):
+        username = f"user_{rnd.randrange(users):05d}"
+        if username not in decoded:
+            decoded[username] = {"ns": []}
+        decoded[username]["ns"].append({"n": f"Synthetic note {i} about rule {rnd.randint(1, 10)}",
+                                        "t": 1500000000 + rnd.randrange(200000000),
+                                        "m": rnd.randrange(5),
+                                        "l": f"l,{rnd.randrange(36 ** 6):x},{rnd.randrange(36 ** 6):x}",
+                                        "w": rnd.randrange(len(TB_WARNINGS))})
+    for user in decoded.values():
+        user["ns"].sort(key=lambda n: n["t"], reverse=True)
+    return decoded
+
+
+def usernotes_page(decoded: dict) -> str:
+    """Content of the usernotes wiki page for decoded notes."""
+    return json.dumps({"ver": 6,
+                       "constants": {"users": [f"mod_{i}" for i in range(5)], "warnings": list(TB_WARNINGS)},
+                       "blob": BlobEncoder().blob_from_dict(decoded)})
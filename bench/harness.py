@@ -0,0 +1,118 @@
+"""Shared plumbing of the benchmarks: the fake backend, per-handler probes and result formatting."""
+
+from __future__ import annotations
+
+import math
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+from drbot import reddit, actions
+from drbot.agents import HandlerAgent
+from drbot.offline import FakeReddit, FakeSession, ScratchDataStore
+
+_session = None
+
+
+def use_backend(backend: FakeReddit) -> FakeSession:
+    """Point the bot's reddit() at a backend. Logs in once, then only swaps the backend behind the session."""
+    global _session
+    if _session is None:
+        _session = FakeSession(backend)
+        reddit.login(session=_session)
+    _session.backend = backend
+    return _session
+
+
+def api_calls() -> int:
+    return 0 if _session is None else _session.request_count
+
+
+@contextmanager
+def scratch_data_store():
+    scratch = tempfile.NamedTemporaryFile(prefix="drbot_bench_", suffix=".json", delete=False)
+    scratch.close()
+    try:
+        yield ScratchDataStore(scratch.name)
+    finally:
+        os.remove(scratch.name)
+
+
+def percentile(values: list[float], p: float) -> float | None:
+    """Nearest-rank percentile."""
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def summarize(durations: list[float], calls: int, items: int | None = None, seconds: float | None = None) -> dict:
+    """items/s, API calls per item and p50/p99 latency (ms) of a list of per-item durations."""
+    items = len(durations) if items is None else items
+    seconds = sum(durations) if seconds is None else seconds
+    return {
+        "items": items,
+        "seconds": round(seconds, 4),
+        "items_per_second": round(items / seconds, 2) if seconds > 0 else None,
+        "api_calls": calls,
+        "api_calls_per_item": round(calls / items, 3) if items > 0 else None,
+        "p50_ms": None if len(durations) == 0 else round(percentile(durations, 50) * 1000, 3),
+        "p99_ms": None if len(durations) == 0 else round(percentile(durations, 99) * 1000, 3),
+    }
+
+
+class HandlerProbe:
+    """Wraps the handlers of an agent to time every call and count the API calls it makes."""
+
+    def __init__(self, agent: HandlerAgent) -> None:
+        self.durations = {name: [] for name in agent.handlers}
+        self.calls = {name: 0 for name in agent.handlers}
+        for name, handler in agent.handlers.items():
+            for method in ["start_run", "handle", "end_run"]:
+                setattr(handler, method, self._wrap(name, method, getattr(handler, method)))
+
+    def _wrap(self, name: str, method: str, f):
+        def probe(*args, **kwargs):
+            calls = api_calls()
+            t = time.perf_counter()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                if method == "handle":
+                    self.durations[name].append(time.perf_counter() - t)
+                self.calls[name] += api_calls() - calls
+        return probe
+
+    def results(self) -> dict:
+        return {name: summarize(self.durations[name], self.calls[name]) for name in self.durations}
+
+
+def run_agent(agent: HandlerAgent, backend: FakeReddit, end: float, step: int = 30) -> dict:
+    """Run an agent on batches of `step` virtual seconds until `end`, the way the scheduler would."""
+    probe = HandlerProbe(agent)
+    calls = api_calls()
+    batches = 0
+    t = time.perf_counter()
+    while backend.now < end:
+        backend.now = min(end, backend.now + step)
+        agent.run()
+        actions.drain()  # Send the moderation actions of the batch, as the scheduler would
+        batches += 1
+    seconds = time.perf_counter() - t
+    items = len(next(iter(probe.durations.values()), []))
+    result = summarize([], api_calls() - calls, items=items, seconds=seconds)
+    result["batches"] = batches
+    result["handlers"] = probe.results()
+    return result
+
+
+def repeat(f, times: int) -> dict:
+    """Time `times` calls of f."""
+    durations = []
+    calls = api_calls()
+    for i in range(times):
+        t = time.perf_counter()
+        f()
+        durations.append(time.perf_counter() - t)
+    return summarize(durations, api_calls() - calls)
@@ -0,0 +1,118 @@
+"""
+Benchmark suite of the agent/handler pipeline, run against the offline Reddit stand-in (drbot/offline).
+Reports items/s, API calls per item and p50/p99 latency per handler, and stores the results as JSON
+so regressions show up between releases:
+
+    python -m bench.run                                   # everything at realistic sizes
+    python -m bench.run --scale 0.1 --only autoban,points # quick run
+    python -m bench.run --compare bench/results/v1.2.json # flag regressions against a previous run
+
+Uses the settings in data/ like the bot does, but never talks to reddit and keeps its data store in scratch files.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import time
+
+from drbot.log import console_handler
+
+from bench.benchmarks import BENCHMARKS
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def format_row(name: str, result: dict) -> str:
+    def f(value, unit=""):
+        return "-" if value is None else f"{value}{unit}"
+    return (f"{name:<32} {f(result['items']):>8} {f(result['items_per_second']):>12} {f(result['api_calls_per_item']):>10}"
+            f" {f(result['p50_ms'], 'ms'):>12} {f(result['p99_ms'], 'ms'):>12}")
+
+
+def print_results(results: dict) -> None:
+    print(f"{'benchmark':<32} {'items':>8} {'items/s':>12} {'calls/item':>10} {'p50':>12} {'p99':>12}")
+    for name, result in results["benchmarks"].items():
+        print(format_row(name, result))
+        for handler, handler_result in result.get("handlers", {}).items():
+            print(format_row(f"  {handler}", handler_result))
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """Regressions of more than threshold (relative) against a previous run."""
+    regressions = []
+
+    def check(name: str, current: dict, previous: dict) -> None:
+        for key, worse in [("items_per_second", -1), ("api_calls_per_item", 1), ("p99_ms", 1)]:
+            a, b = previous.get(key), current.get(key)
+            if a is None or b is None or a == 0:
+                continue
+            change = (b - a) / a
+            if change * worse > threshold:
+                regressions.append(f"{name} {key}: {a} -> {b} ({change:+.0%})")
+
+    for name, current in results["benchmarks"].items():
+        previous = baseline.get("benchmarks", {}).get(name)
+        if previous is None:
+            continue
+        check(name, current, previous)
+        for handler, handler_result in current.get("handlers", {}).items():
+            if handler in previous.get("handlers", {}):
+                check(f"{name}/{handler}", handler_result, previous["handlers"][handler])
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the bot's agents and handlers against an offline Reddit stand-in.")
+    parser.add_argument("--scale", type=float, default=1.0, help="Size of the data relative to the realistic sizes (10k users, 100k violations, 50k usernotes)")
+    parser.add_argument("--only", help=f"Comma separated benchmarks to run, among: {', '.join(BENCHMARKS)}")
+    parser.add_argument("--output", help="Where to write the JSON results (default: bench/results/<git revision>.json)")
+    parser.add_argument("--compare", help="Previous results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Relative change reported as a regression by --compare")
+    parser.add_argument("--log-level", default="CRITICAL", help="Console log level of the bot during the benchmarks")
+    args = parser.parse_args()
+
+    names = list(BENCHMARKS) if not args.only else [n.strip() for n in args.only.split(",")]
+    for name in names:
+        if name not in BENCHMARKS:
+            parser.error(f"Unknown benchmark '{name}'")
+
+    console_handler.setLevel(args.log_level)
+    revision = git_revision()
+    results = {"meta": {"revision": revision, "date": time.strftime("%Y-%m-%dT%H:%M:%S"), "scale": args.scale,
+                        "python": platform.python_version(), "machine": platform.machine()},
+               "benchmarks": {}}
+    for name in names:
+        print(f"Running {name}...", flush=True)
+        results["benchmarks"][name] = BENCHMARKS[name](args.scale)
+
+    print()
+    print_results(results)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{revision}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if len(regressions) > 0:
+            print(f"\n{len(regressions)} regressions against {args.compare}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            raise SystemExit(1)
+        print(f"\nNo regression against {args.compare}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,6 @@
 from drbot.config import settings
 from drbot.log import log
+from drbot.metrics import metrics
+from drbot.snapshot import snapshot
 from drbot.reddit import reddit
+from drbot.actions import actions
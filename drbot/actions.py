@@ -0,0 +1,253 @@
+from __future__ import annotations
+
+import json
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+import uuid
+
+import prawcore
+from praw.exceptions import RedditAPIException
+
+from drbot import settings, log, metrics, reddit
+
+
+class ActionQueue:
+    """Moderation writes (bans, removals, locks, reports, mod notes, modmails) waiting to be sent to reddit.
+    Handlers queue them and move on, drain() sends them in order from the scheduler. A write that fails
+    is tried again later with exponential backoff, unless reddit refused it for good (e.g. the user doesn't exist),
+or after as long as reddit asks when it's rate limited. The mods get a modmail listing the actions that were dropped.
+    Dry run is handled here: nothing is queued, the action is only logged.
+
+    An action can have an idempotency key, naming what it's about (the user for a ban, the item for a removal,
+    the modlog entry a modmail reports...): queuing an action whose key is still waiting, or (unless keep is False)
+    was sent less than KEEP seconds ago, does nothing, so e.g. a user isn't banned twice when a restart makes the bot
+    go over the same comments again. Actions without a key are always queued.
+    The queue is kept in an SQLite file (action_queue_file) so it survives restarts, or in memory if there's none."""
+
+    # Attempts before giving up on an action
+    MAX_ATTEMPTS = 8
+    # Seconds before the first retry, doubled at each attempt up to BACKOFF_CAP
+    BACKOFF_BASE = 30
+    BACKOFF_CAP = 60 * 60
+    # Seconds sent and failed actions are remembered for, to ignore duplicates
+    KEEP = 60 * 60
+    # Seconds a drain can take before leaving the rest to the next one, so other jobs get to run
+    DRAIN_SECONDS = 10
+    # Kinds of actions the mods are told about when they're dropped (a modmail that can't be sent can't be reported)
+    REPORTED = {"ban", "note", "remove", "lock", "report"}
+
+    def __init__(self) -> None:
+        self.path = ""
+        self._db = None
+        self._lock = threading.RLock()
+
+    def open(self, path: str) -> None:
+        """Use the queue in this file, "" to keep it in memory."""
+        if path != "":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._db = sqlite3.connect(path or ":memory:", timeout=30, isolation_level=None, check_same_thread=False)
+        if path != "":
+            self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS actions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            key TEXT NOT NULL,
+            subreddit TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            state TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_try REAL NOT NULL,
+            updated REAL NOT NULL,
+            error TEXT)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS actions_waiting ON actions (state, next_try)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS actions_keys ON actions (key)")
+        waiting = self.pending()
+        if waiting > 0:
+            log.info(f"{waiting} moderation actions left to send from the last run.")
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            self.open("")
+        return self._db
+
+    def put(self, kind: str, payload: dict, key: str | None = None, description: str = "", keep: bool = True) -> bool:
+        """Queue an action for the current sub. Returns False if it was already queued (same key, see the class).
+        keep=False only ignores duplicates of the action while it's waiting, for actions that can need doing again."""
+        description = description or f"{kind} {json.dumps(payload)}"
+        if settings.dry_run:
+            log.info(f"DRY RUN: would have done {description}")
+            return True
+        unique = key is None
+        key = f"{settings.subreddit.casefold()}/{kind}/{uuid.uuid4().hex if unique else key}"
+        now = time.time()
+        with self._lock:
+            if not unique and self.db.execute("SELECT 1 FROM actions WHERE key = ? AND (state = 'pending' OR (? AND updated > ?))",
+                                              (key, keep, now - ActionQueue.KEEP)).fetchone() is not None:
+                log.debug(f"Not queuing {description}, it already was.")
+                return False
+            self.db.execute("INSERT INTO actions (key, subreddit, kind, payload, next_try, updated) VALUES (?, ?, ?, ?, ?, ?)",
+                            (key, settings.subreddit, kind, json.dumps(payload), now, now))
+        log.debug(f"Queued {description}")
+        return True
+
+    @staticmethod
+    def fullname(item) -> str:
+        return item if isinstance(item, str) else item.fullname
+
+    # Shortcuts for the actions handlers take, item is a Comment, Submission or fullname
+
+    def ban(self, username: str, **kwargs) -> bool:
+        """Ban a user, kwargs are those of SubredditRelationship.add (ban_reason, ban_message, duration...)."""
+        return self.put("ban", {"username": username, **kwargs}, key=username.casefold(), description=f"ban of u/{username}")
+
+    def note(self, username: str, label: str, note: str, item=None) -> bool:
+        return self.put("note", {"username": username, "label": label, "note": note, "thing": None if item is None else self.fullname(item)},
+                        description=f"{label} mod note on u/{username}: {note}")
+
+    # Removals and locks can be needed again after a mod approves or unlocks the item, so they're only deduplicated while waiting
+
+    def remove(self, item, mod_note: str | None = None, spam: bool = False) -> bool:
+        return self.put("remove", {"fullname": self.fullname(item), "mod_note": mod_note, "spam": spam},
+                        key=self.fullname(item), description=f"removal of {self.fullname(item)}", keep=False)
+
+    def lock(self, item) -> bool:
+        return self.put("lock", {"fullname": self.fullname(item)}, key=self.fullname(item), description=f"lock of {self.fullname(item)}",
+                        keep=False)
+
+    def report(self, item, reason: str) -> bool:
+        return self.put("report", {"fullname": self.fullname(item), "reason": reason}, key=f"{self.fullname(item)}/{reason}",
+                        description=f"report of {self.fullname(item)} with reason [{reason}]")
+
+    def modmail(self, subject: str, body: str, key: str | None = None, **kwargs) -> bool:
+        """Send a modmail, kwargs are those of Reddit.send_modmail.
+        key is what the modmail is about (e.g. a modlog entry id), without one it's always sent."""
+        return self.put("modmail", {"subject": subject, "body": body, **kwargs}, key=key, description=f'modmail "{subject}"')
+
+    @staticmethod
+    def describe(kind: str, payload: dict) -> str:
+        """An action in a few words, for the mods."""
+        match kind:
+            case "ban":
+                return f"ban of /u/{payload['username']} for [{payload.get('ban_reason')}]"
+            case "note":
+                return f"{payload['label']} mod note on /u/{payload['username']}: {payload['note']}"
+            case "remove" | "lock":
+                return f"{'removal' if kind == 'remove' else 'lock'} of {payload['fullname']}"
+            case "report":
+                return f"report of {payload['fullname']} with reason [{payload['reason']}]"
+        return f"{kind} {json.dumps(payload)}"
+
+    @staticmethod
+    def ratelimit_wait(e: RedditAPIException) -> float | None:
+        """Seconds reddit asks to wait for if e is a RATELIMIT error (PRAW only sleeps through short ones), None otherwise."""
+        for item in e.items:
+            if item.error_type == "RATELIMIT":
+                match = re.search(r"(\d+) (millisecond|second|minute|hour)", item.message)
+                if match is None:
+                    return ActionQueue.BACKOFF_CAP
+                return int(match.group(1)) * {"millisecond": 0.001, "second": 1, "minute": 60, "hour": 3600}[match.group(2)]
+        return None
+
+    @staticmethod
+    def _thing(fullname: str):
+        if fullname.startswith("t1_"):
+            return reddit().comment(id=fullname[3:])
+        return reddit().submission(id=fullname[3:])
+
+    def send(self, kind: str, payload: dict) -> None:
+        """Make the request of an action, in the context of its sub."""
+        match kind:
+            case "ban":
+                payload = dict(payload)
+                reddit().sub.banned.add(payload.pop("username"), **payload)
+            case "note":
+                reddit().sub.mod.notes.create(redditor=payload["username"], label=payload["label"], note=payload["note"],
+                                              thing=payload["thing"])
+            case "remove":
+                self._thing(payload["fullname"]).mod.remove(mod_note=payload["mod_note"], spam=payload["spam"])
+            case "lock":
+                self._thing(payload["fullname"]).mod.lock()
+            case "report":
+                self._thing(payload["fullname"]).report(reason=payload["reason"])
+            case "modmail":
+                reddit().send_modmail(**payload)
+            case _:
+                raise Exception(f"Unknown action kind: {kind}")
+
+    def drain(self) -> int:
+        """Send the actions that are due, oldest first, for up to DRAIN_SECONDS. Returns the number sent."""
+        started = time.monotonic()
+        sent = 0
+        dropped = {}  # Sub -> descriptions of the actions dropped during this drain
+        while time.monotonic() - started < ActionQueue.DRAIN_SECONDS:
+            with self._lock:
+                rows = self.db.execute("SELECT id, subreddit, kind, payload, attempts FROM actions WHERE state = 'pending' AND next_try <= ? ORDER BY id LIMIT 20",
+                                       (time.time(),)).fetchall()
+            if len(rows) == 0:
+                break
+            for id, subreddit, kind, payload, attempts in rows:
+                with settings.use_subreddit(subreddit):
+                    try:
+                        self.send(kind, json.loads(payload))
+                    except RedditAPIException as e:
+                        wait = self.ratelimit_wait(e)
+                        if wait is None:
+                            log.error(f"Reddit refused {kind} action {payload} in r/{subreddit}, dropping it: {repr(e)}")
+                            self._drop(id, subreddit, kind, payload, attempts + 1, repr(e), dropped)
+                            continue
+                        # Not a failure, reddit wants the bot to slow down: wait as long as it says, without counting an attempt
+                        log.warning(f"{kind} action in r/{subreddit} hit reddit's rate limit, retrying in {wait:.0f}s.")
+                        with self._lock:
+                            self.db.execute("UPDATE actions SET next_try = ?, updated = ?, error = ? WHERE id = ?",
+                                            (time.time() + wait + 1, time.time(), repr(e), id))
+                        continue
+                    except (prawcore.exceptions.NotFound, prawcore.exceptions.Forbidden, prawcore.exceptions.BadRequest) as e:
+                        log.error(f"Reddit refused {kind} action {payload} in r/{subreddit}, dropping it: {repr(e)}")
+                        self._drop(id, subreddit, kind, payload, attempts + 1, repr(e), dropped)
+                        continue
+                    except Exception as e:
+                        attempts += 1
+                        if attempts >= ActionQueue.MAX_ATTEMPTS:
+                            log.error(f"{kind} action {payload} in r/{subreddit} failed {attempts} times, giving up: {repr(e)}")
+                            self._drop(id, subreddit, kind, payload, attempts, repr(e), dropped)
+                            continue
+                        delay = min(ActionQueue.BACKOFF_CAP, ActionQueue.BACKOFF_BASE * 2 ** (attempts - 1)) * random.uniform(0.5, 1)
+                        log.warning(f"{kind} action in r/{subreddit} failed (attempt {attempts}), retrying in {delay:.0f}s: {repr(e)}")
+                        with self._lock:
+                            self.db.execute("UPDATE actions SET attempts = ?, next_try = ?, updated = ?, error = ? WHERE id = ?",
+                                            (attempts, time.time() + delay, time.time(), repr(e), id))
+                        continue
+                self._finish(id, "done", attempts + 1, None)
+                sent += 1
+        for subreddit, lines in dropped.items():
+            with settings.use_subreddit(subreddit):
+                self.modmail(subject="Moderation actions failed",
+                             body="These actions of the bot could not be done and were dropped, please check them manually:\n\n" + "\n\n".join(lines))
+        with self._lock:
+            self.db.execute("DELETE FROM actions WHERE state != 'pending' AND updated < ?", (time.time() - ActionQueue.KEEP,))
+        metrics.set_gauge("pending_actions", self.pending())
+        return sent
+
+    def _drop(self, id: int, subreddit: str, kind: str, payload: str, attempts: int, error: str, dropped: dict) -> None:
+        """Give up on an action, and keep it for the report to the mods at the end of the drain."""
+        self._finish(id, "failed", attempts, error)
+        if kind in ActionQueue.REPORTED:
+            dropped.setdefault(subreddit, []).append(f"{self.describe(kind, json.loads(payload))}: {error}")
+
+    def _finish(self, id: int, state: str, attempts: int, error: str | None) -> None:
+        with self._lock:
+            self.db.execute("UPDATE actions SET state = ?, attempts = ?, updated = ?, error = ? WHERE id = ?",
+                            (state, attempts, time.time(), error, id))
+
+    def pending(self) -> int:
+        with self._lock:
+            return self.db.execute("SELECT COUNT(*) FROM actions WHERE state = 'pending'").fetchone()[0]
+
+
+actions = ActionQueue()
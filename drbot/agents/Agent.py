@@ -1,6 +1,6 @@
 from __future__ import annotations
 from abc import ABC, abstractmethod
-from drbot import log
+from drbot import settings, log
 from drbot.stores import DataStore
 
 
@@ -19,12 +19,18 @@ class Agent(ABC):
         if name is None:  # By default, the name is just the class name
             name = self.__class__.__name__
         self.name = name
+        self.subreddit = settings.subreddit
         self._data_store = data_store
 
         # Check for DataStore conflicts
         if self.name in self._data_store:
             raise Exception(f'Name "{self.name}" already exists in the DataStore.')
 
+    @property
+    def label(self) -> str:
+        """Name in the logs and metrics, with the sub if the bot serves several."""
+        return self.name if len(settings.all_subreddits) == 1 else f"{self.subreddit}/{self.name}"
+
     @abstractmethod
     def run(self) -> None:
-        log.debug(f"{self.name} running.")
+        log.debug(f"{self.label} running.")
@@ -1,7 +1,9 @@
 from __future__ import annotations
+import time
 from abc import abstractmethod
 from typing import Generic, TypeVar
-from drbot import log
+from drbot import settings, log, metrics, snapshot
+from drbot.metrics import Batch
 from drbot.agents import Agent
 from drbot.handlers import Handler
 from drbot.stores import DataStore
@@ -17,10 +19,17 @@ class HandlerAgent(Agent, Generic[T]):
     def __init__(self, data_store: DataStore, name: str | None = None) -> None:
         super().__init__(data_store, name)
         self.handlers = {}
+        self._routes = {}  # Route of an item -> handlers that want it, see route()
 
         # Initialize last_processed
-        latest = self.get_latest_item()
-        self._data_store[self.name] = {"_meta": {"last_processed": None if latest is None else self.id(latest)}}
+        # (only used until the data store is loaded, so the one from the startup snapshot doesn't need revalidating)
+        latest = snapshot.get(f"{self.name}.latest_item")
+        if latest is None:
+            item = self.get_latest_item()
+            latest = {"id": None, "time": None} if item is None else {"id": self.id(item), "time": self.timestamp(item)}
+            snapshot.put(f"{self.name}.latest_item", latest)
+        self._data_store[self.name] = {"_meta": {"last_processed": latest["id"]}}
+        self._last_processed_time = latest["time"]
 
     def get_data_store(self, handler: Handler) -> dict:
         """Get a reserved slice of the DataStore for a given handler.
@@ -38,36 +47,79 @@ class HandlerAgent(Agent, Generic[T]):
         if handler.name in self.handlers:
             log.error(f"Handler {handler.name} already registered, overwriting.")
         self.handlers[handler.name] = handler
+        self._routes = {}
         handler.setup(self)
 
+    def route(self, item: T) -> str | tuple[str, ...] | None:
+        """Kind of an item (or kinds, it then goes to the handlers wanting any of them), matched against
+        the handled_actions of the handlers to only pass it to those that want it.
+        None (the default) sends every item to every handler."""
+        return None
+
+    def handlers_for(self, route: str | tuple[str, ...] | None) -> list[Handler[T]]:
+        """Handlers wanting the items of a route, in registration order."""
+        if route not in self._routes:
+            kinds = {route} if isinstance(route, str) else set(route or ())
+            self._routes[route] = [h for h in self.handlers.values()
+                                   if route is None or h.handled_actions is None or not kinds.isdisjoint(h.handled_actions)]
+        return self._routes[route]
+
+    def wanted_actions(self) -> frozenset[str] | None:
+        """Every kind of item the handlers want, None if one of them wants them all."""
+        if any(h.handled_actions is None for h in self.handlers.values()):
+            return None
+        return frozenset().union(*(h.handled_actions for h in self.handlers.values()))
+
     def run(self) -> None:
         super().run()
-
-        items = [item for item in self.get_items() if not self.skip_item(item)]
+        # Pick up edited settings once per batch instead of on every access
+        settings.refresh()
+
+        # Time and requests are charged to each handler, the agent's own work (fetching items, saving) to the agent
+        batch = Batch(self.label)
+        start = time.perf_counter()
+        with batch.measure(self.name):
+            items = [item for item in self.get_items() if not self.skip_item(item)]
         if len(items) == 0:
-            log.debug(f"{self.name} returning since no item to process")
+            metrics.set_gauge("agent_lag_seconds", 0, agent=self.label)
+            log.debug(f"{self.label} returning since no item to process")
             return
-        log.info(f"{self.name} processing {len(items)} new items.")
+        log.info(f"{self.label} processing {len(items)} new items.")
+        batch.items = len(items)
+        newest, oldest = self.timestamp(items[-1]), self._last_processed_time or self.timestamp(items[0])
+        if newest is not None and oldest is not None:
+            metrics.set_gauge("agent_lag_seconds", round(max(0, newest - oldest), 3), agent=self.label)
 
         # Let all the handlers know we're starting a new run
         for handler in self.handlers.values():
-            handler.start_run()
+            with batch.measure(handler.name):
+                handler.start_run()
 
         # Process items
         for item in items:
-            log.debug(f"{self.name} handling item {self.id(item)}")
-            for handler in self.handlers.values():
-                handler.handle(item)
-            self.data_store["_meta"]["last_processed"] = self.id(item)
-            self._data_store.save()
+            log.debug(f"{self.label} handling item {self.id(item)}")
+            for handler in self.handlers_for(self.route(item)):
+                with batch.measure(handler.name):
+                    handler.handle(item)
+            self.mark_processed(item)
+            self._last_processed_time = self.timestamp(item) or self._last_processed_time
+            if self._last_processed_time is not None:
+                metrics.set_gauge("agent_last_processed_timestamp_seconds", self._last_processed_time, agent=self.label)
+            with batch.measure(self.name):
+                self._data_store.save()
 
         #self._data_store.save()
         # Let all the handlers know the run has ended
         for handler in self.handlers.values():
-            handler.end_run()
+            with batch.measure(handler.name):
+                handler.end_run()
 
         # Make a local backup
-        self._data_store.save()
+        with batch.measure(self.name):
+            self._data_store.save()
+
+        batch.seconds = time.perf_counter() - start
+        log.info(metrics.end_batch(batch))
 
     @abstractmethod
     def get_items(self) -> list[T]:
@@ -82,6 +134,16 @@ class HandlerAgent(Agent, Generic[T]):
         Used for keeping track of last_processed."""
         pass
 
+    def timestamp(self, item: T) -> float | None:
+        """Creation time of an item (unix time), for the lag metrics.
+        Works for anything with a created_utc, override it for other items."""
+        return getattr(item, "created_utc", None)
+
+    def mark_processed(self, item: T) -> None:
+        """Record that an item was handled, so get_items doesn't return it again.
+        Sets self.data_store["_meta"]["last_processed"], override it to keep other cursors too."""
+        self.data_store["_meta"]["last_processed"] = self.id(item)
+
     def get_latest_item(self) -> T | None:
         """Get the latest item. Used for setting the initial last_processed,
         so you don't process items stretching backwards forever on the first run.
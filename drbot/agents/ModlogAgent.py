@@ -1,18 +1,136 @@
+from __future__ import annotations
+import heapq
 from praw.models import ModAction
-from drbot import settings, reddit
+from drbot import settings, log, reddit
 from drbot.agents import HandlerAgent
+from drbot.stores import DataStore
 
 
 class ModlogAgent(HandlerAgent[ModAction]):
-    """Scans incoming modlog entries and runs handlers on them."""
+    """Scans incoming modlog entries and runs handlers on them.
+    The modlog is read newest first until the last entry processed, usually within the first page.
+    When the bot is so far behind that reading it all would take more requests than fetching each action
+    the handlers want on its own (e.g. after downtime on a busy sub), it catches up with those filtered
+    listings instead (see streams), merged by time."""
 
-    def get_items(self) -> list[ModAction]:
+    # Cached reddit responses made stale by what mods do outside of the bot, per modlog action
+    INVALIDATES = {
+        "wikirevise": ["GET r/{subreddit}/wiki/{page}"],
+        "banuser": ["GET r/{subreddit}/about/banned"],
+        "unbanuser": ["GET r/{subreddit}/about/banned"],
+        "addmoderator": ["GET r/{subreddit}/about/moderators"],
+        "removemoderator": ["GET r/{subreddit}/about/moderators"],
+        "acceptmoderatorinvite": ["GET r/{subreddit}/about/moderators"],
+        "removecomment": ["GET api/info"],
+        "removelink": ["GET api/info"],
+        "spamcomment": ["GET api/info"],
+        "spamlink": ["GET api/info"],
+        "approvecomment": ["GET api/info"],
+        "approvelink": ["GET api/info"],
+    }
+
+    # Modlog actions changing the mod team
+    MOD_TEAM_CHANGES = {"addmoderator", "removemoderator", "acceptmoderatorinvite"}
+
+    # Kind of the entries made by reddit's admins, for the handled_actions of handlers (they're listed with mod=a)
+    ADMIN = "admin"
+    # Actions fetched even if no handler wants them, to invalidate the caches above.
+    # Removals and approvals are left out: there are lots of them, and the api/info cache doesn't last long.
+    WATCHED = MOD_TEAM_CHANGES | {"wikirevise", "banuser", "unbanuser"}
+    # Entries per page of the modlog listing
+    PAGE = 100
+
+    def __init__(self, data_store: DataStore, name: str | None = None) -> None:
+        super().__init__(data_store, name)
+        self._streams_of = {}  # Id of a fetched entry -> the streams it came in
+        self._latest = None  # Latest entry of the modlog, when read_modlog gave up
+
+    def streams(self) -> dict[str, dict] | None:
+        """Filtered listings to fetch when far behind, as stream name -> filters of SubredditModeration.log.
+        Reddit filters the modlog on one action (or mod) at a time, so there is one per action wanted by the handlers,
+        with its own cursor. None if one of the handlers wants every entry."""
+        wanted = self.wanted_actions()
+        if wanted is None:
+            return None
+        streams = {action: {"action": action} for action in sorted((wanted | ModlogAgent.WATCHED) - {ModlogAgent.ADMIN})}
+        if ModlogAgent.ADMIN in wanted:
+            streams[ModlogAgent.ADMIN] = {"mod": "a"}  # Reddit's shorthand for all admins
+        return streams
+
+    def read_modlog(self) -> list[ModAction] | None:
+        """New entries of the whole modlog, latest first, or None if reading them would take more requests than the streams."""
+        meta = self.data_store["_meta"]
+        since = meta.get("last_processed_time")
+        streams = self.streams()
         items = []
-        # items = reddit().sub.mod.log(
-        #     limit=None, params={"before": self.data_store["_meta"]["last_processed"]})  # Yes really, it's 'before' not 'after' - reddit convention has the top of the list being the 'first'
-        for item in reddit().sub.mod.log(limit=None, params={"before": self.data_store["_meta"]["last_processed"]}):
-            items.append(item)# Yes really, it's 'before' not 'after' - reddit convention has the top of the list being the 'first'
-        return list(reversed(list(items)))  # Process from earliest to latest
+        # Yes really, it's 'before' not 'after' - reddit convention has the top of the list being the 'first'
+        for item in reddit().sub.mod.log(limit=None, params={"before": meta["last_processed"]}):
+            if since is not None and item.created_utc < since:
+                break
+            items.append(item)
+            if len(items) == ModlogAgent.PAGE and streams is not None and since is not None:
+                # More than a page behind, guess how many are left from the time this one covers
+                self._latest = next(reddit().sub.mod.log(limit=1))
+                covered = max(1, max(i.created_utc for i in items) - min(i.created_utc for i in items))
+                if (self._latest.created_utc - since) / covered - 1 > len(streams):
+                    return None
+        self._streams_of = {item.id: ["all"] for item in items}
+        return items
+
+    def read_streams(self) -> list[ModAction]:
+        """New entries of the streams, latest first."""
+        meta = self.data_store["_meta"]
+        cursors = meta.setdefault("cursors", {})
+        fetched = []
+        self._streams_of = {}
+        for stream, filters in self.streams().items():
+            # A new stream starts after the last entry processed
+            cursor = cursors.setdefault(stream, {"id": None, "time": meta["last_processed_time"]})
+            items = []
+            # Yes really, it's 'before' not 'after' - reddit convention has the top of the list being the 'first'
+            for item in reddit().sub.mod.log(**filters, limit=None, params={"before": cursor["id"]}):
+                if item.created_utc < cursor["time"]:
+                    break
+                if item.id != meta["last_processed"]:
+                    items.append(item)
+            if len(items) > 0 and all(self.skip_item(item) for item in items):
+                # Only entries of the bot, move past them so they aren't fetched again
+                cursors[stream] = {"id": items[0].id, "time": items[0].created_utc}
+            for item in items:
+                self._streams_of.setdefault(item.id, []).append(stream)
+            fetched.append(items)
+        # Processing the latest entry too moves last_processed past the skipped ones, for read_modlog to start from there
+        fetched.append([self._latest])
+        seen = set()
+        return [item for item in heapq.merge(*fetched, key=lambda item: item.created_utc, reverse=True)
+                if not (item.id in seen or seen.add(item.id))]
+
+    def get_items(self) -> list[ModAction]:
+        items = self.read_modlog()
+        if items is None:
+            log.info(f"{self.label} is far behind, catching up on the entries the handlers want only.")
+            items = self.read_streams()
+
+        for template in set(t for item in items for t in ModlogAgent.INVALIDATES.get(item.action, [])):
+            reddit().cache.invalidate(template)
+        if any(item.action in ModlogAgent.MOD_TEAM_CHANGES for item in items):
+            reddit().mod_roster.invalidate()
+        return list(reversed(items))  # Process from earliest to latest
+
+    def route(self, item: ModAction) -> str | tuple[str, str]:
+        if ModlogAgent.ADMIN in self._streams_of.get(item.id, []) or item._mod == "Anti-Evil Operations":
+            return (item.action, ModlogAgent.ADMIN)
+        return item.action
+
+    def mark_processed(self, item: ModAction) -> None:
+        super().mark_processed(item)
+        meta = self.data_store["_meta"]
+        meta["last_processed_time"] = item.created_utc
+        for stream in self._streams_of.get(item.id, []):
+            if stream == "all":
+                meta.pop("cursors", None)  # Behind now, streams will start over from here
+            else:
+                meta.setdefault("cursors", {})[stream] = {"id": item.id, "time": item.created_utc}
 
     def id(self, item: ModAction) -> str:
         return item.id
@@ -1,4 +1,12 @@
+from __future__ import annotations
+
+import functools
 import shutil
+import threading
+from collections.abc import Mapping
+from contextlib import contextmanager
+from contextvars import ContextVar
+from types import MappingProxyType
 
 from dynaconf import Dynaconf, Validator
 from dynaconf.validator import OrValidator
@@ -63,7 +71,7 @@ def validate_monitored_subs_config(l):
         if not ("id" in c and type(c["id"]) is str):
             print(f"Missing or invalid 'id' for sub monitoring name #{i}")
             return False
-        if not ("action" in c and type(c["action"]) is str and c["action"] in ["ban", "watch", "report", "modalert"]):
+        if not ("action" in c and type(c["action"]) is str and c["action"] in ["ban", "remove", "report", "watch", "modalert"]):
             print(f"Missing or invalid 'action' for monitoring reason #{i} ({c['id']}) - must be a valid action")
             return False
         for k in c:
@@ -73,11 +81,203 @@ def validate_monitored_subs_config(l):
     return True
 
 
+def validate_components_config(kind):
+    """Check the [agents.X] or [handlers.X] tables of the settings."""
+    keys = {"agents": ["enabled", "every"], "handlers": ["enabled", "jobs"]}[kind]
+
+    def validate(d):
+        for name, c in d.items():
+            if not isinstance(c, Mapping):
+                print(f"Broken {kind} entry '{name}': {c}")
+                return False
+            for k in c:
+                if not k in keys:
+                    print(f"Unknown key '{k}' for {name} - must be one of: {', '.join(keys)}")
+                    return False
+            if "enabled" in c and not type(c["enabled"]) is bool:
+                print(f"Invalid 'enabled' for {name} - must be true or false")
+                return False
+            if "every" in c and not (type(c["every"]) is int and c["every"] > 0):
+                print(f"Invalid 'every' for {name} - must be a whole number of seconds >= 1")
+                return False
+            if "jobs" in c:
+                if not isinstance(c["jobs"], Mapping):
+                    print(f"Invalid 'jobs' for {name} - must be a table of job = seconds")
+                    return False
+                for job, every in c["jobs"].items():
+                    if not (type(every) is int and every >= 0):
+                        print(f"Invalid interval for job '{job}' of {name} - must be a whole number of seconds (or 0 to turn it off)")
+                        return False
+        return True
+    return validate
+
+
+def _freeze(value):
+    """Deep read-only copy of a settings value."""
+    if isinstance(value, Mapping):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+class SettingsSnapshot:
+    """Immutable, already validated view of the settings at a given time.
+    Attribute reads are plain dict lookups, no disk access or validation is involved."""
+
+    __slots__ = ("_values", "revision")
+
+    def __init__(self, values: Mapping, revision: int) -> None:
+        object.__setattr__(self, "_values", MappingProxyType({k.lower(): _freeze(v) for k, v in values.items()}))
+        object.__setattr__(self, "revision", revision)
+
+    def __getattr__(self, name: str):
+        try:
+            return self._values[name.lower()]
+        except KeyError:
+            raise AttributeError(f"Unknown setting '{name}'") from None
+
+    def __setattr__(self, name: str, value) -> None:
+        raise AttributeError("Settings are read-only, edit the settings file instead")
+
+    def __contains__(self, name: str) -> bool:
+        return name.lower() in self._values
+
+
+# The sub the current code is working for, when the bot serves several (see Settings.use_subreddit)
+current_subreddit: ContextVar[str | None] = ContextVar("current_subreddit", default=None)
+
+
+class Settings:
+    """The settings used by the whole bot.
+    Reads are served from the current SettingsSnapshot. The files are only read again when refresh() notices they changed
+    (checked once per batch by the agents) or when reload() is called (e.g. by ConfigEditHandler),
+    and a new snapshot only replaces the current one if it passes validation.
+
+    When the bot serves several subs (extra_subreddits), each extra sub has its own Settings, layered over the main ones,
+    and everything (reads, reloads...) goes to the Settings of the sub set by use_subreddit()."""
+
+    def __init__(self, dynaconf: Dynaconf, paths: tuple = None, overrides: dict | None = None, root: Settings | None = None) -> None:
+        self._dynaconf = dynaconf
+        self._paths = paths or (SETTINGS_PATH, AUTH_SETTINGS_PATH)
+        self._overrides = overrides or {}
+        self._root = root or self
+        self._subs = {}  # casefolded sub name -> Settings, for the extra subs
+        self._lock = threading.Lock()
+        self._files_revision = settings_revision(self._paths)
+        self._snapshot = SettingsSnapshot(dynaconf.as_dict() | self._overrides, 1)
+
+    def __getattr__(self, name: str):
+        return getattr(self._current()._snapshot, name)
+
+    def __setattr__(self, name: str, value) -> None:
+        if not name.startswith("_"):
+            raise AttributeError("Settings are read-only, edit the settings file instead")
+        super().__setattr__(name, value)
+
+    def _current(self) -> Settings:
+        subreddit = current_subreddit.get()
+        if subreddit is None or len(self._subs) == 0:
+            return self
+        return self._subs.get(subreddit.casefold(), self)
+
+    @property
+    def revision(self) -> int:
+        """Increases every time a new snapshot is loaded, for caches built from the settings."""
+        return self._current()._snapshot.revision
+
+    @property
+    def file(self) -> str:
+        """The settings file of the current sub, the one mirroring its wiki settings page."""
+        current = self._current()
+        return current._paths[-1] if current is not self._root else SETTINGS_PATH
+
+    @property
+    def all_subreddits(self) -> list[str]:
+        """Every sub the bot serves, the main one first."""
+        return [self._root._snapshot.subreddit] + [s._snapshot.subreddit for s in self._root._subs.values()]
+
+    def snapshot(self) -> SettingsSnapshot:
+        """Current settings, guaranteed not to change while you hold them."""
+        return self._current()._snapshot
+
+    @contextmanager
+    def use_subreddit(self, subreddit: str):
+        """Serve the settings of subreddit (and make reddit().sub point to it) in this block."""
+        token = current_subreddit.set(subreddit)
+        try:
+            yield
+        finally:
+            current_subreddit.reset(token)
+
+    def bind(self, func):
+        """func, always run for the sub currently in use, e.g. for a scheduled job."""
+        subreddit = self.subreddit
+
+        @functools.wraps(func)
+        def run(*args, **kwargs):
+            with self.use_subreddit(subreddit):
+                return func(*args, **kwargs)
+        # Job names in the metrics, e.g. "ModlogAgent.run" (or "sub/ModlogAgent.run" when serving several subs)
+        if hasattr(func, "__self__"):
+            run.__qualname__ = f"{type(func.__self__).__name__}.{func.__name__}"
+        if len(self.all_subreddits) > 1:
+            run.__qualname__ = f"{subreddit}/{run.__qualname__}"
+        return run
+
+    def add_subreddit(self, settings: Settings) -> None:
+        self._subs[settings._snapshot.subreddit.casefold()] = settings
+
+    def reload(self) -> bool:
+        """Read the settings files again. Returns True if a new valid snapshot was loaded."""
+        from drbot.log import log  # drbot.log itself needs the settings
+        current = self._current()
+        if current is not self:
+            return current.reload()
+        with self._lock:
+            self._files_revision = settings_revision(self._paths)
+            try:
+                self._dynaconf.reload()
+                self._dynaconf.validators.validate()
+            except Exception as e:
+                log.error(f"Invalid settings, keeping the previous ones: {e}")
+                return False
+            self._snapshot = SettingsSnapshot(self._dynaconf.as_dict() | self._overrides, self._snapshot.revision + 1)
+        log.info(f"Settings reloaded (revision {self._snapshot.revision}).")
+        return True
+
+    def refresh(self) -> bool:
+        """Reload the settings if their files changed since the last load."""
+        current = self._current()
+        if settings_revision(current._paths) == current._files_revision:
+            return False
+        return current.reload()
+
 
 SETTINGS_PATH = os.path.join(os.path.dirname(__file__), '../data/settings.toml')
 AUTH_SETTINGS_PATH = os.path.join(os.path.dirname(__file__), '../data/server_settings.toml')
 OLD_AUTH_SETTINGS_PATH = os.path.join(os.path.dirname(__file__), '../data/auth.toml')
 
+
+def subreddit_settings_path(subreddit: str) -> str:
+    """Settings file of an extra sub, applied over the main settings file."""
+    return os.path.join(os.path.dirname(__file__), f'../data/settings.{subreddit}.toml')
+
+
+def settings_revision(paths: tuple) -> tuple:
+    """Cheap marker of the settings files state, changes whenever one of them is rewritten
+    (e.g. by ConfigEditHandler when the wiki settings page is edited)."""
+    revision = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            revision.append(None)
+        else:
+            revision.append((stat.st_mtime_ns, stat.st_size))
+    return tuple(revision)
+
+
 if not os.path.isfile(AUTH_SETTINGS_PATH):
     if os.path.isfile(OLD_AUTH_SETTINGS_PATH):
         print("Old settings file detected, backuping and replacing")
@@ -92,12 +292,7 @@ if not os.path.isfile(SETTINGS_PATH):
     print("There's no application settings file. Run first_time_setup.py")
     sys.exit(1)
 
-settings = Dynaconf(
-    envvar_prefix="AutobanBOT",
-    settings_files=[SETTINGS_PATH, AUTH_SETTINGS_PATH],
-    validate_on_update="all",
-    fresh_vars=["point_threshold", "point_config", "monitored_subs", "expiration_months", "autoban_mode", "dry_run", "trusted_users", "polls", "wipe_contrib_on_permaban"],
-    validators=[
+VALIDATORS = [
         OrValidator(
             Validator('refresh_token', ne="", is_type_of=str),
             Validator('client_id', 'client_secret', 'username', 'password', ne="", is_type_of=str),
@@ -113,6 +308,20 @@ settings = Dynaconf(
                   is_type_of=bool, default=False, messages={"is_test_env": "Invalid '{name}' in the config"}),
         Validator('subreddit',
                   ne="", is_type_of=str, messages={"operations": "You must set '{name}' in the config"}),
+        Validator('extra_subreddits',
+                  is_type_of=list, default=[], messages={"operations": "Invalid '{name}' in the config"}),
+        Validator('trace_sample_rate',
+                  gte=0, lte=1, is_type_of=(int, float), default=0, messages={"operations": "{name} ({value}) must be between 0 and 1 in the config"}),
+        Validator('trace_file',
+                  is_type_of=str, default="data/trace.jsonl.gz", messages={"operations": "Invalid '{name}' in the config"}),
+        Validator('startup_snapshot_file',
+                  is_type_of=str, default="data/startup.json", messages={"operations": "Invalid '{name}' in the config"}),
+        Validator('shard_queue_file',
+                  is_type_of=str, default="", messages={"operations": "Invalid '{name}' in the config"}),
+        Validator('action_queue_file',
+                  is_type_of=str, default="data/actions.sqlite", messages={"operations": "Invalid '{name}' in the config"}),
+        Validator('metrics_port',
+                  gte=0, lte=65535, is_type_of=int, default=0, messages={"operations": "{name} ({value}) must be a port number (or 0 to turn it off) in the config"}),
         Validator('log_file', 'praw_log_file', 'wiki_page', 'local_backup_file',
                   is_type_of=str, messages={"operations": "Invalid '{name}' in the config"}),
         Validator('point_threshold',
@@ -121,8 +330,22 @@ settings = Dynaconf(
                   is_type_of=list, condition=validate_points_config, messages={"condition": "Invalid {name} in the config"}),
         Validator('monitored_subs',
                   is_type_of=list, condition=validate_monitored_subs_config, messages={"condition": "Invalid {name} in the config"}),
+        Validator('autoban_cleared_days',
+                  gte=0, is_type_of=int, default=7, messages={"operations": "{name} ({value}) must be a whole number (or 0 to turn it off) in the config"}),
+        Validator('autoban_cleared_capacity',
+                  gt=0, is_type_of=int, default=10000, messages={"operations": "{name} ({value}) must be at least 1 in the config"}),
         Validator('polls',
                   is_type_of=list, condition=validate_polls_config, default=[], messages={"condition": "Invalid {name} in the config"}),
+        Validator('agents',
+                  is_type_of=dict, condition=validate_components_config("agents"), default={}, messages={"condition": "Invalid {name} in the config"}),
+        Validator('handlers',
+                  is_type_of=dict, condition=validate_components_config("handlers"), default={}, messages={"condition": "Invalid {name} in the config"}),
+        Validator('tb_migration',
+                  is_type_of=bool, default=False, messages={"operations": "{name} ({value}) in the config must be one of: true, false"}),
+        Validator('tb_migration_rate',
+                  gt=0, is_type_of=int, default=30, messages={"operations": "{name} ({value}) must be at least 1 in the config"}),
+        Validator('tb_migration_batch',
+                  gt=0, is_type_of=int, default=200, messages={"operations": "{name} ({value}) must be at least 1 in the config"}),
         Validator('expiration_months', 'modmail_truncate_len',
                   gte=0, is_type_of=int, messages={"operations": "{name} ({value}) must be a whole number (or 0 to turn it off) in in the config"}),
         Validator('autoban_mode',
@@ -135,11 +358,38 @@ settings = Dynaconf(
 CRITICAL, ERROR, WARNING, INFO, DEBUG"""}),
         Validator('dry_run', 'exclude_mods', 'safe_mode', 'custom_point_mod_notes', 'self_moderation_modmail', 'admin_modmail', 'first_time_retroactive_modlog',
                   is_type_of=bool, messages={"operations": "{name} ({value}) in the config must be one of: true, false"}),
-    ]
-)
+]
 
-try:
-    settings.validators.validate()
-except Exception as e:
-    print(e)
-    sys.exit(1)
+
+def load_settings_files(*paths: str) -> Dynaconf:
+    dynaconf = Dynaconf(
+        envvar_prefix="AutobanBOT",
+        settings_files=list(paths),
+        validate_on_update="all",
+        validators=VALIDATORS)
+    try:
+        dynaconf.validators.validate()
+    except Exception as e:
+        print(f"{paths[-1]}: {e}")
+        sys.exit(1)
+    return dynaconf
+
+
+settings = Settings(load_settings_files(SETTINGS_PATH, AUTH_SETTINGS_PATH))
+
+# Each extra sub gets the main settings, overridden by its own settings file (if there's one)
+for subreddit in settings.extra_subreddits:
+    if subreddit.casefold() in (s.casefold() for s in settings.all_subreddits):
+        print(f"r/{subreddit} is already served, ignoring it in extra_subreddits.")
+        continue
+    path = subreddit_settings_path(subreddit)
+    if not os.path.isfile(path):
+        print(f"No settings file for r/{subreddit} ({path}), using the main settings for it.")
+    overrides = {"subreddit": subreddit}
+    root, ext = os.path.splitext(settings.local_backup_file)
+    if settings.local_backup_file != "":
+        overrides["local_backup_file"] = f"{root}.{subreddit}{ext}"  # Each sub has its own data store
+    sub_dynaconf = load_settings_files(SETTINGS_PATH, AUTH_SETTINGS_PATH, path)
+    if sub_dynaconf.as_dict().get("LOCAL_BACKUP_FILE") != settings.local_backup_file:
+        overrides.pop("local_backup_file", None)  # Set in the sub's own file
+    settings.add_subreddit(Settings(sub_dynaconf, (SETTINGS_PATH, AUTH_SETTINGS_PATH, path), overrides, root=settings))
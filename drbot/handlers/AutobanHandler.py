@@ -1,38 +1,53 @@
 from __future__ import annotations
 
+import heapq
 import time
+from collections import namedtuple
 
 import prawcore
-from praw.models import Comment
+from praw.models import Comment, Redditor
 from prawcore import TooManyRequests
 
-from drbot import settings, log, reddit
+from drbot import settings, log, reddit, snapshot, actions
 from drbot.agents import Agent
 from drbot.const.BotConstants import UserStatus
 from drbot.handlers import Handler
-from drbot.stores import MonitoredSubsMap
+from drbot.stores import MonitoredSubsMap, JobQueue, BloomFilter
 from enum import Enum, auto
 
 from drbot.tools.RedditUserUtils import RedditUserUtils
 
 
+# What a history check found, when it ran in a worker: the item in the monitored sub and where to see it
+Trigger = namedtuple("Trigger", ["fullname", "permalink"])
+
+
 class AutobanHandler(Handler[Comment]):
     """
     Scan the comments of the sub and check if the author posted previously in monitored subs.
     Acts on the user if this is the case by either adding a modnote or banning, depending on the configuration for this specific sub.
+
+    Users found in no monitored sub are remembered for autoban_cleared_days in a Bloom filter saved in the DataStore,
+    and skipped until then, restarts included. The filter is emptied when the monitored subs change.
+
+    Bans are gathered while handling the batch and queued together at its end (see run_bans): the modqueue is
+    cleaned in one pass for everyone banned, and the mods get one modmail. All writes go through the ActionQueue,
+which tells the mods about the bans it had to drop.
+
+    With shard_queue_file set, the history checks are handed out to worker processes (see worker.py) through a JobQueue,
+    and the bot works on them too while it waits. The results are collected and acted on here at the end of the batch.
     """
 
-    def _refresh_processing_cache(self):
-        if not self.processed_users_cache or len(self.processed_users_cache) > 4096 or len(self.processed_users_cache) <= 0:
-            self.processed_users_cache = set([])
-            # add the generic account used for communication
-            gen_reddit_name = settings.subreddit + "-ModTeam"
-            self.processed_users_cache.add(gen_reddit_name)
-            self.processed_users_cache.add("AutoModerator")
-            for moderator in reddit().sub.moderator():
-                self.processed_users_cache.add(moderator.name)
-            for trusted_user in settings.trusted_users:
-                self.processed_users_cache.add(trusted_user)
+    # Kind of the history check jobs in the JobQueue
+    JOB_KIND = "autoban"
+    # Seconds the end of a batch waits for its history checks, the ones still running are collected by the next batch
+    COLLECT_TIMEOUT = 60
+
+    def is_exempt(self, username: str) -> bool:
+        """Mods, the sub's ModTeam account, AutoModerator and trusted users are never checked."""
+        return (username in ("AutoModerator", f"{settings.subreddit}-ModTeam")
+                or username in settings.trusted_users
+                or username in reddit().mod_roster)
 
     def setup(self, agent: Agent[Comment]) -> None:
         # Ran once at handler registration in agent
@@ -40,67 +55,115 @@ class AutobanHandler(Handler[Comment]):
         self.processed_users_cache = set([])
         self.monitored_subs_map = MonitoredSubsMap()
         self.user_utils = RedditUserUtils()
-        self._refresh_processing_cache()
         self.banned_users_cache = set([])
         self.watched_users_cache = set([])
         self.ban_list_infos = []
+        self.modqueue_authors = set([])  # Casefolded names of the users whose modqueue items are removed at the end of the batch
+        self.queue = JobQueue(settings.shard_queue_file) if settings.shard_queue_file != "" else None
+        self.queued_checks = {}  # Job id -> username
+        self.cleared_users = None
+        if settings.autoban_cleared_days > 0:
+            self.cleared_users = BloomFilter(settings.autoban_cleared_capacity, settings.autoban_cleared_days * 24 * 60 * 60)
+            if "cleared_users" in self.data_store and self.cleared_users.load(self.data_store["cleared_users"]):
+                log.info(f"Loaded {len(self.cleared_users)} cleared users.")
 
     def start_run(self) -> None:
         # ran at the beginning of each batch
-        log.debug("Invalidating cache if needed.")
-        self._refresh_processing_cache()
         # Refreshed map values from config
         self.monitored_subs_map.refresh_values()
+        if self.cleared_users is not None:
+            subs = snapshot.fingerprint(" ".join(sorted(sub.casefold() for sub in self.monitored_subs_map.subs_map)))
+            if self.data_store.get("cleared_users_subs") != subs:
+                if len(self.cleared_users) > 0:
+                    log.info("The monitored subs changed, forgetting the cleared users.")
+                self.cleared_users.clear()
+                self.data_store["cleared_users_subs"] = subs
         self.processed_users_cache = set([])
         self.banned_users_cache = set([])
         self.watched_users_cache = set([])
         self.ban_list_infos = []
+        self.modqueue_authors = set([])
+        if self.queue is not None:
+            # Checks left over by a batch that didn't finish (e.g. the bot crashed), their items are already processed
+            self.queued_checks = {job.id: job.payload["username"] for job in self.queue.jobs(AutobanHandler.JOB_KIND, settings.subreddit)}
+            if len(self.queued_checks) > 0:
+                log.info(f"Picking up {len(self.queued_checks)} history checks left in the queue.")
 
     def end_run(self):
         # ran at the end of each batch
+        if self.queue is not None:
+            self.collect_queued_checks()
+        if self.cleared_users is not None and self.cleared_users.changed:
+            self.data_store["cleared_users"] = self.cleared_users.to_dict()
+            self.cleared_users.changed = False
+        self.run_bans()
+        self.clear_modqueue()
         if len(self.ban_list_infos) > 0:
             lines = []
             for ban in self.ban_list_infos:
                 line = f"/u/{ban['username']} for [{ban['reason']}] based on trigger [{ban['trigger']}]({ban['trigger']})"
                 lines.append(line)
             body = "\n\n".join(lines)
-            reddit().send_modmail(subject=f"New Autoban actions",
-                                  body=f"These users were automatically banned from your sub: \n\n{body}")
+            actions.modmail(subject=f"New Autoban actions",
+                            body=f"These users were queued to be automatically banned from your sub "
+                                 f"(you'll get another modmail if one of the bans fails): \n\n{body}")
 
     def clear_modqueue_for_user(self, reddit_user):
-        modqueue = reddit().sub.mod.modqueue(limit=None)
-        for item in modqueue:
-            if item.author == reddit_user:
-                item.mod.lock()
-                item.mod.remove(mod_note="AutobanBOT: removed banned user's entry from modqueue")
-                pass
-            pass
+        """Have the items of a user removed from the modqueue at the end of the batch."""
+        self.modqueue_authors.add(str(reddit_user).casefold())
+
+    def clear_modqueue(self) -> None:
+        """Remove the modqueue items of all the users of clear_modqueue_for_user, in one pass over the modqueue."""
+        if len(self.modqueue_authors) == 0:
+            return
+        for item in reddit().sub.mod.modqueue(limit=None):
+            if item.author is not None and item.author.name.casefold() in self.modqueue_authors:
+                actions.lock(item)
+                actions.remove(item, mod_note="AutobanBOT: removed banned user's entry from modqueue")
+        self.modqueue_authors = set([])
+
+    @property
+    def pending_bans(self) -> dict:
+        """Username -> ban waiting for the end of the batch. Kept in the DataStore, which is saved after each item,
+        so bans found before a crash are still carried out though their comments won't be handled again."""
+        return self.data_store.setdefault("pending_bans", {})
+
+    def queue_ban(self, reddit_user, trigger, rule) -> None:
+        """Ban a user at the end of the batch, see run_bans."""
+        if reddit_user.name in self.pending_bans:
+            return
+        self.pending_bans[reddit_user.name] = {"sub_name": rule["sub_name"], "trigger": trigger.permalink}
+        self.banned_users_cache.add(reddit_user.name)
+
+    def run_bans(self) -> None:
+        """Queue the bans of the batch, with their mod notes, to be sent by the ActionQueue."""
+        for username, ban in list(self.pending_bans.items()):
+            sub_name = ban["sub_name"]
+            if self.monitored_subs_map[sub_name] is None:
+                log.warning(f"r/{sub_name} is no longer monitored, not banning u/{username}.")
+                del self.pending_bans[username]
+                continue
+            note = self.monitored_subs_map.get_note(sub_name)
+            log.warning(f"Banning user [{username}] for posting in [{sub_name}]")
+            if actions.ban(username, ban_reason=note,
+                           ban_message="You have been automatically and permanently banned from the sub, if you think this is an error, write us a modmail!"):
+                actions.note(username, self.monitored_subs_map.get_label(sub_name), note)
+                self.clear_modqueue_for_user(username)
+                self.ban_list_infos.append({"username": username, "reason": note, "trigger": ban["trigger"]})
+            # Else already banned
+            del self.pending_bans[username]
 
     def process_user_entries(self, reddit_user, trigger, rule):
-        entries = []
-        for comment in reddit().user(reddit_user).comments(limit=None):
-            if comment.subreddit.display_name == settings.subreddit:
-                entries.append(comment)
-        for post in reddit().user(reddit_user).submissions(limit=None):
-            if post.subreddit.display_name == settings.subreddit:
-                entries.append(post)
-
-        for item in entries:
+        for item in self.user_utils.get_user_entries(reddit_user):
             match self.monitored_subs_map.get_action(rule['sub_name']):
                 case "report":
                     reason = self.monitored_subs_map.get_note(rule['sub_name'])
                     reason += " - trigger sub = /r/"
                     reason += rule['sub_name']
-                    if not settings.dry_run:
-                        item.report(reason=reason)
-                    else:
-                        log.info(f"DRY RUN: Would have reported comment of user {reddit_user.name} with reason [{reason}]")
+                    actions.report(item, reason)
                 case "remove":
-                    if not settings.dry_run:
-                        item.mod.lock()
-                        item.mod.remove(mod_note="AutobanBOT: removed user's entry")
-                    else:
-                        log.info(f"DRY RUN: Would have removed entry of user {reddit_user.name}")
+                    actions.lock(item)
+                    actions.remove(item, mod_note="AutobanBOT: removed user's entry")
 
     def act_on(self, reddit_user, trigger, rule):
         if not self.user_utils.get_user_status(reddit_user) == UserStatus.ACTIVE:
@@ -109,25 +172,7 @@ class AutobanHandler(Handler[Comment]):
         #sub_name = rule['sub_name']
         match self.monitored_subs_map.get_action(rule['sub_name']):
             case "ban":
-                if not settings.dry_run:
-                    try:
-                        log.warning(f"Banning user [{reddit_user.name}] for posting in [{rule['sub_name']}]")
-                        reddit().sub.banned.add(reddit_user.name, ban_reason=self.monitored_subs_map.get_note(rule['sub_name']),
-                                                ban_message="You have been automatically and permanently banned from the sub, if you think this is an error, write us a modmail!")
-                        reddit().sub.mod.notes.create(redditor=reddit_user.name,
-                                                      label=self.monitored_subs_map.get_label(rule['sub_name']),
-                                                      note=self.monitored_subs_map.get_note(rule['sub_name']))
-                        self.clear_modqueue_for_user(reddit_user.name)
-                        self.banned_users_cache.add(reddit_user.name)
-                        self.ban_list_infos.append({
-                            "username": reddit_user.name,
-                            "reason": self.monitored_subs_map.get_note(rule['sub_name']),
-                            "trigger": trigger.permalink
-                        })
-                    except Exception as e:
-                        log.error(f"Failed to ban user [{reddit_user.name}]: {e.message}")
-                else:
-                    log.info(f"DRY RUN : [NOT] banning user [{reddit_user.name}] for posting in [{rule['sub_name']}]")
+                self.queue_ban(reddit_user, trigger, rule)
             case "watch":
                 if reddit_user.name in self.watched_users_cache:
                     log.info(f"User {reddit_user.name} in watched list already, not further action needed")
@@ -167,69 +212,116 @@ class AutobanHandler(Handler[Comment]):
                         return
                 #if manual_retry >= 5:
                     #log.error(f"Failed to recover modnotes for user {reddit_user.name}")
-                if not settings.dry_run:
-                    log.warning(f"Watching user [{reddit_user.name}] for posting in [{rule['sub_name']}], creating note")
-                    manual_retry = 1
-                    while manual_retry >= 1:
-                        try:
-                            reddit().sub.mod.notes.create(redditor=reddit_user.name, label=target_label,
-                                                  note=target_note)
-                            manual_retry = 0
-                        except TooManyRequests as e:
-                            log.warning("Hitting rate limiting during note creation, sleeping")
-                            time.sleep(manual_retry * 10)
-                            manual_retry += 1
-                    self.watched_users_cache.add(reddit_user.name)
-                else:
-                    log.info(f"DRY RUN : watching user [{reddit_user.name}] for posting in [{rule['sub_name']}]")
-            case "report":
+                log.warning(f"Watching user [{reddit_user.name}] for posting in [{rule['sub_name']}], creating note")
+                actions.note(reddit_user.name, target_label, target_note)
+                self.watched_users_cache.add(reddit_user.name)
+            case "report" | "remove":
                 self.process_user_entries(reddit_user, trigger, rule)
             case "modalert":
                 body = f"This modalert was triggered by the user /u/{reddit_user.name} posting in the sub /r/{rule['sub_name']}\n\n"
                 body += f"The comment triggering this alert is the following: [{trigger.permalink}]({trigger.permalink})"
-                reddit().send_modmail(subject=f"New modalert targeting user /u/{reddit_user.name} from /r/{rule['sub_name']}",
-                                      body=body)
+                actions.modmail(subject=f"New modalert targeting user /u/{reddit_user.name} from /r/{rule['sub_name']}",
+                                body=body, key=trigger.fullname)
             case _:
                 log.error(f"Processing unmanaged action {self.monitored_subs_map.get_action(rule['sub_name'])}")
 
 
 
 
+    @staticmethod
+    def find_trigger(monitored_subs_map: MonitoredSubsMap, comment_author: Redditor):
+        """The item of the user in a monitored sub whose rule takes precedence (see MonitoredSubsMap.ACTIONS)
+        and that rule, or None. Submissions and comments are read as one stream, newest first, and paging
+        stops as soon as nothing further down the history could outrank what was found.
+        Only reads, so it can run in a worker process."""
+        if len(monitored_subs_map.subs_map) == 0:
+            return None
+        sub_cache = set([])  # Fullnames of the subs already checked for this user
+        found = None
+        history = heapq.merge(comment_author.submissions.new(limit=250), comment_author.comments.new(limit=250),
+                              key=lambda item: item.created_utc, reverse=True)
+        for item in history:
+            if item.subreddit_id in sub_cache:
+                continue
+            sub_cache.add(item.subreddit_id)
+            rule = monitored_subs_map.match(item)
+            if rule is None:
+                continue
+            log.info(f"Found matching rule for sub {rule['sub_name']} ({rule['action']}) and user {comment_author.name}")
+            if found is None or monitored_subs_map.rank(rule) < monitored_subs_map.rank(found[1]):
+                found = item, rule
+                if monitored_subs_map.rank(rule) == monitored_subs_map.top_rank:
+                    break  # Nothing can take precedence over it
+        return found
+
     def process_user_history(self, comment_author):
         # Check if the user posts in monitored subs
-        sub_cache = set([])
-        # Avoid checking for our subreddit
-        sub_cache.add(settings.subreddit)
-        # Check for submissions in shitty subs (faster than comments in case of positive)
-        for submission in comment_author.submissions.new(limit=250):
-            check = submission.subreddit.display_name
-            # We already checked and processed the sub for this user
-            if check in sub_cache:
-                #log.debug(f"Skipping sub {check} since already processed")
-                continue
-            if submission.subreddit.display_name in self.monitored_subs_map.subs_map:
-                # action = self.monitored_subs_map[comment.subreddit]["action"]
-                log.info(f"Found matching rule for sub {check} and user {comment_author.name}")
-                self.act_on(comment_author, submission,
-                            self.monitored_subs_map.subs_map[submission.subreddit.display_name])
+        found = AutobanHandler.find_trigger(self.monitored_subs_map, comment_author)
+        if found is not None:
+            self.act_on(comment_author, *found)
+        elif self.cleared_users is not None:
+            self.cleared_users.add(comment_author.name)
+
+    def queue_user_history(self, comment_author) -> None:
+        """Leave the history check of a user to the workers, see collect_queued_checks."""
+        job_id = self.queue.put(AutobanHandler.JOB_KIND, settings.subreddit, {"username": comment_author.name})
+        self.queued_checks[job_id] = comment_author.name
+
+    def collect_queued_checks(self) -> None:
+        """Wait for the history checks of the batch, working on them too, and act on what they found.
+        Checks still not done after COLLECT_TIMEOUT are left in the queue for the next batch (see start_run)."""
+        if len(self.queued_checks) == 0:
+            return
+        worker = f"{settings.username or 'bot'}-coordinator"
+        deadline = time.monotonic() + AutobanHandler.COLLECT_TIMEOUT
+        results = {}
+        while True:
+            results.update(self.queue.results([i for i in self.queued_checks if i not in results]))
+            if len(results) == len(self.queued_checks):
                 break
-            else:
-                sub_cache.add(check)
-        # If no submission, check comments
-        for comment in comment_author.comments.new(limit=250):
-            check = comment.subreddit.display_name
-            # We already checked and processed the sub for this user
-            if check in sub_cache:
-                #log.debug(f"Skipping sub {check} since already processed")
-                continue
-            if comment.subreddit.display_name in self.monitored_subs_map.subs_map:
-                # action = self.monitored_subs_map[comment.subreddit]["action"]
-                log.info(f"Found matching rule for sub {check} and user {comment_author.name}")
-                self.act_on(comment_author, comment,
-                            self.monitored_subs_map.subs_map[comment.subreddit.display_name])
+            if time.monotonic() >= deadline:
+                log.info(f"{len(self.queued_checks) - len(results)} history checks aren't done yet, leaving them for the next batch.")
                 break
-            else:
-                sub_cache.add(check)
+            job = self.queue.claim(worker, AutobanHandler.JOB_KIND, settings.subreddit)
+            if job is None:
+                time.sleep(0.2)  # All the remaining ones are being worked on
+                continue
+            try:
+                found = AutobanHandler.find_trigger(self.monitored_subs_map, Redditor(reddit(), job.payload["username"]))
+            except Exception as e:
+                # E.g. the user was suspended since, don't hold up the batch for it
+                log.error(f"History check of u/{job.payload['username']} failed, skipping it: {repr(e)}")
+                self.queue.finish(job.id, None, repr(e))
+                continue
+            self.queue.finish(job.id, AutobanHandler.check_result(found))
+
+        # Act in the order the users were seen
+        failed = self.queue.failed(list(results))
+        for job_id, username in sorted(self.queued_checks.items()):
+            if job_id not in results:
+                continue
+            result = results[job_id]
+            if job_id in failed:
+                continue  # Not cleared, it's checked again next time they post
+            if result is None:
+                if self.cleared_users is not None:
+                    self.cleared_users.add(username)
+                continue
+            rule = self.monitored_subs_map[result["sub_name"]]
+            if rule is None:
+                log.warning(f"r/{result['sub_name']} is no longer monitored, not acting on u/{username}.")
+                continue
+            self.act_on(Redditor(reddit(), username), Trigger(result["fullname"], result["permalink"]), rule)
+        self.queue.delete(list(results))
+        self.queued_checks = {}
+
+    @staticmethod
+    def check_result(found) -> dict | None:
+        """What find_trigger found, as stored in the JobQueue."""
+        if found is None:
+            return None
+        item, rule = found
+        return {"sub_name": rule["sub_name"], "fullname": item.fullname, "permalink": item.permalink}
 
     def handle(self, item: Comment) -> None:
         # Comment was removed, we cannot get the author
@@ -242,6 +334,13 @@ class AutobanHandler(Handler[Comment]):
         # We already processed this user, do nothing
         if comment_author.name in self.processed_users_cache:
             return
+        if self.is_exempt(comment_author.name):
+            self.processed_users_cache.add(comment_author.name)
+            return
+        if self.cleared_users is not None and comment_author.name in self.cleared_users:
+            log.debug(f"u/{comment_author.name} was recently cleared, skipping")
+            self.processed_users_cache.add(comment_author.name)
+            return
         log.debug(f"Checking history for: {comment_author.name}")
         user_status = self.user_utils.get_user_status(comment_author)
         if comment_author.name in self.banned_users_cache:
@@ -259,6 +358,9 @@ class AutobanHandler(Handler[Comment]):
             return
 
         # Check if the user posts in monitored subs
-        self.process_user_history(comment_author)
+        if self.queue is not None:
+            self.queue_user_history(comment_author)
+        else:
+            self.process_user_history(comment_author)
         # user was processed, add to cache to avoid spamming the API
         self.processed_users_cache.add(comment_author.name)
@@ -11,11 +11,12 @@ from drbot.handlers import Handler
 
 
 class ConfigEditHandler(Handler[ModAction]):
+    handled_actions = frozenset({"wikirevise"})
 
     def setup(self, agent: Agent[ModAction]) -> None:
         super().setup(agent)
     def handle(self, item: ModAction) -> None:
-        SETTINGS_PATH = os.path.join(os.path.dirname(__file__), '../../data/settings.toml')
+        SETTINGS_PATH = settings.file  # The main settings file, or the one of the sub if the bot serves several
         SETTINGS_PAGE = f"{settings.wiki_page}/settings"
         # If a removal reason is added, add the violation to the user's record
         if item.action == "wikirevise":
@@ -26,5 +27,6 @@ class ConfigEditHandler(Handler[ModAction]):
                 with open(SETTINGS_PATH, "w") as f:
                     rem_settings = tomlkit.parse(data)
                     f.write(tomlkit.dumps(rem_settings))
+                settings.reload()
 
 
@@ -11,6 +11,10 @@ class Handler(ABC, Generic[T]):
     """For use with Agents.
     Scans incoming items entries one at a time."""
 
+    # Kinds of items the handler wants (e.g. modlog actions, see HandlerAgent.route), None for all of them.
+    # The agent only passes it those, and can ask reddit for those only.
+    handled_actions: frozenset[str] | None = None
+
     def __init__(self, name: Optional[str] = None):
         if name is None:  # By default, the name is just the class name
             name = self.__class__.__name__
@@ -17,6 +17,7 @@ from drbot.const.BotConstants import UserStatus
 from drbot.handlers import Handler
 import re
 from drbot.tools import ToolBoxUtils
+from drbot.tools.ModNotesMigrator import ModNotesMigrator
 from drbot.tools.RedditUserUtils import RedditUserUtils
 
 
@@ -27,17 +28,26 @@ class ModNotesHandler(Handler[ModAction]):
     Aims to create a TB note when a new modnote is created via new
     """
 
+    handled_actions = frozenset({"wikirevise", "addnote"})
+
     def setup(self, agent: Agent[ModAction]) -> None:
         super().setup(agent)
         self.tb_manipulator = ToolBoxUtils.ToolBoxManipulator(reddit(), settings.username)
         self.user_utils = RedditUserUtils()
         self.cache = set([])
         self.mod_notes = {}
+        self.migrator = ModNotesMigrator(self.tb_manipulator, self)
+        self.pending_tb_users = set([])
 
     def start_run(self) -> None:
         log.debug("Invalidating cache")
         #self.cache = {}
         self.tb_manipulator.refresh_tb()
+        # pending_tb_users is kept: it holds the users whose notes couldn't be written back in the last batch
+
+    def end_run(self) -> None:
+        if len(self.pending_tb_users) > 0:
+            self.write_back_to_tb()
 
     @staticmethod
     def is_tb_note_action(item) -> bool:
@@ -70,39 +80,6 @@ class ModNotesHandler(Handler[ModAction]):
                 log.warning(f"Action not recognized on TB note action [{item.description}]")
                 return "", ""
 
-    def is_tb_in_modnote(self, tb_note: dict, modnotes) -> bool:
-        target_owner = self.tb_manipulator.get_note_owner(tb_note)
-        target_label = self.tb_manipulator.get_note_modnote_label(tb_note)
-        target_note = self.tb_manipulator.get_note_content(tb_note)
-        target_datetime = self.tb_manipulator.get_note_date(tb_note)
-        target_date = f"{target_datetime}"
-        for modnote in modnotes:
-            if modnote is None:
-                # can return None even in iterator
-                return False
-            if modnote.label == target_label:
-                # Either the note was manually created by user (rare) or was transferred by bot
-                if modnote.moderator.name == target_owner:
-                    if target_note == modnote.note:
-                        # Matching note found, skip this tb_note
-                        return True
-                else:
-                    # Note was created by bot, check if the note content mentions the text and mod name
-                    if target_note in modnote.note and target_owner in modnote.note and target_date in modnote.note:
-                        # Matching note found, skip this tb_note
-                        return True
-                    # Old format was not starting with date but with owner
-                    if target_note in modnote.note and modnote.note.startswith(target_owner):
-                        return True
-        return False
-
-    def get_user_modnotes(self, username):
-        notes = []
-        for note in reddit().sub.mod.notes.redditors(username, all_notes=True, params={"filter": "NOTE"}):
-            notes.append(note)
-        return notes
-
-
     def handle_tb_action(self, item: ModAction):
         type, username = self.extract_type_and_username_from_tb_action(item)
         if len(username) <= 0:
@@ -120,45 +97,92 @@ class ModNotesHandler(Handler[ModAction]):
                 f"Retrieved unwanted status {user_status.name} for user {username}, dropping modnote processing")
             return
         if type == "create":
-            usernotes_tb = self.tb_manipulator.get_user_notes(username)
-            manual_retry = 1
-            while manual_retry >= 1:
-                try:
-                    usernotes_reddit = self.get_user_modnotes(username)
-                    manual_retry = 0
-                except TooManyRequests as e:
-                    log.warning("Hitting rate limiting while fetching user notes, sleeping")
-                    time.sleep(manual_retry * 10)
-                    manual_retry += 1
-            for tb_note in usernotes_tb:
-                if self.is_tb_in_modnote(tb_note, usernotes_reddit):
-                    # Found match, nothing to do
-                    log.debug("Found matching note, checking next entry")
-                    continue
-                else:
-                    # Need to create the note in reddit
-                    redditor = username
-                    label = self.tb_manipulator.get_note_modnote_label(tb_note)
-                    date_s = self.tb_manipulator.get_note_date(tb_note)
-                    note = f"{date_s} | {self.tb_manipulator.get_note_owner(tb_note)} | {self.tb_manipulator.get_note_content(tb_note)}"
-                    thing = self.tb_manipulator.get_note_modnote_target(tb_note)
-                    log.info(
-                        f"Creating mod note in new reddit from tb_note - user [{redditor}] label [{label}] content [{note}]")
-                    manual_retry = 1
-                    while manual_retry >= 1:
-                        try:
-                            reddit().sub.mod.notes.create(redditor=redditor, label=label,
-                                                          note=note, thing=thing)
-                            manual_retry = 0
-                        except TooManyRequests as e:
-                            log.warning("Hitting rate limiting during note creation, sleeping")
-                            time.sleep(manual_retry * 10)
-                            manual_retry += 1
+            self.migrator.migrate_user(username)
         elif type == "delete":
             # todo
             pass
 
 
+    def get_missing_tb_notes(self, username: str) -> list:
+        """Manual mod notes of a user that have no counterpart in TB."""
+        tb_index = set([])
+        for tb_note in self.tb_manipulator.get_user_notes(username):
+            tb_index.update(self.tb_manipulator.get_note_fingerprints(tb_note))
+        missing = []
+        for modnote in self.migrator.get_user_modnotes(username):
+            if modnote is None or modnote.moderator is None:
+                continue
+            # Notes made by the bot are either copies of TB notes or its own actions
+            if modnote.moderator.name == settings.username:
+                continue
+            if self.tb_manipulator.get_modnote_fingerprint(modnote) not in tb_index:
+                missing.append(modnote)
+        return missing
+
+    def write_back_to_tb(self) -> None:
+        """Merge the new mod notes of this batch into TB and commit them as a single wiki revision.
+        The revision is written against the one TB was loaded from, so concurrent edits are detected and merged again.
+        pending_tb_users is only emptied once the notes are saved, so a failed write is tried again next batch."""
+        missing = {}
+        for username in self.pending_tb_users:
+            notes = self.get_missing_tb_notes(username)
+            if len(notes) > 0:
+                missing[username] = notes
+        count = sum(len(notes) for notes in missing.values())
+        if count == 0:
+            log.debug("No new mod note to write back to TB")
+            self.pending_tb_users = set([])
+            return
+        links = {}
+        for notes in missing.values():
+            for modnote in notes:
+                if modnote.reddit_id not in links:
+                    links[modnote.reddit_id] = self.tb_manipulator.get_tb_link_from_fullname(modnote.reddit_id)
+
+        for attempt in range(1, 4):
+            for username, notes in missing.items():
+                known = set([])
+                for tb_note in self.tb_manipulator.get_user_notes(username):
+                    known.update(self.tb_manipulator.get_note_fingerprints(tb_note))
+                for modnote in notes:
+                    # Someone may have added the same note to TB while we were merging
+                    if self.tb_manipulator.get_modnote_fingerprint(modnote) in known:
+                        continue
+                    self.tb_manipulator.add_user_note(username, modnote.moderator.name, modnote.created_at,
+                                                      modnote.label, modnote.note, links[modnote.reddit_id])
+            if settings.dry_run:
+                log.info(f"DRY RUN: would have written {count} mod notes of {len(missing)} users back to TB")
+                self.tb_manipulator.refresh_tb()
+                self.pending_tb_users = set([])
+                return
+            try:
+                self.tb_manipulator.save_tb(reason=f"AutobanBOT: sync of {count} mod notes from new reddit")
+            except prawcore.exceptions.Conflict:
+                log.warning(f"TB usernotes were edited during the write back, merging again ({attempt}/3)")
+                self.tb_manipulator.refresh_tb()
+                continue
+            except Exception as e:
+                # Drop the notes merged in memory, or they'd look written back to get_missing_tb_notes
+                self.tb_manipulator.refresh_tb()
+                self.pending_tb_users.update(missing)
+                log.error(f"Failed to write {count} mod notes back to TB, retrying at the end of the next batch: {repr(e)}")
+                return
+            log.info(f"Wrote {count} mod notes of {len(missing)} users back to TB")
+            self.pending_tb_users = set([])
+            return
+        self.pending_tb_users.update(missing)
+        log.error(f"Failed to write {count} mod notes back to TB after 3 conflicting edits, retrying at the end of the next batch")
+
+    def migrate_all(self) -> None:
+        """Bulk copy of every Toolbox note to mod notes, a slice at a time.
+        Meant to be scheduled, resumes from the checkpoint saved in the data store."""
+        if not settings.tb_migration:
+            return
+        if self.migrator.checkpoint["done"]:
+            log.debug("Toolbox to mod notes migration already done")
+            return
+        self.migrator.run(rate=settings.tb_migration_rate, batch_size=settings.tb_migration_batch)
+
     def handle(self, item: ModAction) -> None:
         # Assume that the bot handle note creation correctly and doesn't need to process its own entries
         if item.mod.name == settings.username:
@@ -173,12 +197,5 @@ class ModNotesHandler(Handler[ModAction]):
 
             # Process a new modnote entry (new modnote)
             case "addnote":
-                # Fetch tb of target user
-                # check for duplicate
-                # if yes, do nothing
-                # else
-                # build new TB array with new note
-                # if note type or modo does not exist, create in constants array
-                # replace user TB in full TB
-                # save TB to wiki
-                pass
+                # Notes are merged into TB once per batch in end_run
+                self.pending_tb_users.add(item.target_author)
@@ -2,7 +2,7 @@ from __future__ import annotations
 
 from praw.models import ModAction, Redditor
 
-from drbot import settings, log, reddit
+from drbot import settings, log, reddit, actions
 from drbot.agents import Agent
 from drbot.const.BotConstants import UserStatus
 from drbot.handlers import Handler
@@ -10,6 +10,8 @@ from drbot.tools.RedditUserUtils import RedditUserUtils
 
 
 class ModQueueCleanerHandler(Handler[ModAction]):
+    handled_actions = frozenset({"banuser"})
+
     def setup(self, agent: Agent[ModAction]) -> None:
         super().setup(agent)
         # Ran once at handler registration in agent
@@ -20,39 +22,51 @@ class ModQueueCleanerHandler(Handler[ModAction]):
     def start_run(self) -> None:
         log.debug("Invalidating cache")
         self.cache = set([])
+        # Wipes interrupted by a crash or restart
+        for username in list(self.data_store.get("wipes", [])):
+            log.info(f"Resuming the wipe of u/{username}")
+            try:
+                self.wipe_user_entries(reddit().redditor(username))
+            except Exception as e:
+                # Keep it checkpointed for the next batch, reddit may be having a moment, and let this batch go on
+                log.error(f"Couldn't resume the wipe of u/{username}, trying again next batch: {repr(e)}")
 
     def wipe_user_entries(self, reddit_user: Redditor):
+        """Remove all the entries of a user in the sub, through the ActionQueue.
+        The wipe is checkpointed in the data store until all the removals are queued, so it resumes after a crash."""
         log.info(f"Wiping history of user {reddit_user.name}")
-        entries = []
         if reddit_user.name == "[deleted]":
             log.warn("Should have removed user contrib but user has deleted its account")
+            self.end_wipe(reddit_user.name)
             return
         user_status = self.user_utils.get_user_status(reddit_user)
         if user_status is UserStatus.SUSPENDED or user_status is UserStatus.UNEXPECTED or user_status is UserStatus.SHADOWBANNED:
             log.warn("Should have removed user contrib but user has wrong status")
+            self.end_wipe(reddit_user.name)
             return
-        for comment in reddit_user.comments.new(limit=None):
-            if comment.subreddit.display_name == settings.subreddit:
-                entries.append(comment)
-        for post in reddit_user.submissions.new(limit=None):
-            if post.subreddit.display_name == settings.subreddit:
-                entries.append(post)
+        wipes = self.data_store.setdefault("wipes", [])
+        if reddit_user.name not in wipes:
+            wipes.append(reddit_user.name)
 
+        entries = self.user_utils.get_user_entries(reddit_user)
+        log.info(f"Removing {len(entries)} entries of u/{reddit_user.name}")
         for item in entries:
-            if not settings.dry_run:
-                if not item.locked and item.archived is False:
-                    item.mod.lock()
-                item.mod.remove(mod_note="AutobanBOT (botwipe): removed user's entry after permaban")
-            else:
-                log.info(f"DRY RUN: Would have removed entry of user {reddit_user.name}")
+            if not item.locked and item.archived is False:
+                actions.lock(item)
+            actions.remove(item, mod_note="AutobanBOT (botwipe): removed user's entry after permaban")
+        self.end_wipe(reddit_user.name)
+
+    def end_wipe(self, username: str) -> None:
+        if username in self.data_store.get("wipes", []):
+            self.data_store["wipes"].remove(username)
 
     def clear_modqueue_for_user(self, reddit_user):
         modqueue = reddit().sub.mod.modqueue(limit=None)
         for item in modqueue:
             if item.author == reddit_user:
                 if not item.locked and item.archived is False:
-                    item.mod.lock()
-                item.mod.remove(mod_note="AutobanBOT: removed banned user's entry from modqueue")
+                    actions.lock(item)
+                actions.remove(item, mod_note="AutobanBOT: removed banned user's entry from modqueue")
                 pass
             pass
 
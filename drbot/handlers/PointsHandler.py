@@ -4,19 +4,23 @@ from praw.models import ModAction
 from copy import deepcopy
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
-from drbot import settings, log, reddit
+from drbot import settings, log, reddit, actions
 from drbot.stores import PointMap
 from drbot.agents import Agent
 from drbot.handlers import Handler
 
 
 class PointsHandler(Handler[ModAction]):
+    handled_actions = frozenset({"addremovalreason", "approvecomment", "unbanuser"})
+
     def setup(self, agent: Agent[ModAction]) -> None:
         super().setup(agent)
         self.point_map = PointMap()
 
     def start_run(self) -> None:
         log.info("Starting point recalculation")
+        # Only rebuilds if the settings changed
+        self.point_map.refresh_values()
 
     def end_run(self) -> None:
         log.info("Stopping point recalculation")
@@ -212,7 +216,7 @@ class PointsHandler(Handler[ModAction]):
         log.info(f"Starting full scan ({len(users)} users).")
 
         if settings.exclude_mods:
-            mods = set(mod.name for mod in reddit().sub.moderator())
+            mods = set(reddit().mod_roster.names())
             for mod in mods:
                 if mod in users and self.remove_user(mod):
                     log.info(f"Wiped record of u/{mod} because they're a mod.")
@@ -270,8 +274,8 @@ class PointsHandler(Handler[ModAction]):
             message += f"{'A' if settings.autoban_mode >= 2 else 'No'} ban has been issued."
 
             # Send modmail
-            reddit().send_modmail(subject=f"{'Ban' if settings.autoban_mode >= 2 else 'Point'} alert for u/{username}",
-                                  body=message)
+            actions.modmail(subject=f"{'Ban' if settings.autoban_mode >= 2 else 'Point'} alert for u/{username}",
+                            body=message, key=f"{username.casefold()}/{','.join(sorted(self.data_store[username]['violations']))}")
 
         # Handle autoban
         if settings.autoban_mode in [2, 3]:
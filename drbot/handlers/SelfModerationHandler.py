@@ -2,7 +2,7 @@ from __future__ import annotations
 import praw
 from praw.models import ModAction, Comment
 from datetime import datetime
-from drbot import settings, log, reddit
+from drbot import settings, log, reddit, actions
 from drbot.agents import Agent
 from drbot.handlers import Handler
 
@@ -11,6 +11,8 @@ class SelfModerationHandler(Handler[ModAction]):
     """Scans the modlog for instances of moderators moderating their own comments,
     comments on their posts, or comments in the reply tree below their own comments."""
 
+    handled_actions = frozenset({"removecomment", "approvecomment", "approvelink"})
+
     def setup(self, agent: Agent[ModAction]) -> None:
         super().setup(agent)
         self.cache = {}
@@ -51,8 +53,9 @@ class SelfModerationHandler(Handler[ModAction]):
         if self_moderation:
             log.warning(f"Self-moderation detected by u/{item._mod} in {item.target_fullname} on {datetime.fromtimestamp(item.created_utc)}")
             if settings.self_moderation_modmail:
-                reddit().send_modmail(subject=f"Self-moderation by u/{item._mod}",
-                                      body=f"On {datetime.fromtimestamp(item.created_utc)}, u/{item._mod} {'removed' if item.action == 'removecomment' else 'approved'} [this {'comment' if item.target_fullname.startswith('t1_') else 'post'}](https://reddit.com{item.target_permalink}) despite being involved upstream of it.")
+                actions.modmail(subject=f"Self-moderation by u/{item._mod}",
+                                body=f"On {datetime.fromtimestamp(item.created_utc)}, u/{item._mod} {'removed' if item.action == 'removecomment' else 'approved'} [this {'comment' if item.target_fullname.startswith('t1_') else 'post'}](https://reddit.com{item.target_permalink}) despite being involved upstream of it.",
+                                key=item.id)
 
     def is_self_moderated(self, mod: str, fullname: str, skip_first: bool = True):
         """Scans a given object and its parents for any instances of the given mod as an author."""
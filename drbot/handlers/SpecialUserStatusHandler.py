@@ -6,7 +6,7 @@ import prawcore
 from praw.models import Comment
 from prawcore import TooManyRequests
 
-from drbot import settings, log, reddit
+from drbot import settings, log, reddit, metrics, actions
 from drbot.agents import Agent
 from drbot.const.BotConstants import UserStatus
 from drbot.handlers import Handler
@@ -48,6 +48,7 @@ class SpecialUserStatusHandler(Handler[Comment]):
             log.info(f"Item {item.permalink} has no author, dropping")
             return
         # We already processed this user, do nothing
+        metrics.record_cache("user_status", comment_author.name in self.user_cache)
         if comment_author.name not in self.user_cache:
             log.debug(f"Checking status for: {comment_author.name}")
             user_status = self.user_utils.get_user_status(comment_author)
@@ -56,9 +57,6 @@ class SpecialUserStatusHandler(Handler[Comment]):
         match self.user_cache[comment_author.name]:
             case UserStatus.SHADOWBANNED:
                 reason = f"User {comment_author.name} has posted while being shadowbanned"
-                if not settings.dry_run:
-                    log.info(f"Sending report for user {comment_author.name} on comment {item.permalink}")
-                    item.report(reason=reason)
-                else:
-                    log.info(f"DRY RUN: Would have reported comment of user {comment_author.name} with reason [{reason}]")
+                log.info(f"Reporting comment {item.permalink} of user {comment_author.name}")
+                actions.report(item, reason)
 
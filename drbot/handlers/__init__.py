@@ -1,12 +1,31 @@
+from importlib import import_module
 from drbot.handlers.Handler import Handler
-from drbot.handlers.AdminHandler import AdminHandler
-from drbot.handlers.PointsHandler import PointsHandler
-from drbot.handlers.SelfModerationHandler import SelfModerationHandler
-from drbot.handlers.ModmailMobileLinkHandler import ModmailMobileLinkHandler
-from drbot.handlers.AutobanHandler import AutobanHandler
-from drbot.handlers.ConfigEditHandler import ConfigEditHandler
-from drbot.handlers.ModNotesHandler import ModNotesHandler
-from drbot.handlers.PollHandler import PollHandler
-from drbot.handlers.ConstantPollingHandler import ConstantPollingHandler
-from drbot.handlers.ModQueueCleanerHandler import ModQueueCleanerHandler
-from drbot.handlers.SpecialUserStatusHandler import SpecialUserStatusHandler
+
+# Handlers are loaded on first use (PEP 562), so only the ones the bot registers are imported
+_LAZY = {name: f"drbot.handlers.{name}" for name in [
+    "AdminHandler",
+    "PointsHandler",
+    "SelfModerationHandler",
+    "ModmailMobileLinkHandler",
+    "AutobanHandler",
+    "ConfigEditHandler",
+    "ModNotesHandler",
+    "PollHandler",
+    "ConstantPollingHandler",
+    "ModQueueCleanerHandler",
+    "SpecialUserStatusHandler",
+]}
+
+__all__ = ["Handler"] + list(_LAZY)
+
+
+def __getattr__(name: str):
+    if name in _LAZY:
+        value = getattr(import_module(_LAZY[name]), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY))
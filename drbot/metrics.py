@@ -0,0 +1,309 @@
+from __future__ import annotations
+
+import json
+import re
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+from drbot import log
+from drbot.tracing import tracer
+
+# Turn request URLs into endpoint templates, so names and IDs don't each get their own time series
+ENDPOINT_PATTERNS = [
+    (re.compile(r"^r/[^/]+"), "r/{subreddit}"),
+    (re.compile(r"^(user|u)/[^/]+"), "user/{user}"),
+    (re.compile(r"(^|/)comments/[^/]+(/[^/]+)?"), r"\1comments/{id}"),
+    (re.compile(r"/by_id/[^/]+"), "/by_id/{ids}"),
+    (re.compile(r"^r/\{subreddit\}/wiki/(settings/|revisions/)?[^/].*$"), r"r/{subreddit}/wiki/\1{page}"),
+    (re.compile(r"/conversations/[^/]+"), "/conversations/{id}"),
+    (re.compile(r"/removal_reasons/[^/]+"), "/removal_reasons/{id}"),
+]
+
+# Description of the gauges set with Metrics.set_gauge
+GAUGES = {
+    "agent_lag_seconds": "Time between the newest item an agent fetched and the last one it had processed.",
+    "agent_last_processed_timestamp_seconds": "Creation time of the last item processed by each agent.",
+    "datastore_bytes": "Size of the serialized data store.",
+    "pending_actions": "Moderation actions waiting to be sent to reddit, see drbot/actions.py.",
+}
+
+# Bucket upper bounds of the batch duration histogram, in seconds
+BATCH_SECONDS_BUCKETS = [0.5, 1, 2, 5, 10, 30, 60, 120, 300]
+
+
+def endpoint(method: str, url: str) -> str:
+    """E.g. ("GET", "https://oauth.reddit.com/r/foo/about/log?limit=100") -> "GET r/{subreddit}/about/log\"."""
+    path = urlparse(url).path.strip("/")
+    for pattern, template in ENDPOINT_PATTERNS:
+        path = pattern.sub(template, path)
+    return f"{method.upper()} {path}"
+
+
+def _labels(labels: dict) -> str:
+    if len(labels) == 0:
+        return ""
+    escaped = {k: str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for k, v in labels.items()}
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped.items()) + "}"
+
+
+class Usage:
+    """Resources spent by one scope: wall time, reddit requests, bytes received and time slept waiting on reddit."""
+
+    __slots__ = ("calls", "seconds", "max_seconds", "requests", "bytes", "rate_limit_sleep", "retry_sleep")
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.requests = 0
+        self.bytes = 0
+        self.rate_limit_sleep = 0.0
+        self.retry_sleep = 0.0
+
+    def add(self, other: Usage) -> None:
+        self.calls += other.calls
+        self.seconds += other.seconds
+        self.max_seconds = max(self.max_seconds, other.max_seconds)
+        self.requests += other.requests
+        self.bytes += other.bytes
+        self.rate_limit_sleep += other.rate_limit_sleep
+        self.retry_sleep += other.retry_sleep
+
+    def to_dict(self) -> dict:
+        return {"calls": self.calls, "seconds": round(self.seconds, 4), "max_seconds": round(self.max_seconds, 4),
+                "requests": self.requests, "bytes": self.bytes,
+                "rate_limit_sleep": round(self.rate_limit_sleep, 4), "retry_sleep": round(self.retry_sleep, 4)}
+
+
+class Batch:
+    """Usage of each handler of an agent during one batch."""
+
+    def __init__(self, agent: str) -> None:
+        self.agent = agent
+        self.started = time.time()
+        self.items = 0
+        self.seconds = 0.0
+        self.usage = {}
+
+    def get(self, name: str) -> Usage:
+        if name not in self.usage:
+            self.usage[name] = Usage()
+        return self.usage[name]
+
+    def measure(self, name: str):
+        """Charge everything done in the block to the handler (or agent) called name."""
+        return metrics.measure(self.get(name), name)
+
+    def total(self) -> Usage:
+        total = Usage()
+        for usage in self.usage.values():
+            total.add(usage)
+        return total
+
+    def summary(self) -> str:
+        """One line for the log, handlers sorted by cost."""
+        total = self.total()
+        line = f"{self.agent} batch: {self.items} items in {self.seconds:.2f}s, {total.requests} requests, {total.bytes / 1024:.0f} KB"
+        if total.rate_limit_sleep + total.retry_sleep >= 0.1:
+            line += f", {total.rate_limit_sleep + total.retry_sleep:.1f}s waiting on reddit"
+        parts = []
+        for name, usage in sorted(self.usage.items(), key=lambda u: (u[1].requests, u[1].seconds), reverse=True):
+            share = f" ({usage.requests / total.requests:.0%})" if total.requests > 0 else ""
+            parts.append(f"{name} {usage.seconds:.2f}s {usage.requests} req{share}")
+        if len(parts) > 0:
+            line += " | " + ", ".join(parts)
+        return line
+
+    def to_dict(self) -> dict:
+        return {"agent": self.agent, "started": self.started, "items": self.items, "seconds": round(self.seconds, 4),
+                "handlers": {name: usage.to_dict() for name, usage in self.usage.items()}}
+
+
+class Metrics:
+    """Where the bot's time and request budget goes.
+    Requests and sleeps are counted at the prawcore level (see drbot/reddit.py) and charged to the scope that is active
+    in the current thread, which HandlerAgent sets around every handler call."""
+
+    # Batches kept for export
+    HISTORY = 100
+
+    def __init__(self) -> None:
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.batches = deque(maxlen=Metrics.HISTORY)
+        self.totals = {}
+        self.unscoped = Usage()
+        self.requests = Counter()  # (endpoint, status) -> count
+        self.cache = Counter()  # (cache, "hit" or "miss") -> count
+        self.gauges = {}  # (name, labels) -> value
+        self.batch_buckets = {}  # agent -> count per bucket of BATCH_SECONDS_BUCKETS (+Inf last)
+        self.jobs = {}  # job -> {"runs", "seconds", "overruns"}
+        self._server = None
+
+    def _current(self) -> Usage:
+        return getattr(self._local, "usage", None) or self.unscoped
+
+    @property
+    def scope(self) -> str | None:
+        """Name of the handler (or agent) currently being measured in this thread."""
+        return getattr(self._local, "scope", None)
+
+    @contextmanager
+    def measure(self, usage: Usage, scope: str | None = None):
+        """Charge everything done in the block, in this thread, to usage."""
+        previous, previous_scope = getattr(self._local, "usage", None), self.scope
+        self._local.usage, self._local.scope = Usage(), scope
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            spent = self._local.usage
+            spent.calls = 1
+            spent.seconds = spent.max_seconds = time.perf_counter() - start
+            self._local.usage, self._local.scope = previous, previous_scope
+            with self._lock:
+                usage.add(spent)
+
+    def record_request(self, method: str, url: str, status: int, size: int) -> None:
+        usage = self._current()
+        usage.requests += 1
+        usage.bytes += size
+        with self._lock:
+            self.requests[(endpoint(method, url), status)] += 1
+
+    def record_rate_limit_sleep(self, seconds: float) -> None:
+        self._current().rate_limit_sleep += seconds
+
+    def record_retry_sleep(self, seconds: float) -> None:
+        self._current().retry_sleep += seconds
+
+    def record_cache(self, cache: str, hit: bool) -> None:
+        with self._lock:
+            self.cache[(cache, "hit" if hit else "miss")] += 1
+
+    def set_gauge(self, name: str, value: float, **labels) -> None:
+        """Current value of something, e.g. set_gauge("agent_lag_seconds", 12.5, agent="ModlogAgent")."""
+        with self._lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def record_job(self, job: str, seconds: float, overrun: bool) -> None:
+        """A scheduler job ran. It overran if it took longer than its interval."""
+        with self._lock:
+            stats = self.jobs.setdefault(job, {"runs": 0, "seconds": 0.0, "overruns": 0})
+            stats["runs"] += 1
+            stats["seconds"] += seconds
+            stats["overruns"] += int(overrun)
+
+    def end_batch(self, batch: Batch) -> str:
+        """Store a finished batch and add it to the totals. Returns its summary line."""
+        with self._lock:
+            self.batches.append(batch)
+            buckets = self.batch_buckets.setdefault(batch.agent, [0] * (len(BATCH_SECONDS_BUCKETS) + 1))
+            buckets[next((i for i, bound in enumerate(BATCH_SECONDS_BUCKETS) if batch.seconds <= bound), -1)] += 1
+            totals = self.totals.setdefault(batch.agent, {"batches": 0, "items": 0, "seconds": 0.0, "handlers": {}})
+            totals["batches"] += 1
+            totals["items"] += batch.items
+            totals["seconds"] += batch.seconds
+            for name, usage in batch.usage.items():
+                totals["handlers"].setdefault(name, Usage()).add(usage)
+        return batch.summary()
+
+    def export(self) -> dict:
+        """Totals per agent and handler since startup, and the latest batches."""
+        with self._lock:
+            return {
+                "agents": {agent: {"batches": t["batches"], "items": t["items"], "seconds": round(t["seconds"], 4),
+                                   "handlers": {name: usage.to_dict() for name, usage in t["handlers"].items()}}
+                           for agent, t in self.totals.items()},
+                "unscoped": self.unscoped.to_dict(),
+                "batches": [batch.to_dict() for batch in self.batches],
+            }
+
+    def openmetrics(self) -> str:
+        """Everything in the OpenMetrics text format, for Prometheus."""
+        lines = []
+
+        def family(name: str, kind: str, help: str, samples: list[tuple[str, dict, float]]) -> None:
+            lines.append(f"# TYPE drbot_{name} {kind}")
+            lines.append(f"# HELP drbot_{name} {help}")
+            for suffix, labels, value in samples:
+                lines.append(f"drbot_{name}{suffix}{_labels(labels)} {value}")
+
+        with self._lock:
+            handlers = [(agent, name, usage) for agent, t in self.totals.items() for name, usage in t["handlers"].items()]
+            family("batches", "counter", "Batches processed by each agent.",
+                   [("_total", {"agent": a}, t["batches"]) for a, t in self.totals.items()])
+            family("items", "counter", "Items processed by each agent.",
+                   [("_total", {"agent": a}, t["items"]) for a, t in self.totals.items()])
+            samples = []
+            for agent, buckets in self.batch_buckets.items():
+                cumulative = 0
+                for bound, count in zip(BATCH_SECONDS_BUCKETS + ["+Inf"], buckets):
+                    cumulative += count
+                    samples.append(("_bucket", {"agent": agent, "le": bound}, cumulative))
+                samples.append(("_count", {"agent": agent}, cumulative))
+                samples.append(("_sum", {"agent": agent}, round(self.totals[agent]["seconds"], 4)))
+            family("batch_seconds", "histogram", "Duration of the batches of each agent.", samples)
+            family("handler_seconds", "counter", "Time spent in each handler.",
+                   [("_total", {"agent": a, "handler": h}, round(u.seconds, 4)) for a, h, u in handlers])
+            family("handler_requests", "counter", "Reddit requests made by each handler.",
+                   [("_total", {"agent": a, "handler": h}, u.requests) for a, h, u in handlers])
+            family("reddit_requests", "counter", "Reddit requests by endpoint and status.",
+                   [("_total", {"endpoint": e, "status": s}, n) for (e, s), n in sorted(self.requests.items())])
+            family("reddit_rate_limited", "counter", "Reddit requests answered with 429 Too Many Requests.",
+                   [("_total", {}, sum(n for (e, s), n in self.requests.items() if s == 429))])
+            usages = [u for a, h, u in handlers] + [self.unscoped]
+            family("reddit_rate_limit_sleep_seconds", "counter", "Time spent waiting for reddit's rate limit.",
+                   [("_total", {}, round(sum(u.rate_limit_sleep for u in usages), 4))])
+            family("reddit_retry_sleep_seconds", "counter", "Time spent backing off before retrying failed requests.",
+                   [("_total", {}, round(sum(u.retry_sleep for u in usages), 4))])
+            family("reddit_received_bytes", "counter", "Bytes received from reddit.",
+                   [("_total", {}, sum(u.bytes for u in usages))])
+            family("cache_requests", "counter", "Cache lookups by result.",
+                   [("_total", {"cache": c, "result": r}, n) for (c, r), n in sorted(self.cache.items())])
+            family("job_runs", "counter", "Runs of each scheduled job.",
+                   [("_total", {"job": j}, stats["runs"]) for j, stats in self.jobs.items()])
+            family("job_seconds", "counter", "Time spent in each scheduled job.",
+                   [("_total", {"job": j}, round(stats["seconds"], 4)) for j, stats in self.jobs.items()])
+            family("job_overruns", "counter", "Runs of each scheduled job that took longer than its interval.",
+                   [("_total", {"job": j}, stats["overruns"]) for j, stats in self.jobs.items()])
+            for name in sorted(set(name for name, labels in self.gauges)):
+                family(name, "gauge", GAUGES.get(name, name),
+                       [("", dict(labels), value) for (n, labels), value in self.gauges.items() if n == name])
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int) -> None:
+        """Serve openmetrics() on http://<host>:port/metrics from a background thread."""
+        if self._server is not None:
+            return
+        self._server = ThreadingHTTPServer(("", port), _MetricsRequestHandler)
+        threading.Thread(target=self._server.serve_forever, name="metrics", daemon=True).start()
+        log.info(f"Serving metrics on port {port}.")
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path in ("/metrics", "/"):
+            body, content_type = metrics.openmetrics().encode(), "application/openmetrics-text; version=1.0.0; charset=utf-8"
+        elif path == "/trace":
+            # Latest traced requests, in the same format as the trace files
+            body, content_type = "".join(json.dumps(t) + "\n" for t in tracer.recent()).encode(), "application/x-ndjson"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.debug(f"Metrics request: {format % args}")
+
+
+metrics = Metrics()
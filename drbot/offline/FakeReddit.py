@@ -0,0 +1,616 @@
+from __future__ import annotations
+
+import json
+import re
+import threading
+import time
+from bisect import bisect_right
+from collections import Counter
+from typing import Any
+from urllib.parse import urlparse
+
+
+def _base36(n: int) -> str:
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    s = ""
+    while n:
+        n, r = divmod(n, 36)
+        s = digits[r] + s
+    return s or "0"
+
+
+class _Timeline:
+    """Ids kept sorted by creation time, so listings can be cut at the virtual clock with a bisect."""
+
+    def __init__(self) -> None:
+        self.ids = []
+        self.times = []
+        self.positions = {}
+
+    def add(self, id: str, created: float) -> None:
+        if id in self.positions:
+            return  # E.g. an item reported twice is only once in the modqueue
+        if len(self.times) == 0 or created >= self.times[-1]:
+            self.positions[id] = len(self.ids)
+            self.ids.append(id)
+            self.times.append(created)
+            return
+        # Out of order insertion (rare), reindex everything after it
+        i = bisect_right(self.times, created)
+        self.ids.insert(i, id)
+        self.times.insert(i, created)
+        for j in range(i, len(self.ids)):
+            self.positions[self.ids[j]] = j
+
+    def remove(self, id: str) -> None:
+        i = self.positions.pop(id, None)
+        if i is None:
+            return
+        del self.ids[i]
+        del self.times[i]
+        for j in range(i, len(self.ids)):
+            self.positions[self.ids[j]] = j
+
+    def visible(self, now: float | None) -> int:
+        """Number of ids created at or before now."""
+        return len(self.ids) if now is None else bisect_right(self.times, now)
+
+    def page(self, now: float | None, params: dict, default_limit: int = 25) -> tuple[list[str], str | None]:
+        """Newest first page of ids following reddit's before/after/limit conventions.
+        Returns the ids and the cursor of the next page (None on the last page)."""
+        end = self.visible(now)
+        start = 0
+        if params.get("after"):
+            if params["after"] not in self.positions:
+                return [], None
+            end = min(end, self.positions[params["after"]])
+        if params.get("before"):
+            if params["before"] not in self.positions:
+                return [], None
+            start = self.positions[params["before"]] + 1
+        limit = int(params.get("limit") or default_limit)
+        limit = max(1, min(limit, 100))
+        ids = self.ids[max(start, end - limit):end][::-1]
+        return ids, (ids[-1] if end - limit > start and len(ids) > 0 else None)
+
+
+class FakeReddit:
+    """In-memory stand-in for the parts of the Reddit API the bot uses.
+    Serves recorded or synthetic traffic (see TrafficGenerator for the fixture format) to PRAW through FakeSession.
+    Only items created before the virtual clock (self.now) are visible, so a day of traffic can be replayed at full speed.
+    Writes (removals, bans, notes, wiki edits, modmails...) are applied to the state, logged in the modlog like reddit does,
+    and recorded in self.actions so the behavior of two versions of the bot can be compared."""
+
+    def __init__(self, subreddit: str, bot: str = "AutobanBOT", moderators: list[str] | None = None) -> None:
+        self.subreddit = subreddit
+        self.bot = bot
+        self.moderators = [bot] + [m for m in (moderators or []) if m != bot]
+        self.now = None
+
+        self._lock = threading.RLock()
+        self._next_id = 36 ** 5
+        self.subreddit_id = self.new_id()
+
+        self.users = {}
+        self.things = {}
+        self.sub_timelines = {"t1": _Timeline(), "t3": _Timeline()}
+        self.user_timelines = {}
+        self.modlog = {}
+        self.modlog_timeline = _Timeline()
+        self.modlog_timelines = {}  # Per action, and "a" for the admins, for the filtered listings
+        self.banned = {}
+        self.modqueue = _Timeline()
+        self.wiki = {}
+        self.removal_reasons = []
+        self.modnotes = {}
+        self.modmail = {}
+
+        self.actions = []
+        self.requests = Counter()
+        self.statuses = Counter()
+
+        self._routes = [(method, template, re.compile(self._route_regex(template)), getattr(self, name))
+                        for method, template, name in FakeReddit.ROUTES]
+
+    def __deepcopy__(self, memo: dict):
+        # PRAW deep copies listing params, which can hold a reference to the Reddit instance and so to this object
+        return self
+
+    # Endpoint templates (same placeholders as PRAW's API_PATH) and the methods answering them
+    ROUTES = [
+        ("POST", "api/v1/access_token", "_access_token"),
+        ("GET", "api/v1/me", "_me"),
+        ("GET", "r/{subreddit}/about", "_subreddit_about"),
+        ("GET", "r/{subreddit}/comments", "_subreddit_comments"),
+        ("GET", "r/{subreddit}/new", "_subreddit_new"),
+        ("GET", "r/{subreddit}/search", "_search"),
+        ("GET", "r/{subreddit}/about/log", "_modlog"),
+        ("GET", "r/{subreddit}/about/modqueue", "_modqueue"),
+        ("GET", "r/{subreddit}/about/moderators", "_moderators"),
+        ("GET", "r/{subreddit}/about/banned", "_banned"),
+        ("POST", "r/{subreddit}/api/friend", "_friend"),
+        ("POST", "r/{subreddit}/api/unfriend", "_unfriend"),
+        ("POST", "r/{subreddit}/api/wiki/edit", "_wiki_edit"),
+        ("POST", "r/{subreddit}/wiki/settings/{page}", "_wiki_settings"),
+        ("GET", "r/{subreddit}/wiki/{page}", "_wiki_page"),
+        ("GET", "api/v1/{subreddit}/removal_reasons", "_removal_reasons"),
+        ("GET", "user/{user}/about", "_user_about"),
+        ("GET", "user/{user}/{where}", "_user_listing"),
+        ("GET", "api/info", "_info"),
+        ("GET", "comments/{id}", "_submission"),
+        ("POST", "api/{action}", "_moderate"),
+        ("POST", "api/v1/modactions/removal_reasons", "_ok"),
+        ("GET", "api/mod/notes/recent", "_recent_notes"),
+        ("GET", "api/mod/notes", "_get_notes"),
+        ("POST", "api/mod/notes", "_create_note"),
+        ("DELETE", "api/mod/notes", "_delete_note"),
+        ("GET", "api/mod/conversations", "_modmail_list"),
+        ("POST", "api/mod/conversations", "_create_modmail"),
+        ("POST", "api/mod/conversations/{id}/{action}", "_modmail_action"),
+    ]
+
+    MODERATION_ACTIONS = {"remove", "approve", "lock", "unlock", "report", "comment", "editusertext", "distinguish"}
+
+    @staticmethod
+    def _route_regex(template: str) -> str:
+        pattern = re.sub(r"\{(\w+)\}", lambda m: f"(?P<{m.group(1)}>{'.+' if m.group(1) == 'page' else '[^/]+'})", template)
+        return f"^{pattern}$"
+
+    @classmethod
+    def from_fixture(cls, fixture: dict) -> FakeReddit:
+        """Build the stand-in from a fixture dict (see TrafficGenerator.generate for the format)."""
+        backend = cls(fixture["subreddit"], bot=fixture.get("bot", "AutobanBOT"), moderators=fixture.get("moderators"))
+        for user in fixture.get("users", []):
+            backend.add_user(**user)
+        for thing in sorted(fixture.get("things", []), key=lambda t: t["data"]["created_utc"]):
+            backend.add_thing(thing["kind"], thing["data"])
+        for entry in sorted(fixture.get("modlog", []), key=lambda e: e["created_utc"]):
+            backend.add_modlog(entry)
+        for ban in fixture.get("banned", []):
+            backend.banned[ban["name"].lower()] = ban
+        for fullname in fixture.get("modqueue", []):
+            if fullname in backend.things:
+                backend.modqueue.add(fullname, backend.things[fullname]["data"]["created_utc"])
+        for page, content in fixture.get("wiki", {}).items():
+            backend.set_wiki(page, content)
+        backend.removal_reasons = list(fixture.get("removal_reasons", []))
+        for note in fixture.get("modnotes", []):
+            backend.add_modnote(note["user"], note.get("label"), note["note"], operator=note.get("operator"),
+                                created_at=note.get("created_at"), reddit_id=note.get("reddit_id"))
+        backend.now = fixture.get("start")
+        return backend
+
+    @classmethod
+    def from_file(cls, path: str) -> FakeReddit:
+        with open(path, "r") as f:
+            return cls.from_fixture(json.load(f))
+
+    # -- State --
+
+    def new_id(self) -> str:
+        with self._lock:
+            self._next_id += 1
+            return _base36(self._next_id)
+
+    def clock(self) -> float:
+        return time.time() if self.now is None else self.now
+
+    def add_user(self, name: str, status: str = "active", created_utc: float | None = None, **extra) -> dict:
+        """status is one of active, suspended, shadowbanned or deleted."""
+        user = {"name": name, "id": self.new_id(), "status": status,
+                "created_utc": created_utc if created_utc is not None else 1262304000.0, **extra}
+        self.users[name.lower()] = user
+        return user
+
+    def get_user(self, name: str) -> dict:
+        if name.lower() not in self.users:
+            self.add_user(name)
+        return self.users[name.lower()]
+
+    def add_thing(self, kind: str, data: dict) -> dict:
+        """Add a comment (t1) or submission (t3). Missing fields are filled with reddit's defaults."""
+        with self._lock:
+            data = dict(data)
+            data.setdefault("id", self.new_id())
+            data.setdefault("created_utc", self.clock())
+            data.setdefault("subreddit", self.subreddit)
+            data.setdefault("author", "[deleted]")
+            fullname = f"{kind}_{data['id']}"
+            data["name"] = fullname
+            data.setdefault("subreddit_id", f"t5_{self.subreddit_id}" if data["subreddit"].lower() == self.subreddit.lower() else f"t5_{self.new_id()}")
+            data.setdefault("subreddit_name_prefixed", f"r/{data['subreddit']}")
+            data.setdefault("created", data["created_utc"])
+            for k, v in {"removed": False, "approved": False, "locked": False, "stickied": False, "distinguished": None,
+                         "mod_note": None, "mod_reason_title": None, "mod_reports": [], "user_reports": [], "num_reports": 0,
+                         "score": 1, "banned_by": None, "banned_at_utc": None}.items():
+                data.setdefault(k, v)
+            if data["removed"] and data["banned_at_utc"] is None:
+                data["banned_at_utc"] = data["created_utc"]
+            if data["author"] != "[deleted]":
+                data.setdefault("author_fullname", f"t2_{self.get_user(data['author'])['id']}")
+            if kind == "t1":
+                data.setdefault("body", "")
+                data.setdefault("link_id", f"t3_{self.new_id()}")
+                data.setdefault("parent_id", data["link_id"])
+                data.setdefault("permalink", f"/r/{data['subreddit']}/comments/{data['link_id'][3:]}/_/{data['id']}/")
+            else:
+                data.setdefault("title", "")
+                data.setdefault("selftext", "")
+                data.setdefault("num_comments", 0)
+                data.setdefault("permalink", f"/r/{data['subreddit']}/comments/{data['id']}/_/")
+                data.setdefault("url", f"https://www.reddit.com{data['permalink']}")
+            self.things[fullname] = {"kind": kind, "data": data}
+            if data["subreddit"].lower() == self.subreddit.lower():
+                self.sub_timelines[kind].add(fullname, data["created_utc"])
+            if data["author"] != "[deleted]":
+                if data["author"].lower() not in self.user_timelines:
+                    self.user_timelines[data["author"].lower()] = {"t1": _Timeline(), "t3": _Timeline()}
+                self.user_timelines[data["author"].lower()][kind].add(fullname, data["created_utc"])
+            return data
+
+    def add_modlog(self, entry: dict) -> dict:
+        with self._lock:
+            entry = dict(entry)
+            entry.setdefault("id", f"ModAction_{self.new_id()}")
+            entry.setdefault("created_utc", self.clock())
+            entry.setdefault("subreddit", self.subreddit)
+            entry.setdefault("subreddit_name_prefixed", f"r/{self.subreddit}")
+            entry.setdefault("sr_id36", self.subreddit_id)
+            for k in ["details", "description", "target_author", "target_fullname", "target_permalink", "target_title", "target_body"]:
+                entry.setdefault(k, None)
+            entry.setdefault("mod_id36", self.get_user(entry["mod"])["id"])
+            self.modlog[entry["id"]] = entry
+            self.modlog_timeline.add(entry["id"], entry["created_utc"])
+            self.modlog_timelines.setdefault(entry["action"], _Timeline()).add(entry["id"], entry["created_utc"])
+            if entry["mod"] == "Anti-Evil Operations":
+                self.modlog_timelines.setdefault("a", _Timeline()).add(entry["id"], entry["created_utc"])
+            return entry
+
+    def set_wiki(self, page: str, content: str, author: str | None = None) -> dict:
+        with self._lock:
+            revision = {"content_md": content, "revision_id": f"{self.new_id()}-0000-0000-0000-000000000000",
+                        "revision_date": int(self.clock()), "revision_by": author}
+            self.wiki[page.lower()] = revision
+            return revision
+
+    def add_modnote(self, user: str, label: str | None, note: str, operator: str | None = None,
+                    created_at: float | None = None, reddit_id: str | None = None) -> dict:
+        with self._lock:
+            operator = operator or self.bot
+            modnote = {"id": f"ModNote_{self.new_id()}", "subreddit": self.subreddit, "subreddit_id": f"t5_{self.subreddit_id}",
+                       "user": user, "user_id": f"t2_{self.get_user(user)['id']}",
+                       "operator": operator, "operator_id": f"t2_{self.get_user(operator)['id']}",
+                       "created_at": int(created_at if created_at is not None else self.clock()), "type": "NOTE",
+                       "mod_action_data": {"action": None, "reddit_id": None, "details": None, "description": None},
+                       "user_note_data": {"note": note, "reddit_id": reddit_id, "label": label}}
+            modnote["cursor"] = modnote["id"]
+            self.modnotes.setdefault(user.lower(), []).append(modnote)
+            return modnote
+
+    def record(self, action: str, **details) -> None:
+        """Log a write made by the bot."""
+        self.actions.append({"action": action, "time": self.clock(), **details})
+
+    # -- Request handling --
+
+    def handle(self, method: str, url: str, params: dict | None = None, data: Any = None) -> tuple[int, Any]:
+        """Answer a request, returns the HTTP status and the JSON payload (None for no content)."""
+        method = method.upper()
+        path = urlparse(url).path.strip("/")
+        params = dict(params or {})
+        if isinstance(data, (list, tuple)):
+            data = dict(data)
+        data = dict(data or {})
+        for m, template, regex, handler in self._routes:
+            if m != method:
+                continue
+            match = regex.match(path)
+            if match is None:
+                continue
+            self.requests[f"{method} {template}"] += 1
+            with self._lock:
+                status, payload = handler(params=params, data=data, **match.groupdict())
+            self.statuses[status] += 1
+            return status, payload
+        self.requests[f"{method} {path}"] += 1
+        self.statuses[404] += 1
+        return FakeReddit.not_found()
+
+    @staticmethod
+    def not_found() -> tuple[int, dict]:
+        return 404, {"message": "Not Found", "error": 404}
+
+    def _is_our_sub(self, subreddit: str) -> bool:
+        return subreddit.lower() == self.subreddit.lower()
+
+    def _listing(self, children: list[dict], after: str | None) -> dict:
+        return {"kind": "Listing", "data": {"after": after, "before": None, "dist": len(children), "modhash": None,
+                                            "geo_filter": "", "children": children}}
+
+    def _thing_listing(self, timeline: _Timeline, params: dict) -> dict:
+        ids, after = timeline.page(self.now, params)
+        return self._listing([self.things[i] for i in ids], after)
+
+    def _user_data(self, name: str) -> dict:
+        user = self.get_user(name)
+        return {"name": user["name"], "id": user["id"], "created_utc": user["created_utc"], "created": user["created_utc"],
+                "link_karma": 1, "comment_karma": 1, "is_mod": False, "is_employee": False, "verified": True,
+                "has_verified_email": True, "icon_img": ""}
+
+    def _ok(self, **kwargs) -> tuple[int, dict]:
+        return 200, {}
+
+    def _access_token(self, **kwargs) -> tuple[int, dict]:
+        return 200, {"access_token": f"fake-{self.new_id()}", "token_type": "bearer", "expires_in": 86400, "scope": "*"}
+
+    def _me(self, **kwargs) -> tuple[int, dict]:
+        return 200, self._user_data(self.bot)
+
+    def _subreddit_about(self, subreddit: str, **kwargs) -> tuple[int, dict]:
+        our = self._is_our_sub(subreddit)
+        return 200, {"kind": "t5", "data": {
+            "display_name": self.subreddit if our else subreddit, "id": self.subreddit_id if our else self.new_id(),
+            "name": f"t5_{self.subreddit_id}" if our else None, "user_is_moderator": our,
+            "subscribers": 1000, "subreddit_type": "public", "over18": False}}
+
+    def _subreddit_comments(self, subreddit: str, params: dict, **kwargs) -> tuple[int, dict]:
+        if not self._is_our_sub(subreddit):
+            return 200, self._listing([], None)
+        return 200, self._thing_listing(self.sub_timelines["t1"], params)
+
+    def _subreddit_new(self, subreddit: str, params: dict, **kwargs) -> tuple[int, dict]:
+        if not self._is_our_sub(subreddit):
+            return 200, self._listing([], None)
+        return 200, self._thing_listing(self.sub_timelines["t3"], params)
+
+    def _search(self, subreddit: str, params: dict, **kwargs) -> tuple[int, dict]:
+        """Only author:"name" queries, which is all the bot searches for."""
+        match = re.fullmatch(r'author:"?([^"]+)"?', params.get("q", ""))
+        if match is None or not self._is_our_sub(subreddit):
+            return 200, self._listing([], None)
+        posts = _Timeline()
+        timelines = self.user_timelines.get(match.group(1).lower(), {})
+        if "t3" in timelines:
+            for id, created in zip(timelines["t3"].ids, timelines["t3"].times):
+                if self._is_our_sub(self.things[id]["data"]["subreddit"]):
+                    posts.add(id, created)
+        return 200, self._thing_listing(posts, params)
+
+    def _modlog(self, subreddit: str, params: dict, **kwargs) -> tuple[int, dict]:
+        if not self._is_our_sub(subreddit):
+            return 403, {"message": "Forbidden", "error": 403}
+        # Like reddit, filter before paging, so a filtered listing only has the pages of the entries it matches
+        timeline = self.modlog_timeline
+        if params.get("type"):
+            timeline = self.modlog_timelines.get(params["type"], _Timeline())
+        elif params.get("mod") == "a":
+            timeline = self.modlog_timelines.get("a", _Timeline())
+        ids, after = timeline.page(self.now, params)
+        entries = [self.modlog[i] for i in ids]
+        if params.get("mod"):
+            mods = set(params["mod"].lower().split(","))
+            entries = [e for e in entries if e["mod"].lower() in mods or ("a" in mods and e["mod"] == "Anti-Evil Operations")]
+        return 200, self._listing([{"kind": "modaction", "data": e} for e in entries], after)
+
+    def _modqueue(self, subreddit: str, params: dict, **kwargs) -> tuple[int, dict]:
+        return 200, self._thing_listing(self.modqueue, params)
+
+    def _user_list(self, entries: list[dict], params: dict) -> dict:
+        if params.get("user"):
+            entries = [e for e in entries if e["name"].lower() == params["user"].lower()]
+        return {"kind": "UserList", "data": {"children": entries, "after": None, "before": None}}
+
+    def _moderators(self, subreddit: str, params: dict, **kwargs) -> tuple[int, dict]:
+        entries = [{"name": m, "id": f"t2_{self.get_user(m)['id']}", "date": 1262304000.0, "mod_permissions": ["all"],
+                    "author_flair_text": None, "author_flair_css_class": None} for m in self.moderators]
+        return 200, self._user_list(entries, params)
+
+    def _banned(self, subreddit: str, params: dict, **kwargs) -> tuple[int, dict]:
+        entries = [{"name": b["name"], "id": f"t2_{self.get_user(b['name'])['id']}", "rel_id": f"rb_{self.get_user(b['name'])['id']}",
+                    "date": b.get("date", 0), "note": b.get("note", ""), "days_left": b.get("days_left")}
+                   for b in self.banned.values()]
+        return 200, self._user_list(entries, params)
+
+    def _friend(self, subreddit: str, data: dict, **kwargs) -> tuple[int, dict]:
+        if data.get("type") == "banned":
+            self.banned[data["name"].lower()] = {"name": data["name"], "date": self.clock(), "note": data.get("ban_reason", ""),
+                                                 "days_left": data.get("duration")}
+            self.record("ban", user=data["name"], reason=data.get("ban_reason"))
+            self.add_modlog({"action": "banuser", "mod": self.bot, "target_author": data["name"],
+                             "details": "permanent" if not data.get("duration") else f"{data['duration']} days",
+                             "description": data.get("ban_reason")})
+        elif data.get("type") == "moderator":
+            self.moderators.append(data["name"])
+            self.record("addmoderator", user=data["name"])
+        return 200, {"json": {"errors": []}}
+
+    def _unfriend(self, subreddit: str, data: dict, **kwargs) -> tuple[int, dict]:
+        if data.get("type") == "banned":
+            self.banned.pop(data["name"].lower(), None)
+            self.record("unban", user=data["name"])
+            self.add_modlog({"action": "unbanuser", "mod": self.bot, "target_author": data["name"]})
+        return 200, {"json": {"errors": []}}
+
+    def _wiki_page(self, subreddit: str, page: str, **kwargs) -> tuple[int, dict]:
+        revision = self.wiki.get(page.lower())
+        if revision is None:
+            return FakeReddit.not_found()
+        author = revision["revision_by"]
+        return 200, {"kind": "wikipage", "data": {
+            "content_md": revision["content_md"], "content_html": "", "may_revise": True, "reason": None,
+            "revision_id": revision["revision_id"], "revision_date": revision["revision_date"],
+            "revision_by": None if author is None else {"kind": "t2", "data": self._user_data(author)}}}
+
+    def _wiki_edit(self, subreddit: str, data: dict, **kwargs) -> tuple[int, dict]:
+        page = data["page"]
+        current = self.wiki.get(page.lower())
+        if data.get("previous") and current is not None and data["previous"] != current["revision_id"]:
+            return 409, {"message": "Conflict", "error": 409, "reason": "EDIT_CONFLICT",
+                         "newcontent": current["content_md"], "newrevision": current["revision_id"]}
+        self.set_wiki(page, data.get("content", ""), author=self.bot)
+        self.record("wikiedit", page=page, size=len(data.get("content", "")))
+        self.add_modlog({"action": "wikirevise", "mod": self.bot, "details": f"Page {page} edited", "description": data.get("reason")})
+        return 200, {}
+
+    def _wiki_settings(self, subreddit: str, page: str, data: dict, **kwargs) -> tuple[int, dict]:
+        return 200, {"kind": "wikipagesettings", "data": {"listed": data.get("listed", True), "permlevel": int(data.get("permlevel", 0)), "editors": []}}
+
+    def _removal_reasons(self, subreddit: str, **kwargs) -> tuple[int, dict]:
+        return 200, {"data": {r["id"]: r for r in self.removal_reasons}, "order": [r["id"] for r in self.removal_reasons]}
+
+    def _user_status(self, user: str) -> str:
+        return self.users[user.lower()]["status"] if user.lower() in self.users else "deleted"
+
+    def _user_about(self, user: str, **kwargs) -> tuple[int, dict]:
+        status = self._user_status(user)
+        if status in ("shadowbanned", "deleted"):
+            return FakeReddit.not_found()
+        if status == "suspended":
+            return 200, {"kind": "t2", "data": {"name": self.get_user(user)["name"], "is_suspended": True}}
+        return 200, {"kind": "t2", "data": self._user_data(user)}
+
+    def _user_listing(self, user: str, where: str, params: dict, **kwargs) -> tuple[int, dict]:
+        if self._user_status(user) in ("shadowbanned", "deleted", "suspended"):
+            return FakeReddit.not_found()
+        timelines = self.user_timelines.get(user.lower())
+        if timelines is None:
+            return 200, self._listing([], None)
+        if where == "comments":
+            return 200, self._thing_listing(timelines["t1"], params)
+        if where == "submitted":
+            return 200, self._thing_listing(timelines["t3"], params)
+        if where == "overview":
+            merged = _Timeline()
+            for timeline in timelines.values():
+                for id, created in zip(timeline.ids, timeline.times):
+                    merged.add(id, created)
+            return 200, self._thing_listing(merged, params)
+        return FakeReddit.not_found()
+
+    def _info(self, params: dict, **kwargs) -> tuple[int, dict]:
+        ids = [i for i in params.get("id", "").split(",") if i in self.things]
+        return 200, self._listing([self.things[i] for i in ids], None)
+
+    def _submission(self, id: str, **kwargs) -> tuple[int, list]:
+        fullname = f"t3_{id}"
+        if fullname not in self.things:
+            return FakeReddit.not_found()
+        comments = [t for t in self.things.values() if t["kind"] == "t1" and t["data"]["link_id"] == fullname]
+        return 200, [self._listing([self.things[fullname]], None), self._listing(comments, None)]
+
+    def _things_response(self, things: list[dict]) -> dict:
+        return {"json": {"errors": [], "data": {"things": things}}}
+
+    def _moderate(self, action: str, data: dict, **kwargs) -> tuple[int, Any]:
+        if action not in FakeReddit.MODERATION_ACTIONS:
+            return FakeReddit.not_found()
+        fullname = data.get("id") or data.get("thing_id")
+        thing = self.things.get(fullname)
+        if thing is None:
+            return FakeReddit.not_found()
+        item = thing["data"]
+        kind = "comment" if thing["kind"] == "t1" else "link"
+        match action:
+            case "remove":
+                item["removed"] = True
+                item["approved"] = False
+                item["banned_by"] = self.bot
+                item["banned_at_utc"] = self.clock()
+                self.modqueue.remove(fullname)
+                self.record("remove", target=fullname, author=item["author"], spam=data.get("spam") == "True")
+                self.add_modlog({"action": f"remove{kind}", "mod": self.bot, "target_author": item["author"],
+                                 "target_fullname": fullname, "target_permalink": item["permalink"]})
+            case "approve":
+                item["removed"] = False
+                item["approved"] = True
+                self.modqueue.remove(fullname)
+                self.record("approve", target=fullname, author=item["author"])
+                self.add_modlog({"action": f"approve{kind}", "mod": self.bot, "target_author": item["author"],
+                                 "target_fullname": fullname, "target_permalink": item["permalink"]})
+            case "lock" | "unlock":
+                item["locked"] = action == "lock"
+                self.record(action, target=fullname, author=item["author"])
+            case "report":
+                item["num_reports"] += 1
+                item["user_reports"].append([data.get("reason"), 1, False, False])
+                self.modqueue.add(fullname, item["created_utc"])
+                self.record("report", target=fullname, author=item["author"], reason=data.get("reason"))
+            case "comment":
+                reply = self.add_thing("t1", {"author": self.bot, "body": data.get("text", ""), "subreddit": item["subreddit"],
+                                              "link_id": item.get("link_id", fullname), "parent_id": fullname})
+                self.record("reply", target=fullname, id=reply["name"])
+                return 200, self._things_response([self.things[reply["name"]]])
+            case "editusertext":
+                item["body" if thing["kind"] == "t1" else "selftext"] = data.get("text", "")
+                self.record("edit", target=fullname)
+                return 200, self._things_response([thing])
+            case "distinguish":
+                item["distinguished"] = "moderator" if data.get("how") != "no" else None
+                item["stickied"] = data.get("sticky") == "True"
+                return 200, self._things_response([thing])
+        return 200, {}
+
+    def _notes_page(self, notes: list[dict], params: dict) -> dict:
+        notes = notes[::-1]  # Newest first
+        if params.get("before"):
+            ids = [n["id"] for n in notes]
+            notes = notes[ids.index(params["before"]) + 1:] if params["before"] in ids else []
+        if params.get("filter") == "NOTE":
+            notes = [n for n in notes if n["type"] == "NOTE"]
+        limit = max(1, min(int(params.get("limit") or 25), 100))
+        page = notes[:limit]
+        return {"mod_notes": page, "start_cursor": page[0]["id"] if page else None,
+                "end_cursor": page[-1]["id"] if page else None, "has_next_page": len(notes) > limit}
+
+    def _get_notes(self, params: dict, **kwargs) -> tuple[int, dict]:
+        return 200, self._notes_page(self.modnotes.get(params.get("user", "").lower(), []), params)
+
+    def _recent_notes(self, params: dict, **kwargs) -> tuple[int, dict]:
+        notes = [self.modnotes[u.lower()][-1] if self.modnotes.get(u.lower()) else None for u in params.get("users", "").split(",")]
+        return 200, {"mod_notes": notes}
+
+    def _create_note(self, data: dict, **kwargs) -> tuple[int, dict]:
+        note = self.add_modnote(data["user"], data.get("label"), data["note"], reddit_id=data.get("reddit_id"))
+        self.record("modnote", user=data["user"], label=data.get("label"), note=data["note"])
+        self.add_modlog({"action": "addnote", "mod": self.bot, "target_author": data["user"], "details": data.get("label"),
+                         "description": data["note"]})
+        return 200, {"created": note}
+
+    def _delete_note(self, params: dict, **kwargs) -> tuple[int, dict]:
+        notes = self.modnotes.get(params.get("user", "").lower(), [])
+        self.modnotes[params.get("user", "").lower()] = [n for n in notes if n["id"] != params.get("note_id")]
+        self.record("deletenote", user=params.get("user"), id=params.get("note_id"))
+        return 200, {}
+
+    def _modmail_payload(self, conversation: dict) -> dict:
+        messages = {m["id"]: m for m in conversation["_messages"]}
+        data = {k: v for k, v in conversation.items() if k != "_messages"}
+        return {"conversation": data, "messages": messages, "modActions": {}, "user": {}}
+
+    def _modmail_list(self, **kwargs) -> tuple[int, dict]:
+        return 200, {"conversations": {}, "conversationIds": [], "messages": {}, "viewerId": f"t2_{self.get_user(self.bot)['id']}"}
+
+    def _create_modmail(self, data: dict, **kwargs) -> tuple[int, dict]:
+        id, message_id = self.new_id(), self.new_id()
+        author = {"name": self.bot, "isMod": True, "isAdmin": False, "isOp": True, "isParticipant": False,
+                  "isHidden": data.get("isAuthorHidden") == "True", "isDeleted": False, "id": self.get_user(self.bot)["id"]}
+        date = time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime(self.clock()))
+        message = {"id": message_id, "body": data.get("body", ""), "bodyMarkdown": data.get("body", ""), "author": author,
+                   "isInternal": not data.get("to"), "date": date, "participatingAs": "moderator"}
+        conversation = {"id": id, "subject": data.get("subject", ""), "isInternal": not data.get("to"), "isAuto": False,
+                        "isHighlighted": False, "isRepliable": True, "lastUpdated": date, "lastModUpdate": date,
+                        "lastUserUpdate": None, "lastUnread": None, "numMessages": 1, "state": 0,
+                        "owner": {"displayName": self.subreddit, "type": "subreddit", "id": f"t5_{self.subreddit_id}"},
+                        "participant": {}, "authors": [author], "objIds": [{"id": message_id, "key": "messages"}],
+                        "_messages": [message]}
+        self.modmail[id] = conversation
+        self.record("modmail", subject=data.get("subject"), to=data.get("to"), size=len(data.get("body", "")))
+        return 201, self._modmail_payload(conversation)
+
+    def _modmail_action(self, id: str, action: str, **kwargs) -> tuple[int, dict]:
+        if id not in self.modmail:
+            return FakeReddit.not_found()
+        if action == "archive":
+            self.modmail[id]["state"] = 2
+        self.record(f"modmail_{action}", id=id)
+        return 200, self._modmail_payload(self.modmail[id])
@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import json
+import random
+import threading
+import time
+from http import HTTPStatus
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from drbot.offline.FakeReddit import FakeReddit
+
+
+class FakeSession:
+    """Drop-in replacement for the requests.Session used by prawcore, answering from a FakeReddit instead of the network.
+    Log in with reddit.login(session=FakeSession(backend)) to run the bot against it.
+
+    latency (+/- jitter) seconds are slept before every answer.
+    If rate_limit is set, reddit's rate limit headers are sent for a budget of rate_limit requests per rate_window seconds
+    (so prawcore paces itself like it does in production) and requests over the budget get a 429."""
+
+    def __init__(self, backend: FakeReddit, latency: float = 0.0, jitter: float = 0.0,
+                 rate_limit: int | None = None, rate_window: int = 600, seed: int | None = None) -> None:
+        self.backend = backend
+        self.headers = CaseInsensitiveDict()  # prawcore sets the user agent in there
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._window_start = time.monotonic()
+        self._used = 0
+
+        self.request_count = 0
+        self.rate_limited = 0
+        self.simulated_latency = 0.0
+
+    def _rate_limit_headers(self) -> tuple[dict, bool]:
+        """Count the request against the budget. Returns the headers to send and whether it's over the budget."""
+        if self.rate_limit is None:
+            return {}, False
+        with self._lock:
+            now = time.monotonic()
+            if now - self._window_start >= self.rate_window:
+                self._window_start = now
+                self._used = 0
+            self._used += 1
+            over = self._used > self.rate_limit
+            if over:
+                self.rate_limited += 1
+            headers = {"x-ratelimit-used": str(self._used),
+                       "x-ratelimit-remaining": str(float(max(0, self.rate_limit - self._used))),
+                       "x-ratelimit-reset": str(max(0, int(self._window_start + self.rate_window - now)))}
+            return headers, over
+
+    def request(self, method: str, url: str, params: dict | None = None, data=None, json=None,
+                headers: dict | None = None, **kwargs) -> requests.Response:
+        if self.latency > 0:
+            delay = max(0.0, self._random.uniform(self.latency - self.jitter, self.latency + self.jitter))
+            self.simulated_latency += delay
+            time.sleep(delay)
+        self.request_count += 1
+
+        response_headers, over = self._rate_limit_headers()
+        if over:
+            status, payload = 429, {"message": "Too Many Requests", "error": 429}
+        else:
+            status, payload = self.backend.handle(method, url, params=params, data=data if data is not None else json)
+        return FakeSession._response(url, status, payload, response_headers)
+
+    @staticmethod
+    def _response(url: str, status: int, payload, headers: dict) -> requests.Response:
+        response = requests.Response()
+        response.url = url
+        response.status_code = status
+        response.reason = HTTPStatus(status).phrase
+        response.encoding = "utf-8"
+        response._content = b"" if payload is None else json.dumps(payload).encode("utf-8")
+        response.headers = CaseInsensitiveDict({"content-type": "application/json; charset=UTF-8",
+                                                "content-length": str(len(response._content)), **headers})
+        return response
+
+    def close(self) -> None:
+        pass
+
+    def __deepcopy__(self, memo: dict):
+        # PRAW deep copies listing params, which can hold a reference to the Reddit instance and so to this object
+        return self
@@ -0,0 +1,16 @@
+from __future__ import annotations
+
+from drbot.stores import DataStore
+
+
+class ScratchDataStore(DataStore):
+    """DataStore saving to a scratch file instead of the bot's local backup,
+    so offline runs don't clobber the real data (but still pay for the saves like the bot does)."""
+
+    def __init__(self, path: str) -> None:
+        super().__init__()
+        self.path = path
+
+    def save(self) -> None:
+        with open(self.path, "w") as f:
+            f.write(self.to_json())
@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import base64
+import json
+import random
+import time
+import zlib
+from bisect import bisect_right
+
+
+class TrafficGenerator:
+    """Builds synthetic fixtures for FakeReddit.
+
+    A fixture is a JSON-able dict with the following keys (only subreddit is required):
+        subreddit, bot, moderators: the sub, the bot's account and the other mods
+        start, end: epoch timestamps of the replayed period (the virtual clock starts at start)
+        users: [{name, status (active/suspended/shadowbanned/deleted), created_utc}]
+        things: [{kind (t1/t3), data: {reddit's comment/submission fields}}], on the sub and elsewhere (user histories)
+        modlog: [{reddit's modaction fields}]
+        banned: [{name, date, note}]
+        modqueue: [fullnames]
+        wiki: {page: content}
+        removal_reasons: [{id, title, message}]
+        modnotes: [{user, label, note, operator, created_at}]
+    A recorded day of traffic can be turned into a fixture by dumping the same fields."""
+
+    FILLER_SUBS = ["AskReddit", "france", "pics", "worldnews", "gaming", "science", "movies", "Music", "todayilearned",
+                   "europe", "news", "funny", "technology", "books", "sports", "food", "history", "space", "aww", "memes"]
+
+    def __init__(self, subreddit: str, monitored_subs: list[str] | None = None, removal_reasons: list[str] | None = None,
+                 wiki_page: str = "", seed: int = 0) -> None:
+        self.subreddit = subreddit
+        self.monitored_subs = list(monitored_subs or [])
+        self.removal_reasons = list(removal_reasons or [])
+        self.wiki_page = wiki_page
+        self.random = random.Random(seed)
+        self._next_id = 36 ** 6
+
+    def _id(self) -> str:
+        digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+        self._next_id += 1
+        n, s = self._next_id, ""
+        while n:
+            n, r = divmod(n, 36)
+            s = digits[r] + s
+        return s
+
+    @staticmethod
+    def empty_usernotes() -> str:
+        """Content of an empty Toolbox usernotes page."""
+        blob = base64.b64encode(zlib.compress(b"{}")).decode()
+        return json.dumps({"ver": 6, "constants": {"users": [], "warnings": []}, "blob": blob})
+
+    def generate(self, users: int = 500, comments: int = 5000, submissions: int = 200, duration: int = 86400,
+                 history: int = 50, monitored_share: float = 0.05, suspended_share: float = 0.01,
+                 shadowbanned_share: float = 0.01, banned_share: float = 0.02, removal_share: float = 0.05,
+                 moderators: int = 5, start: float | None = None) -> dict:
+        """Generate a fixture of `duration` seconds of activity on the sub.
+        Commenters follow a long tail (a few users write most comments), each has `history` items elsewhere,
+        and `monitored_share` of them have posted in one of the monitored subs."""
+        rnd = self.random
+        start = float(int(time.time()) - duration if start is None else start)
+        end = start + duration
+        mods = [f"mod_{i}" for i in range(moderators)]
+
+        fixture = {"subreddit": self.subreddit, "bot": "AutobanBOT", "moderators": mods, "start": start, "end": end,
+                   "users": [], "things": [], "modlog": [], "banned": [], "modqueue": [], "wiki": {}, "modnotes": [],
+                   "removal_reasons": [{"id": self._id(), "title": r, "message": r} for r in self.removal_reasons]}
+        if self.wiki_page != "":
+            fixture["wiki"][self.wiki_page] = "This page and its children house the data for the bot. Do not edit."
+            fixture["wiki"][f"{self.wiki_page}/data"] = "{}"
+        fixture["wiki"]["usernotes"] = TrafficGenerator.empty_usernotes()
+
+        # Population
+        names = [f"user_{i:05d}" for i in range(users)]
+        for name in names:
+            status = rnd.choices(["active", "suspended", "shadowbanned"],
+                                 weights=[1 - suspended_share - shadowbanned_share, suspended_share, shadowbanned_share])[0]
+            fixture["users"].append({"name": name, "status": status, "created_utc": start - rnd.randint(86400, 10 * 365 * 86400)})
+            if rnd.random() < banned_share:
+                fixture["banned"].append({"name": name, "date": start - rnd.randint(0, 365 * 86400), "note": "synthetic ban"})
+
+        # Histories outside of the sub
+        for name in names:
+            monitored = len(self.monitored_subs) > 0 and rnd.random() < monitored_share
+            for i in range(history):
+                sub = rnd.choice(self.monitored_subs) if monitored and rnd.random() < 0.2 else rnd.choice(TrafficGenerator.FILLER_SUBS)
+                created = start - rnd.randint(60, 365 * 86400)
+                if rnd.random() < 0.2:
+                    fixture["things"].append({"kind": "t3", "data": {"id": self._id(), "author": name, "subreddit": sub,
+                                                                      "title": "Synthetic post", "created_utc": created}})
+                else:
+                    fixture["things"].append({"kind": "t1", "data": {"id": self._id(), "author": name, "subreddit": sub,
+                                                                      "body": "Synthetic comment elsewhere", "created_utc": created}})
+
+        # Activity on the sub, with some before the replay so the agents have a starting point
+        posts = []
+        for i in range(submissions):
+            created = start - 3600 if i == 0 else rnd.uniform(start - 3600, end)
+            post = {"id": self._id(), "author": rnd.choice(names), "subreddit": self.subreddit, "title": f"Post {i}",
+                    "created_utc": created}
+            posts.append(post)
+            fixture["things"].append({"kind": "t3", "data": post})
+        posts.sort(key=lambda p: p["created_utc"])
+        post_times = [p["created_utc"] for p in posts]
+        weights = [1 / (rank + 1) ** 0.8 for rank in range(users)]
+        for i in range(comments + 20):
+            created = rnd.uniform(start - 3600, start) if i < 20 else rnd.uniform(start, end)
+            # Comment on a post that already exists
+            post = posts[rnd.randrange(max(1, bisect_right(post_times, created)))]
+            comment = {"id": self._id(), "author": rnd.choices(names, weights=weights)[0], "subreddit": self.subreddit,
+                       "body": f"Synthetic comment {i}", "link_id": f"t3_{post['id']}",
+                       "created_utc": max(created, post["created_utc"])}
+            fixture["things"].append({"kind": "t1", "data": comment})
+
+            # Moderation of the sub
+            if rnd.random() < removal_share:
+                removed = comment["created_utc"] + rnd.uniform(60, 3600)
+                mod = rnd.choice(mods) if len(mods) > 0 else "AutoModerator"
+                target = {"target_author": comment["author"], "target_fullname": f"t1_{comment['id']}",
+                          "target_permalink": f"/r/{self.subreddit}/comments/{post['id']}/_/{comment['id']}/"}
+                fixture["modlog"].append({"action": "removecomment", "mod": mod, "created_utc": removed, **target})
+                comment["removed"] = True
+                if len(self.removal_reasons) > 0:
+                    fixture["modlog"].append({"action": "addremovalreason", "mod": mod, "created_utc": removed + 1,
+                                              "description": rnd.choice(self.removal_reasons), **target})
+                if rnd.random() < 0.1:
+                    fixture["modlog"].append({"action": "approvecomment", "mod": mod, "created_utc": removed + rnd.uniform(60, 3600), **target})
+            elif rnd.random() < 0.01:
+                fixture["modqueue"].append(f"t1_{comment['id']}")
+
+        # A starting point for the modlog agent
+        if len(fixture["modlog"]) == 0 or min(e["created_utc"] for e in fixture["modlog"]) > start:
+            fixture["modlog"].append({"action": "editflair", "mod": mods[0] if len(mods) > 0 else "AutoModerator",
+                                      "created_utc": start - 60})
+        return fixture
@@ -0,0 +1,4 @@
+from drbot.offline.FakeReddit import FakeReddit
+from drbot.offline.FakeSession import FakeSession
+from drbot.offline.TrafficGenerator import TrafficGenerator
+from drbot.offline.ScratchDataStore import ScratchDataStore
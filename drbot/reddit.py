@@ -1,12 +1,19 @@
 import praw
-import json
+import time
+from urllib.parse import urlparse
 import prawcore
 from prawcore import Requestor
+from prawcore.rate_limit import RateLimiter
 import random
+import threading
+from collections import OrderedDict
+from copy import deepcopy
 from typing import Optional
 from requests.status_codes import codes
 import logging
-from drbot import settings, log
+from drbot import settings, log, metrics, snapshot
+from drbot.metrics import endpoint
+from drbot.tracing import tracer
 from drbot.log import ModmailLoggingHandler, TemplateLoggingFormatter, BASE_FORMAT
 
 DRBOT_CLIENT_ID_PATH = "drbot/drbot_client_id.txt"
@@ -22,9 +29,7 @@ class InfiniteRetryStrategy(prawcore.sessions.RetryStrategy):
     """For use with PRAW.
     Retries requests forever using capped exponential backoff with jitter.
     This prevents the bot from dying when reddit's servers have an outage or the internet is down.
-    Use by setting
-        reddit._core._retry_strategy_class = InfiniteRetryStrategy
-    right after initializing your praw.Reddit object."""
+    Used by CachingSession, the sessions of drbot's Reddit."""
 
     def _sleep_seconds(self):
         if self._attempts == 0:
@@ -33,6 +38,13 @@ class InfiniteRetryStrategy(prawcore.sessions.RetryStrategy):
             log.warn(f"Request still failing after multiple tries, retrying... ({self._attempts})")
         return random.randrange(0, min(self._cap, self._base * 2 ** self._attempts))
 
+    def sleep(self):
+        if self._attempts == 0:
+            return  # First try, nothing to wait for
+        start = time.perf_counter()
+        super().sleep()
+        metrics.record_retry_sleep(time.perf_counter() - start)
+
     def __init__(self, _base=2, _cap=60, _attempts=0):
         self._base = _base
         self._cap = _cap
@@ -47,29 +59,233 @@ class InfiniteRetryStrategy(prawcore.sessions.RetryStrategy):
 
 del prawcore.Session.STATUS_EXCEPTIONS[codes["too_many_requests"]]
 prawcore.Session.RETRY_STATUSES.add(codes["too_many_requests"])
-    
-class JSONDebugRequestor(Requestor):
+
+
+class InstrumentedRequestor(Requestor):
+    """Counts every request made to reddit and the bytes received, see drbot/metrics.py."""
+
+    def request(self, *args, **kwargs):
+        response = super().request(*args, **kwargs)
+        method = kwargs.get("method", args[0] if len(args) > 0 else "")
+        url = kwargs.get("url", args[1] if len(args) > 1 else "")
+        metrics.record_request(method, url, response.status_code, len(response.content))
+        return response
+
+
+class InstrumentedRateLimiter(RateLimiter):
+    """Records the time spent waiting for reddit's rate limit. Used by CachingSession."""
+
+    def delay(self):
+        start = time.perf_counter()
+        super().delay()
+        metrics.record_rate_limit_sleep(time.perf_counter() - start)
+
+
+class TracingRequestor(InstrumentedRequestor):
+    """Records the requests sampled by drbot.tracing.tracer (when tracing is on), see trace_report.py."""
+
     def request(self, *args, **kwargs):
+        if not tracer.enabled or not tracer.sampled():
+            return super().request(*args, **kwargs)
+        start = time.perf_counter()
         response = super().request(*args, **kwargs)
-        with open("log_file.json", "a") as f:
-            if "https://oauth.reddit.com/api/mod/notes" in args[1]:
-                log.warn("Logging modnote request")
-                #f.write(json.dumps({"args": args, "kwargs": kwargs, "response": response.json()}) + '\n' + '\n')
-                f.write(response.text + '\n' + '\n')
-                log.warn("Request logged")
+        method = kwargs.get("method", args[0] if len(args) > 0 else "")
+        url = kwargs.get("url", args[1] if len(args) > 1 else "")
+        tracer.record({
+            "time": round(time.time(), 3),
+            "method": method.upper(),
+            "endpoint": endpoint(method, url),
+            "path": urlparse(url).path,
+            "params": {k: str(v) for k, v in (kwargs.get("params") or {}).items()},
+            "status": response.status_code,
+            "ms": round((time.perf_counter() - start) * 1000, 1),
+            "bytes": len(response.content),
+            "ratelimit_remaining": response.headers.get("x-ratelimit-remaining"),
+            "ratelimit_used": response.headers.get("x-ratelimit-used"),
+            "ratelimit_reset": response.headers.get("x-ratelimit-reset"),
+            "handler": metrics.scope,
+        })
         return response
 
+
+class RequestCache:
+    """Read-through cache of reddit's responses to GET requests, for the endpoints in TTL.
+    Identical requests made while one is in flight wait for it instead of being sent again.
+    Writes invalidate the endpoints they affect (see INVALIDATES), and ModlogAgent invalidates
+    what mods change outside of the bot (e.g. wiki edits)."""
+
+    # Seconds a response stays valid, per endpoint template (see drbot.metrics.endpoint)
+    TTL = {
+        "GET api/v1/me": 3600,
+        "GET user/{user}/about": 300,
+        # User histories, short-lived: mostly so a user commenting in several of the subs we serve is only looked up once
+        "GET user/{user}/submitted": 120,
+        "GET user/{user}/comments": 120,
+        "GET r/{subreddit}/about/moderators": 600,
+        "GET r/{subreddit}/about/banned": 60,
+        "GET r/{subreddit}/wiki/{page}": 60,
+        "GET api/info": 60,
+    }
+    # Endpoints whose cached responses a write makes stale
+    INVALIDATES = {
+        "POST r/{subreddit}/api/friend": ["GET r/{subreddit}/about/banned", "GET r/{subreddit}/about/moderators"],
+        "POST r/{subreddit}/api/unfriend": ["GET r/{subreddit}/about/banned", "GET r/{subreddit}/about/moderators"],
+        "POST r/{subreddit}/api/accept_moderator_invite": ["GET r/{subreddit}/about/moderators"],
+        "POST api/leavemoderator": ["GET r/{subreddit}/about/moderators"],
+        "POST r/{subreddit}/api/wiki/edit": ["GET r/{subreddit}/wiki/{page}"],
+        "POST api/remove": ["GET api/info"],
+        "POST api/approve": ["GET api/info"],
+        "POST api/lock": ["GET api/info"],
+        "POST api/unlock": ["GET api/info"],
+    }
+    # Responses kept at most, the oldest are dropped first
+    MAX_ENTRIES = 10000
+
+    def __init__(self) -> None:
+        self._entries = OrderedDict()  # key -> (template, expiry, response or exception)
+        self._in_flight = {}  # key -> threading.Event
+        self._lock = threading.Lock()
+
+    def __deepcopy__(self, memo):
+        # prawcore deep-copies request payloads, which can hold PRAW models and through them the Reddit instance
+        return self
+
+    def get(self, method: str, path: str, params: dict | None, fetch):
+        """The response to a request, from the cache or from fetch()."""
+        template = endpoint(method, path)
+        if template not in RequestCache.TTL:
+            for stale in RequestCache.INVALIDATES.get(template, []):
+                self.invalidate(stale)
+            return fetch()
+
+        key = (template, path.strip("/"), tuple(sorted((k, str(v)) for k, v in (params or {}).items())))
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry[1] > time.monotonic():
+                    metrics.record_cache(template, True)
+                    if isinstance(entry[2], Exception):
+                        raise entry[2]
+                    return deepcopy(entry[2])
+                in_flight = self._in_flight.get(key)
+                if in_flight is None:
+                    in_flight = self._in_flight[key] = threading.Event()
+                    break
+            # Someone else is fetching it, wait and look again
+            in_flight.wait()
+
+        metrics.record_cache(template, False)
+        try:
+            response = fetch()
+        except prawcore.exceptions.NotFound as e:
+            self._store(key, template, e)  # e.g. deleted users, no need to ask again
+            raise
+        else:
+            self._store(key, template, deepcopy(response))
+            return response
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            in_flight.set()
+
+    def _store(self, key: tuple, template: str, value) -> None:
+        with self._lock:
+            self._entries[key] = (template, time.monotonic() + RequestCache.TTL[template], value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > RequestCache.MAX_ENTRIES:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, template: str | None = None) -> None:
+        """Forget the cached responses of an endpoint template, or all of them."""
+        with self._lock:
+            for key in [k for k, v in self._entries.items() if template is None or v[0] == template]:
+                del self._entries[key]
+
+
+class CachingSession(prawcore.Session):
+    """Sends PRAW's requests through a RequestCache, retrying forever and recording the rate limit waits.
+    Reddit.__init__ builds one in place of each session PRAW prepared, keeping its authorizer."""
+
+    def __init__(self, *, authorizer, window_size: int, cache: RequestCache) -> None:
+        super().__init__(authorizer=authorizer, window_size=window_size)
+        self._rate_limiter = InstrumentedRateLimiter(window_size=window_size)
+        self._retry_strategy_class = InfiniteRetryStrategy
+        self.cache = cache
+
+    def request(self, *args, **kwargs):
+        method = kwargs.get("method", args[0] if len(args) > 0 else "")
+        path = kwargs.get("path", args[1] if len(args) > 1 else "")
+        return self.cache.get(method, path, kwargs.get("params"), lambda: super(CachingSession, self).request(*args, **kwargs))
+
+
+class ModRoster:
+    """A sub's moderators, fetched in one request and kept for TTL seconds,
+    so checking if someone is a mod doesn't cost a request.
+    ModlogAgent invalidates it when it sees the mod team change."""
+
+    TTL = 6 * 60 * 60
+
+    def __init__(self, reddit: "Reddit", subreddit: str) -> None:
+        self._reddit = reddit
+        self.subreddit = subreddit
+        self._names = None
+        self._folded = None
+        self._expiry = 0
+        self._lock = threading.Lock()
+
+    def __deepcopy__(self, memo):
+        return self  # See RequestCache.__deepcopy__
+
+    def _load(self) -> None:
+        with self._lock:
+            if self._names is None or time.monotonic() > self._expiry:
+                log.debug(f"Fetching the moderators of r/{self.subreddit}.")
+                self._names = frozenset(mod.name for mod in self._reddit.subreddit(self.subreddit).moderator())
+                self._folded = frozenset(name.casefold() for name in self._names)
+                self._expiry = time.monotonic() + ModRoster.TTL
+
+    def names(self) -> frozenset[str]:
+        self._load()
+        return self._names
+
+    def __contains__(self, username: str) -> bool:
+        self._load()
+        return username.casefold() in self._folded
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._names = None
+
+
 class Reddit(praw.Reddit):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self._core._retry_strategy_class = InfiniteRetryStrategy
-
-
+        self.cache = RequestCache()
+        # PRAW builds its sessions itself, replace them (no request was sent yet) and keep which one is in use
+        read_only = self._core is self._read_only_core
+        self._authorized_core = self._caching_session(self._authorized_core)
+        self._read_only_core = self._caching_session(self._read_only_core)
+        self._core = self._read_only_core if read_only else self._authorized_core
+        self._mod_rosters = {}  # Casefolded sub name -> ModRoster
+
+    def _caching_session(self, core: prawcore.Session | None) -> CachingSession | None:
+        if core is None:
+            return None
+        return CachingSession(authorizer=core._authorizer, window_size=self.config.window_size, cache=self.cache)
 
     @property
     def sub(self):
+        """The sub currently being worked on (see Settings.use_subreddit)."""
         return self.subreddit(settings.subreddit)
 
+    @property
+    def mod_roster(self) -> ModRoster:
+        """Moderators of the sub currently being worked on."""
+        subreddit = settings.subreddit.casefold()
+        if subreddit not in self._mod_rosters:
+            self._mod_rosters[subreddit] = ModRoster(self, settings.subreddit)
+        return self._mod_rosters[subreddit]
+
     def user_exists(self, username: str) -> bool:
         """Check if a user exists on reddit."""
         try:
@@ -134,7 +350,7 @@ class Reddit(praw.Reddit):
         """Check if a user is a mod in your sub"""
         if isinstance(username, praw.reddit.models.Redditor):
             username = username.name
-        return len(self.sub.moderator(username)) > 0
+        return username in self.mod_roster
 
 
 _reddit = None
@@ -146,34 +362,62 @@ def reddit() -> praw.Reddit:
     return _reddit
 
 
-def login() -> praw.Reddit:
+def _check_login(moderator: bool = True) -> None:
+    """Check that we're logged in (as a mod of the subs we serve unless moderator is False)."""
+    me = _reddit.user.me(use_cache=False).name
+    log.info(f"Logged in to Reddit as u/{me}")
+    if not moderator:
+        return
+
+    for subreddit in settings.all_subreddits:
+        try:
+            if not _reddit.subreddit(subreddit).user_is_moderator:
+                raise Exception(f"u/{me} is not a mod in r/{subreddit}")
+        except prawcore.exceptions.Forbidden:
+            raise Exception(f"r/{subreddit} is private or quarantined.")
+        except prawcore.exceptions.NotFound:
+            raise Exception(f"r/{subreddit} is banned.")
+    snapshot.put("me", me)
+
+
+def login(session=None, moderator: bool = True) -> praw.Reddit:
+    """Log in to reddit with the credentials from the settings.
+    A requests-compatible session can be given to talk to something else than reddit.com,
+    e.g. drbot.offline.FakeSession to run the bot against recorded or synthetic traffic.
+    Workers (see worker.py) log in with moderator=False, their accounts only read."""
     global _reddit
 
+    tracer.configure(settings.trace_sample_rate, settings.trace_file)
+    requestor_kwargs = {} if session is None else {"session": session}
     if settings.refresh_token != "":
         with open(DRBOT_CLIENT_ID_PATH, "r") as f:
             drbot_client_id = f.read()
         _reddit = Reddit(client_id=drbot_client_id,
                          client_secret=None,
                          refresh_token=settings.refresh_token,
-                         #requestor_class=JSONDebugRequestor,
+                         requestor_class=TracingRequestor,
+                         requestor_kwargs=requestor_kwargs,
                          user_agent="Moderation helper https://github.com/0xAnansi/AutobanBOT v1.0 (by /u/FromModToSirius")
     else:
         _reddit = Reddit(client_id=settings.client_id,
                          client_secret=settings.client_secret,
                          username=settings.username,
                          password=settings.password,
-                         #requestor_class=JSONDebugRequestor,
+                         requestor_class=TracingRequestor,
+                         requestor_kwargs=requestor_kwargs,
                          user_agent="Moderation helper https://github.com/0xAnansi/AutobanBOT v1.0 (by /u/FromModToSirius")
 
-    log.info(f"Logged in to Reddit as u/{_reddit.user.me().name}")
+    if not moderator:
+        _check_login(moderator=False)
+        return _reddit
 
-    try:
-        if not _reddit.subreddit(settings.subreddit).user_is_moderator:
-            raise Exception(f"u/{_reddit.user.me().name} is not a mod in r/{settings.subreddit}")
-    except prawcore.exceptions.Forbidden:
-        raise Exception(f"r/{settings.subreddit} is private or quarantined.")
-    except prawcore.exceptions.NotFound:
-        raise Exception(f"r/{settings.subreddit} is banned.")
+    me = snapshot.get("me", revalidate=_check_login)
+    if me is None:
+        _check_login()
+    else:
+        # Saves looking ourselves up again, PRAW would only do it once anyway
+        _reddit.user._me = praw.models.Redditor(_reddit, name=me)
+        log.info(f"Logged in to Reddit as u/{me} (from the startup snapshot)")
 
     # Set up logging to modmail for non test run
     if not settings.dry_run and settings.modmail_logging:
@@ -195,5 +439,7 @@ def login() -> praw.Reddit:
         modmail_handler.setLevel(logging.ERROR)
         log.addHandler(modmail_handler)
 
+    return _reddit
+
 
 reddit.login = login
@@ -0,0 +1,118 @@
+from __future__ import annotations
+from importlib import import_module
+from drbot import settings, log
+from drbot.handlers import Handler
+from drbot.agents import HandlerAgent
+from drbot.stores import DataStore
+
+
+# Everything the bot can run, with its default state and cadence (in seconds).
+# Each entry can be overridden in the settings, e.g. [agents.CommentAgent] or [handlers.PointsHandler].
+AGENTS = {
+    "ModlogAgent": {"enabled": True, "every": 30,
+                    "handlers": ["ModQueueCleanerHandler", "ModNotesHandler", "PointsHandler", "AdminHandler",
+                                 "ConfigEditHandler", "SelfModerationHandler"]},
+    "CommentAgent": {"enabled": True, "every": 30,
+                     "handlers": ["AutobanHandler", "SpecialUserStatusHandler", "PollHandler", "ConstantPollingHandler"]},
+    "ModmailAgent": {"enabled": False, "every": 60,
+                     "handlers": ["ModmailMobileLinkHandler"]},
+}
+
+# jobs are methods of the handler run on their own schedule, on top of the items of their agent
+HANDLERS = {
+    "ModQueueCleanerHandler": {"enabled": True, "jobs": {}},
+    "ModNotesHandler": {"enabled": True, "jobs": {"migrate_all": 60}},
+    "PointsHandler": {"enabled": True, "jobs": {"scan_all": 12 * 60 * 60}},
+    "AdminHandler": {"enabled": True, "jobs": {}},
+    "ConfigEditHandler": {"enabled": True, "jobs": {}},
+    "SelfModerationHandler": {"enabled": False, "jobs": {}},
+    "AutobanHandler": {"enabled": True, "jobs": {}},
+    "SpecialUserStatusHandler": {"enabled": True, "jobs": {}},
+    "PollHandler": {"enabled": True, "jobs": {"run_tally": 12 * 60 * 60}},
+    "ConstantPollingHandler": {"enabled": False, "jobs": {"run_tally": 12 * 60 * 60}},
+    "ModmailMobileLinkHandler": {"enabled": True, "jobs": {}},
+}
+
+
+class LazyHandler(Handler):
+    """Stands in for a handler until it's needed.
+    Setting up a handler often means requests (Toolbox notes, removal reasons...), so the real one
+    is only created when its agent has items for it or one of its jobs runs."""
+
+    def __init__(self, cls: type[Handler]) -> None:
+        super().__init__(cls.__name__)
+        self.cls = cls
+        self.handled_actions = cls.handled_actions
+        self._handler = None
+
+    @property
+    def handler(self) -> Handler:
+        if self._handler is None:
+            log.info(f"Setting up {self.name}.")
+            handler = self.cls()
+            handler.setup(self.agent)
+            self._handler = handler
+        return self._handler
+
+    def start_run(self) -> None:
+        self.handler.start_run()
+
+    def end_run(self) -> None:
+        self.handler.end_run()
+
+    def handle(self, item) -> None:
+        self.handler.handle(item)
+
+    def job(self, method: str):
+        """Callable running one of the handler's methods, for the scheduler."""
+        def run():
+            return getattr(self.handler, method)()
+        run.__qualname__ = f"{self.name}.{method}"
+        return run
+
+
+def config(kind: str, name: str) -> dict:
+    """Settings of an agent (kind "agents") or handler (kind "handlers"): its defaults, overridden by the settings."""
+    defaults = (AGENTS if kind == "agents" else HANDLERS)[name]
+    overrides = {k.casefold(): v for k, v in getattr(settings, kind).items()}.get(name.casefold(), {})
+    result = {k: v for k, v in defaults.items() if k != "jobs"} | {k: v for k, v in overrides.items() if k != "jobs"}
+    if "jobs" in defaults:
+        jobs = dict(defaults["jobs"])
+        for job, every in overrides.get("jobs", {}).items():
+            if job not in jobs:
+                log.warning(f"Unknown job '{job}' for {name} in the settings, ignoring it.")
+                continue
+            jobs[job] = every
+        result["jobs"] = jobs
+    return result
+
+
+def build(data_store: DataStore, schedule) -> list[HandlerAgent]:
+    """Create the agents and handlers turned on in the settings of the current sub and schedule them."""
+    for kind, known in (("agents", AGENTS), ("handlers", HANDLERS)):
+        for name in getattr(settings, kind):
+            if name.casefold() not in {k.casefold() for k in known}:
+                log.warning(f"Unknown {kind[:-1]} '{name}' in the settings, ignoring it.")
+
+    agents = []
+    for agent_name in AGENTS:
+        agent_config = config("agents", agent_name)
+        if not agent_config["enabled"]:
+            log.info(f"{agent_name} is turned off.")
+            continue
+        handler_names = [h for h in agent_config["handlers"] if config("handlers", h)["enabled"]]
+        if len(handler_names) == 0:
+            log.info(f"{agent_name} is not started since all of its handlers are turned off.")
+            continue
+
+        agent = getattr(import_module("drbot.agents"), agent_name)(data_store)
+        for handler_name in handler_names:
+            handler = LazyHandler(getattr(import_module("drbot.handlers"), handler_name))
+            agent.register(handler)
+            for job, every in config("handlers", handler_name)["jobs"].items():
+                if every > 0:
+                    schedule.every(every).seconds.do(settings.bind(handler.job(job))).tag("no_initial")
+        schedule.every(agent_config["every"]).seconds.do(settings.bind(agent.run))
+        log.info(f"{agent.label} runs every {agent_config['every']}s with {', '.join(handler_names)}.")
+        agents.append(agent)
+    return agents
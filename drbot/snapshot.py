@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import time
+from drbot import settings, log
+
+
+class StartupSnapshot:
+    """Results of the requests the bot makes when starting (who it is, the latest modlog entry and comment,
+    the removal reasons, the state of the data page...), saved locally so a restart can skip them.
+    Everything served from the snapshot registers a check that re-fetches it, run by revalidate()
+    shortly after startup, so a crash loop doesn't spend the request budget or delay moderation
+    but stale values don't stick around either.
+    Keys are kept per sub, for the sub currently being worked on (see Settings.use_subreddit)."""
+
+    # Older snapshots are ignored
+    MAX_AGE = 24 * 60 * 60
+
+    def __init__(self) -> None:
+        self.path = ""
+        self.entries = {}
+        self._pending = {}  # key -> revalidation
+
+    def load(self, path: str) -> None:
+        """Load the snapshot of the previous run, if there's a recent one for this sub."""
+        from drbot.stores import DataStore
+
+        self.path = path
+        if path == "" or not os.path.isfile(path):
+            return
+        try:
+            with open(path, "r") as f:
+                data = json.load(f, object_hook=DataStore._json_decoder)
+        except (OSError, ValueError) as e:
+            log.warning(f"Ignoring unreadable startup snapshot {path}: {e}")
+            return
+        age = time.time() - data.get("saved", 0)
+        # The snapshot is the bot's, stamped with its main sub (the entries are kept per sub, see _key)
+        if data.get("subreddit") != settings.all_subreddits[0] or age > StartupSnapshot.MAX_AGE:
+            log.info(f"Ignoring startup snapshot {path} ({'other bot' if data.get('subreddit') != settings.all_subreddits[0] else 'too old'}).")
+            return
+        self.entries = data["entries"]
+        log.info(f"Starting from the startup snapshot of {age / 60:.0f} minutes ago ({len(self.entries)} entries).")
+
+    @staticmethod
+    def _key(key: str) -> str:
+        return f"{settings.subreddit.casefold()}/{key}"
+
+    def get(self, key: str, revalidate=None):
+        """The value saved under key, or None.
+        If a value is returned, revalidate() (if given) is called later to re-fetch it and fix what was done with it."""
+        key = self._key(key)
+        if key not in self.entries:
+            return None
+        if revalidate is not None:
+            self._pending[key] = settings.bind(revalidate)
+        return self.entries[key]
+
+    def put(self, key: str, value) -> None:
+        if self.path == "":
+            return  # No snapshot file, nothing to remember
+        self.entries[self._key(key)] = value
+
+    def save(self) -> None:
+        from drbot.stores import DataStore
+
+        if self.path == "":
+            return
+        data = {"saved": time.time(), "subreddit": settings.all_subreddits[0], "entries": self.entries}
+        temp = f"{self.path}.tmp"
+        with open(temp, "w") as f:
+            json.dump(data, f, default=DataStore._json_encoder)
+        os.replace(temp, self.path)  # Never leave a half-written snapshot behind
+
+    def revalidate(self) -> None:
+        """Re-fetch everything that was served from the snapshot."""
+        if len(self._pending) == 0:
+            return
+        log.info(f"Revalidating {len(self._pending)} startup snapshot entries.")
+        pending, self._pending = self._pending, {}
+        for key, revalidate in pending.items():
+            try:
+                revalidate()
+            except Exception as e:
+                log.error(f"Couldn't revalidate {key} from the startup snapshot: {e}")
+        self.save()
+
+    @staticmethod
+    def fingerprint(content: str) -> str:
+        """Marker of a page's content, to tell if it changed without keeping it."""
+        return hashlib.sha1(content.encode()).hexdigest()
+
+
+snapshot = StartupSnapshot()
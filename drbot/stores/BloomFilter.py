@@ -0,0 +1,79 @@
+from __future__ import annotations
+import base64
+import hashlib
+import math
+import time
+import zlib
+
+
+class BloomFilter:
+    """Set of strings answering "probably added" or "surely not added", in a fixed amount of memory
+    (about 1.7 bytes per item for a 1% error rate over 7 buckets, where a set of usernames takes ~60).
+    Items go into the newest of a series of buckets each covering bucket_seconds, and buckets older than
+    max_age are dropped, so an item is forgotten between max_age - bucket_seconds and max_age after being added.
+    A lookup is a false positive if any bucket gives one, so each bucket is sized for error_rate divided by the
+    number of buckets, for the whole filter to stay under error_rate. A full bucket doesn't take new items
+    until the next one starts, since it would then give more false positives than it was sized for."""
+
+    def __init__(self, capacity: int, max_age: int, bucket_seconds: int = 24 * 60 * 60, error_rate: float = 0.01) -> None:
+        self.capacity = capacity  # Items per bucket
+        self.max_age = max_age
+        self.bucket_seconds = bucket_seconds
+        self.error_rate = error_rate
+        bucket_error_rate = error_rate / math.ceil(max_age / bucket_seconds)
+        self.size = math.ceil(-capacity * math.log(bucket_error_rate) / math.log(2) ** 2)  # Bits per bucket
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.buckets = []  # [start, count, bits], oldest first
+        self.changed = False
+
+    def _positions(self, item: str) -> list[int]:
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def _expire(self, now: float) -> None:
+        kept = [b for b in self.buckets if b[0] > now - self.max_age]
+        if len(kept) < len(self.buckets):
+            self.buckets = kept
+            self.changed = True
+
+    def add(self, item: str) -> None:
+        now = time.time()
+        self._expire(now)
+        if len(self.buckets) == 0 or self.buckets[-1][0] + self.bucket_seconds <= now:
+            self.buckets.append([now, 0, bytearray((self.size + 7) // 8)])
+        bucket = self.buckets[-1]
+        if bucket[1] >= self.capacity:
+            return
+        for p in self._positions(item):
+            bucket[2][p >> 3] |= 1 << (p & 7)
+        bucket[1] += 1
+        self.changed = True
+
+    def __contains__(self, item: str) -> bool:
+        self._expire(time.time())
+        positions = self._positions(item)
+        return any(all(bits[p >> 3] & (1 << (p & 7)) for p in positions) for start, count, bits in self.buckets)
+
+    def __len__(self) -> int:
+        """Number of items added (and not forgotten yet), counting repeats."""
+        return sum(count for start, count, bits in self.buckets)
+
+    def clear(self) -> None:
+        self.buckets = []
+        self.changed = True
+
+    def to_dict(self) -> dict:
+        """The filter as something that fits in a DataStore, with the bits compressed."""
+        return {"capacity": self.capacity, "error_rate": self.error_rate, "bucket_seconds": self.bucket_seconds, "size": self.size,
+                "buckets": [{"start": start, "count": count, "bits": base64.b64encode(zlib.compress(bytes(bits), 9)).decode()}
+                            for start, count, bits in self.buckets]}
+
+    def load(self, d: dict) -> bool:
+        """Restore the buckets saved by to_dict. They're dropped (and False is returned) if they were made with other parameters."""
+        if (d.get("capacity"), d.get("error_rate"), d.get("bucket_seconds"), d.get("size")) != (self.capacity, self.error_rate, self.bucket_seconds, self.size):
+            return False
+        self.buckets = [[b["start"], b["count"], bytearray(zlib.decompress(base64.b64decode(b["bits"])))] for b in d["buckets"]]
+        self._expire(time.time())
+        self.changed = False
+        return True
@@ -3,7 +3,7 @@ import json
 import os
 from pathlib import Path
 from typing import Any
-from drbot import settings, log
+from drbot import settings, log, metrics
 
 
 class DataStore(dict):
@@ -35,6 +35,14 @@ class DataStore(dict):
             self[k] = v
         assert "_meta" in self
 
+    def merge_json(self, s: str, base: str) -> None:
+        """Merge a JSON dump edited elsewhere into the DataStore, base being the dump the DataStore was loaded from.
+        Values that changed since base are kept, the others are taken from the dump (or removed if it dropped them)."""
+
+        theirs = json.loads(s, object_hook=DataStore._json_decoder)
+        _merge(self, theirs, json.loads(base, object_hook=DataStore._json_decoder))
+        assert "_meta" in self
+
     def from_backup(self):
         if os.path.isfile(settings.local_backup_file):
             contents = Path(settings.local_backup_file).read_text()
@@ -48,5 +56,23 @@ class DataStore(dict):
 
         if settings.local_backup_file != "":
             log.debug(f"Backing up data locally ({settings.local_backup_file}).")
+            dump = self.to_json()
+            metrics.set_gauge("datastore_bytes", len(dump), store="local")
             with open(settings.local_backup_file, "w") as f:
-                f.write(self.to_json())
+                f.write(dump)
+
+
+_MISSING = object()
+
+
+def _merge(ours: dict, theirs: dict, base: dict) -> None:
+    """Three-way merge of theirs into ours, key by key, recursing into dicts changed on both sides."""
+    for key in set(ours) | set(theirs):
+        mine, other, old = ours.get(key, _MISSING), theirs.get(key, _MISSING), base.get(key, _MISSING)
+        if mine == old:
+            if other is _MISSING:
+                ours.pop(key, None)
+            else:
+                ours[key] = other
+        elif isinstance(mine, dict) and isinstance(other, dict) and other != old:
+            _merge(mine, other, old if isinstance(old, dict) else {})
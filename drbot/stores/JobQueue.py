@@ -0,0 +1,119 @@
+from __future__ import annotations
+import json
+import os
+import sqlite3
+import time
+from dataclasses import dataclass
+
+
+@dataclass
+class Job:
+    id: int
+    kind: str
+    subreddit: str
+    payload: dict
+
+
+class JobQueue:
+    """Queue of jobs shared by the bot (the coordinator) and worker processes on the same host, in an SQLite file.
+    A claimed job is leased to its worker for LEASE seconds: if the worker dies, someone else picks it up again.
+    A job that fails is left alone for a while (exponential backoff) before being claimed again, and given up on
+    after MAX_ATTEMPTS. Jobs stay in the queue until the coordinator collects their results, so a restart doesn't lose them."""
+
+    # Seconds a worker has to finish a job it claimed
+    LEASE = 120
+    # Failures before giving up on a job, and seconds before the first retry (doubled at each one)
+    MAX_ATTEMPTS = 3
+    BACKOFF_BASE = 10
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            subreddit TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            worker TEXT,
+            claimed REAL,
+            done INTEGER NOT NULL DEFAULT 0,
+            result TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            not_before REAL,
+            error TEXT)""")
+        # Queues made before retries were counted
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(jobs)")}
+        for column, definition in (("attempts", "INTEGER NOT NULL DEFAULT 0"), ("not_before", "REAL"), ("error", "TEXT")):
+            if column not in columns:
+                self._db.execute(f"ALTER TABLE jobs ADD COLUMN {column} {definition}")
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_waiting ON jobs (kind, subreddit, done, claimed)")
+
+    def put(self, kind: str, subreddit: str, payload: dict) -> int:
+        return self._db.execute("INSERT INTO jobs (kind, subreddit, payload) VALUES (?, ?, ?)",
+                                (kind, subreddit, json.dumps(payload))).lastrowid
+
+    def claim(self, worker: str, kind: str, subreddit: str | None = None) -> Job | None:
+        """Take the oldest job nobody is working on (or whose worker's lease ran out) and not waiting to be retried, if there's one."""
+        now = time.time()
+        row = self._db.execute(
+            """UPDATE jobs SET worker = ?, claimed = ?
+               WHERE id = (SELECT id FROM jobs WHERE kind = ? AND done = 0 AND (claimed IS NULL OR claimed < ?)
+                           AND (not_before IS NULL OR not_before <= ?) AND (? IS NULL OR subreddit = ?) ORDER BY id LIMIT 1)
+               RETURNING id, kind, subreddit, payload""",
+            (worker, now, kind, now - JobQueue.LEASE, now, subreddit, subreddit)).fetchone()
+        if row is None:
+            return None
+        return Job(row[0], row[1], row[2], json.loads(row[3]))
+
+    def finish(self, job_id: int, result, error: str | None = None) -> None:
+        """Mark a job done with its result, or with the error it was given up on (see failed)."""
+        self._db.execute("UPDATE jobs SET done = 1, result = ?, error = ? WHERE id = ?", (json.dumps(result), error, job_id))
+
+    def release(self, job_id: int) -> None:
+        """Give a claimed job back for someone else to do, e.g. a worker that can't do it."""
+        self._db.execute("UPDATE jobs SET worker = NULL, claimed = NULL WHERE id = ? AND done = 0", (job_id,))
+
+    def fail(self, job_id: int, error: str) -> bool:
+        """Give a claimed job back after it failed, to be retried after a backoff.
+        Returns False if it failed MAX_ATTEMPTS times: it's then given up on, done with a None result."""
+        row = self._db.execute("UPDATE jobs SET attempts = attempts + 1, error = ? WHERE id = ? RETURNING attempts",
+                               (error, job_id)).fetchone()
+        if row is None:
+            return False
+        if row[0] >= JobQueue.MAX_ATTEMPTS:
+            self.finish(job_id, None, error)
+            return False
+        self._db.execute("UPDATE jobs SET worker = NULL, claimed = NULL, not_before = ? WHERE id = ? AND done = 0",
+                         (time.time() + JobQueue.BACKOFF_BASE * 2 ** (row[0] - 1), job_id))
+        return True
+
+    def results(self, job_ids: list[int]) -> dict[int, object]:
+        """Results of the jobs among job_ids that are done."""
+        results = {}
+        for i in range(0, len(job_ids), 500):  # SQLite limits the number of parameters
+            chunk = job_ids[i:i + 500]
+            rows = self._db.execute(f"SELECT id, result FROM jobs WHERE done = 1 AND id IN ({','.join('?' * len(chunk))})", chunk)
+            results.update({row[0]: json.loads(row[1]) for row in rows})
+        return results
+
+    def failed(self, job_ids: list[int]) -> set[int]:
+        """The jobs among job_ids that were given up on."""
+        failed = set()
+        for i in range(0, len(job_ids), 500):
+            chunk = job_ids[i:i + 500]
+            rows = self._db.execute(f"SELECT id FROM jobs WHERE done = 1 AND error IS NOT NULL AND id IN ({','.join('?' * len(chunk))})", chunk)
+            failed.update(row[0] for row in rows)
+        return failed
+
+    def jobs(self, kind: str, subreddit: str) -> list[Job]:
+        """All the jobs of a kind still in the queue, done or not."""
+        rows = self._db.execute("SELECT id, kind, subreddit, payload FROM jobs WHERE kind = ? AND subreddit = ? ORDER BY id",
+                                (kind, subreddit))
+        return [Job(row[0], row[1], row[2], json.loads(row[3])) for row in rows]
+
+    def delete(self, job_ids: list[int]) -> None:
+        for i in range(0, len(job_ids), 500):
+            chunk = job_ids[i:i + 500]
+            self._db.execute(f"DELETE FROM jobs WHERE id IN ({','.join('?' * len(chunk))})", chunk)
@@ -5,11 +5,19 @@ from drbot.util import get_dupes
 
 class MonitoredSubsMap:
     """
-    Class that handles the mapping between removal reasons and their point costs.
-    Also manages info about expiration durations.
+    Class that handles the mapping between monitored subs and the action to take on their users.
+    Subs are matched case-insensitively, and by fullname (t5_...) once they've been seen,
+    so matching an item of a user's history is a dict lookup on what the listing already gave us.
     """
 
-    def refresh_values(self):
+    # Actions, the one taking precedence first when a user posted in several monitored subs
+    ACTIONS = ["ban", "remove", "report", "watch", "modalert"]
+
+    def refresh_values(self, force: bool = False):
+        """Rebuild the map from the settings, only if they changed since the last build."""
+        revision = settings.revision
+        if not force and revision == self._settings_revision:
+            return
         log.info("Loading monitored subs and actions.")
 
         # Check for dupes
@@ -22,6 +30,9 @@ class MonitoredSubsMap:
         # Build the map
         subs_map = {}
         for x in settings.monitored_subs:
+            if x["id"].casefold() == settings.subreddit.casefold():
+                log.error(f"r/{x['id']} is our own sub, it can't be a monitored sub.")
+                continue
             subs_map[x["id"]] = {"action": str(x["action"]), "sub_name": str(x["id"])}
             if "label" in x:
                 subs_map[x["id"]]["label"] = str(x["label"])
@@ -30,18 +41,46 @@ class MonitoredSubsMap:
         log.debug(f"Subs map: {json.dumps(subs_map)}")
 
         self.subs_map = subs_map
+        self._by_name = {sub.casefold(): rule for sub, rule in subs_map.items()}
+        # Fullnames learned from the listings, kept across rebuilds as long as the sub is still monitored
+        self._names_by_id = {i: name for i, name in self._names_by_id.items() if name in self._by_name}
+        self.top_rank = min((self.rank(rule) for rule in subs_map.values()), default=len(MonitoredSubsMap.ACTIONS))
+        self._settings_revision = revision
 
     def __init__(self):
         self.subs_map = {}
+        self._by_name = {}  # Casefolded sub name -> rule
+        self._names_by_id = {}  # Sub fullname -> casefolded name, for the monitored subs
+        self.top_rank = len(MonitoredSubsMap.ACTIONS)  # Rank of the most severe action of the map
+        self._settings_revision = None
         self.refresh_values()
 
     def __getitem__(self, sub):
-        """Get the entry for a sub."""
-        if sub not in self.subs_map:
+        """Get the entry for a sub (in any case)."""
+        if sub.casefold() not in self._by_name:
             log.debug(f"Unknown entry for sub '{sub}'")
             return
 
-        return self.subs_map[sub]
+        return self._by_name[sub.casefold()]
+
+    def __contains__(self, sub) -> bool:
+        return sub.casefold() in self._by_name
+
+    def match(self, item):
+        """The rule of the monitored sub a comment or submission from a listing was posted in, or None.
+        Uses the subreddit_id and name that came with the listing, so it never makes a request."""
+        name = self._names_by_id.get(item.subreddit_id)
+        if name is None:
+            name = item.subreddit.display_name.casefold()
+            if name not in self._by_name:
+                return None
+            self._names_by_id[item.subreddit_id] = name
+        return self._by_name[name]
+
+    @staticmethod
+    def rank(rule) -> int:
+        """Precedence of a rule's action, 0 being the most severe."""
+        return MonitoredSubsMap.ACTIONS.index(rule["action"])
 
     def get_note(self, sub):
         """Get the expiration months for a removal reason (or the default if no special duration is specified)."""
@@ -1,5 +1,6 @@
 import json
-from drbot import settings, log, reddit
+import time
+from drbot import settings, log, reddit, metrics, snapshot
 from drbot.util import get_dupes
 
 
@@ -9,7 +10,35 @@ class PointMap:
     Also manages info about expiration durations.
     """
 
-    def refresh_values(self):
+    # How long the removal reasons of the sub are trusted before being fetched again, in seconds
+    REMOVAL_REASONS_TTL = 6 * 60 * 60
+
+    def get_removal_reasons(self, force: bool = False) -> set:
+        """Titles of the sub's removal reasons, cached for REMOVAL_REASONS_TTL."""
+        if self._removal_reasons is None and not force:
+            saved = snapshot.get("removal_reasons", revalidate=lambda: self.get_removal_reasons(force=True))
+            if saved is not None:
+                self._removal_reasons = set(saved)
+                self._removal_reasons_time = time.monotonic()
+        hit = not force and self._removal_reasons is not None and time.monotonic() - self._removal_reasons_time <= PointMap.REMOVAL_REASONS_TTL
+        metrics.record_cache("removal_reasons", hit)
+        if not hit:
+            log.debug("Fetching removal reasons of the sub.")
+            self._removal_reasons = set(r.title for r in reddit().sub.mod.removal_reasons)
+            self._removal_reasons_time = time.monotonic()
+            snapshot.put("removal_reasons", sorted(self._removal_reasons))
+        return self._removal_reasons
+
+    def refresh_values(self, force: bool = False):
+        """Rebuild the map from the settings, only if they changed since the last build."""
+        revision = settings.revision
+        if force or revision != self._settings_revision:
+            self._build_map()
+            self._settings_revision = revision
+            self._checked_reasons = None
+        self._check_missing_reasons()
+
+    def _build_map(self):
         log.info("Loading removal reasons.")
 
         # Check for dupes
@@ -27,18 +56,29 @@ class PointMap:
                 point_map["expires"] = int(x["expires"])
         log.debug(f"Point map: {json.dumps(point_map)}")
 
+        self.point_map = point_map
+
+    def _check_missing_reasons(self):
+        # Only warn again when the map or the sub's removal reasons changed
+        reasons = self.get_removal_reasons()
+        if self._checked_reasons is reasons:
+            return
+        self._checked_reasons = reasons
+
         # Check for removal reasons on your sub that aren't in the map
-        missing_reasons = set(r.title for r in reddit().sub.mod.removal_reasons) - set(point_map.keys())
+        missing_reasons = reasons - set(self.point_map.keys())
         if len(missing_reasons) > 0:
             message = "Some removal reasons on your sub don't have an entry in config/settings.toml (they will be treated as costing 0 points):"
             for r in missing_reasons:
                 message += f"\n\t{r}"
             log.warning(message)
 
-        self.point_map = point_map
-
     def __init__(self):
         self.point_map = {}
+        self._settings_revision = None
+        self._removal_reasons = None
+        self._removal_reasons_time = 0.0
+        self._checked_reasons = None
         self.refresh_values()
 
     def __getitem__(self, removal_reason):
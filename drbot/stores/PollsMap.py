@@ -9,7 +9,11 @@ class PollsMap:
     Also manages info about expiration durations.
     """
 
-    def refresh_values(self):
+    def refresh_values(self, force: bool = False):
+        """Rebuild the map from the settings, only if they changed since the last build."""
+        revision = settings.revision
+        if not force and revision == self._settings_revision:
+            return
         log.info("Loading polls actions.")
 
         # Check for dupes
@@ -33,9 +37,11 @@ class PollsMap:
         log.debug(f"Polls map: {json.dumps(polls_map)}")
 
         self.polls = polls_map
+        self._settings_revision = revision
 
     def __init__(self):
         self.polls = {}
+        self._settings_revision = None
         self.refresh_values()
 
     def __getitem__(self, poll):
@@ -1,25 +1,28 @@
 import os
 import re
 from prawcore.exceptions import NotFound
-from drbot import settings, log, reddit
+from drbot import settings, log, reddit, metrics, snapshot
+from drbot.config import SETTINGS_PATH
 from drbot.stores import DataStore
 
 
 class WikiStore:
-    ROOT_PAGE = f"{settings.wiki_page}"
-    DATA_PAGE = f"{settings.wiki_page}/data"
-    SETTINGS_PAGE = f"{settings.wiki_page}/settings"
     MAX_PAGE_SIZE = 524288  # Experimentally verified
-    SETTINGS_PATH = "data/settings.toml"
 
     def __init__(self, data_store: DataStore):
         assert settings.wiki_page != ""
 
+        # The pages of the sub this store is created for
+        self.root_page = f"{settings.wiki_page}"
+        self.data_page = f"{settings.wiki_page}/data"
+        self.settings_page = f"{settings.wiki_page}/settings"
         self.data_store = data_store
+        # What the local backup held when the data store was loaded from it, see _revalidate
+        self._backup_dump = None
 
         # First time setup - wiki page creation
-        if not reddit().page_exists(settings.wiki_page):
-            self._create_pages()
+        if snapshot.get("wiki_pages_exist", revalidate=self._create_missing_pages) is None:
+            self._create_missing_pages()
         # else:
         #     data = reddit().sub.wiki[WikiStore.ROOT_PAGE].content_md
         #     log.info(f"Creating because data is [{data}]")
@@ -29,8 +32,14 @@ class WikiStore:
         self._load()
 
 
+    def _create_missing_pages(self) -> None:
+        if not reddit().page_exists(settings.wiki_page):
+            self._create_pages()
+        snapshot.put("wiki_pages_exist", True)
+
     def save_data_store(self) -> None:
         dump = f"// This page houses [DRBOT](https://github.com/c0d3rman/DRBOT)'s user records. **DO NOT EDIT!**\n\n{self.data_store.to_json()}"
+        metrics.set_gauge("datastore_bytes", len(dump), store="wiki")
 
         if len(dump) > WikiStore.MAX_PAGE_SIZE:
             log.error(f"Data is too long to be written to wiki! ({len(dump)}/{WikiStore.MAX_PAGE_SIZE} characters.) Check log for full data.")
@@ -39,13 +48,14 @@ class WikiStore:
 
         # Don't write if there's no change
         try:
-            data = reddit().sub.wiki[WikiStore.DATA_PAGE].content_md
+            data = reddit().sub.wiki[self.data_page].content_md
         except NotFound:
-            log.error(f"Somehow, tried to save wiki page {WikiStore.DATA_PAGE} without it existing.")
+            log.error(f"Somehow, tried to save wiki page {self.data_page} without it existing.")
             return
         else:
             if data == dump:
                 log.debug("Not saving to wiki because it's already identical to what we would save.")
+                snapshot.put("wiki_data", snapshot.fingerprint(dump))
                 return
 
         log.info("Saving data to wiki.")
@@ -55,30 +65,56 @@ class WikiStore:
             log.debug(f"Data that would be saved:\n\n{dump}")
             return
 
-        reddit().sub.wiki[WikiStore.DATA_PAGE].edit(
+        reddit().sub.wiki[self.data_page].edit(
             content=dump,
             reason="Automated page for DRBOT")
+        snapshot.put("wiki_data", snapshot.fingerprint(dump))
+        snapshot.save()
 
     def save(self) -> None:
         self.save_data_store()
         return
 
     def _load(self) -> None:
+        # The local backup is saved after every item, so it's at least as recent as the wiki page if that page
+        # is still what we last read or wrote there. That's checked after startup, see _revalidate.
+        if (settings.local_backup_file != "" and os.path.isfile(settings.local_backup_file)
+                and snapshot.get("wiki_data", revalidate=self._revalidate) is not None):
+            log.info("Loading data store from the local backup.")
+            self.data_store.from_backup()
+            self._backup_dump = self.data_store.to_json()
+            return
+        self._load_from_wiki()
+
+    def _revalidate(self) -> None:
+        """Merge the wiki data page into the data store if it changed since we last read or wrote it.
+        The agents have been running from the local backup by then, so what they changed since is kept."""
+        try:
+            data = reddit().sub.wiki[self.data_page].content_md
+        except NotFound:
+            return
+        if snapshot.fingerprint(data) != snapshot.get("wiki_data"):
+            log.warning(f"Wiki page {self.data_page} was edited while the bot was down, merging it into the data store.")
+            snapshot.put("wiki_data", snapshot.fingerprint(data))
+            self.data_store.merge_json(re.sub(r"^//.*?\n", "", data), self._backup_dump)
+
+    def _load_from_wiki(self) -> None:
         log.info("Loading data store from wiki.")
         try:
-            data = reddit().sub.wiki[WikiStore.DATA_PAGE].content_md
+            data = reddit().sub.wiki[self.data_page].content_md
         except NotFound:
             if settings.dry_run:
                 log.info("[DRY RUN: because dry-run mode is active, no wiki pages have been created, so no data was loaded from the wiki.]")
                 return
             raise Exception("WikiStore couldn't load data because the necessary pages don't exist! Are you trying to manually call _load()?")
+        snapshot.put("wiki_data", snapshot.fingerprint(data))
         data = re.sub(r"^//.*?\n", "", data)  # Remove comments
         self.data_store.from_json(data)
         log.info("Data loaded")
 
         # log.info("Loading settings from wiki.")
         # try:
-        #     data = reddit().sub.wiki[WikiStore.SETTINGS_PAGE].content_md
+        #     data = reddit().sub.wiki[self.settings_page].content_md
         # except NotFound:
         #     if settings.dry_run:
         #         log.info("[DRY RUN: because dry-run mode is active, no wiki pages have been created, so no data was loaded from the wiki.]")
@@ -100,19 +136,20 @@ class WikiStore:
         reddit().sub.wiki[settings.wiki_page].mod.update(listed=True, permlevel=2)  # Make it mod-only
 
         reddit().sub.wiki.create(
-            name=WikiStore.DATA_PAGE,
+            name=self.data_page,
             content="{}",
             reason="Automated page for DRBOT")
-        reddit().sub.wiki[WikiStore.DATA_PAGE].mod.update(listed=True, permlevel=2)  # Make it mod-only
+        reddit().sub.wiki[self.data_page].mod.update(listed=True, permlevel=2)  # Make it mod-only
 
         settings_content = ""
-        if os.path.isfile(self.SETTINGS_PATH):
-            with open(self.SETTINGS_PATH, "r") as f:
+        settings_path = settings.file if os.path.isfile(settings.file) else SETTINGS_PATH  # Extra subs start from the main settings
+        if os.path.isfile(settings_path):
+            with open(settings_path, "r") as f:
                 settings_content = f.read()
         reddit().sub.wiki.create(
-            name=WikiStore.SETTINGS_PAGE,
+            name=self.settings_page,
             content=settings_content,
             reason="Automated page for DRBOT")
-        reddit().sub.wiki[WikiStore.SETTINGS_PAGE].mod.update(listed=True, permlevel=2)  # Make it mod-only
+        reddit().sub.wiki[self.settings_page].mod.update(listed=True, permlevel=2)  # Make it mod-only
 
         self.save()  # Populate the pages
@@ -3,3 +3,5 @@ from drbot.stores.DataStore import DataStore
 from drbot.stores.WikiStore import WikiStore
 from drbot.stores.MonitoredSubsMap import MonitoredSubsMap
 
+from drbot.stores.JobQueue import JobQueue, Job
+from drbot.stores.BloomFilter import BloomFilter
@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+import time
+from typing import Tuple
+
+import prawcore
+from praw.exceptions import RedditAPIException
+from prawcore import TooManyRequests
+
+from drbot import log, reddit
+from drbot.handlers import Handler
+from drbot.tools.ToolBoxUtils import ToolBoxManipulator
+
+
+class ModNotesMigrator:
+    """
+    Copies Toolbox usernotes to reddit mod notes.
+    Existing mod notes are indexed by fingerprint (owner, date, label, normalized text) so every TB note is checked in O(1).
+    Progress of the bulk migration is checkpointed in the data store of the owning handler so it can resume after a restart.
+    """
+
+    def __init__(self, tb_manipulator: ToolBoxManipulator, handler: Handler):
+        self.tb_manipulator = tb_manipulator
+        self.handler = handler
+        self._last_run = None  # time.monotonic() of the last run, for the rate
+
+    @property
+    def checkpoint(self) -> dict:
+        # Always go through the handler since the data store slice is replaced when loaded from the wiki
+        data_store = self.handler.data_store
+        if "migration" not in data_store:
+            data_store["migration"] = {"last_user": None, "created": 0, "skipped_users": 0, "done": False}
+        return data_store["migration"]
+
+    def get_user_modnotes(self, username: str) -> list:
+        manual_retry = 1
+        while True:
+            try:
+                return list(reddit().sub.mod.notes.redditors(username, all_notes=True, params={"filter": "NOTE"}))
+            except TooManyRequests:
+                log.warning("Hitting rate limiting while fetching user notes, sleeping")
+                time.sleep(manual_retry * 10)
+                manual_retry += 1
+
+    def create_modnote(self, username: str, tb_note: dict) -> None:
+        label = self.tb_manipulator.get_note_modnote_label(tb_note)
+        date_s = self.tb_manipulator.get_note_date(tb_note)
+        note = f"{date_s} | {self.tb_manipulator.get_note_owner(tb_note)} | {self.tb_manipulator.get_note_content(tb_note)}"
+        thing = self.tb_manipulator.get_note_modnote_target(tb_note)
+        log.info(f"Creating mod note in new reddit from tb_note - user [{username}] label [{label}] content [{note}]")
+        manual_retry = 1
+        while manual_retry >= 1:
+            try:
+                reddit().sub.mod.notes.create(redditor=username, label=label, note=note, thing=thing)
+                manual_retry = 0
+            except TooManyRequests:
+                log.warning("Hitting rate limiting during note creation, sleeping")
+                time.sleep(manual_retry * 10)
+                manual_retry += 1
+
+    def migrate_user(self, username: str, budget: int | None = None) -> Tuple[int, bool]:
+        """Create the mod notes missing for one user's TB notes.
+        Returns the number of notes created and whether the user is complete, as it stops early once the budget is spent."""
+        tb_notes = self.tb_manipulator.get_user_notes(username)
+        if len(tb_notes) == 0:
+            return 0, True
+        index = self.tb_manipulator.build_modnote_index(self.get_user_modnotes(username))
+        created = 0
+        for tb_note in tb_notes:
+            if self.tb_manipulator.is_note_in_index(tb_note, index):
+                continue
+            if budget is not None and created >= budget:
+                return created, False
+            self.create_modnote(username, tb_note)
+            index.update(self.tb_manipulator.get_note_fingerprints(tb_note))
+            created += 1
+        return created, True
+
+    def run(self, rate: int, batch_size: int) -> bool:
+        """Migrate users in alphabetical order, resuming after the last checkpointed one.
+        Meant to be called regularly: it creates the notes that fit in rate notes per minute since the last call
+        (a minute's worth the first time), at most batch_size, and returns instead of waiting for more,
+        so it doesn't hold up the scheduler. Returns True once every user has been migrated."""
+        checkpoint = self.checkpoint
+        if checkpoint["done"]:
+            return True
+        if "started" not in checkpoint:
+            checkpoint["started"] = time.time()
+            log.info(f"Starting Toolbox to mod notes migration ({len(self.tb_manipulator.mod_notes)} users).")
+
+        now = time.monotonic()
+        elapsed = 60 if self._last_run is None else now - self._last_run
+        budget = min(batch_size, int(rate * elapsed / 60))
+        if budget <= 0:
+            return False
+        self._last_run = now
+        for username in sorted(self.tb_manipulator.mod_notes):
+            if checkpoint["last_user"] is not None and username <= checkpoint["last_user"]:
+                continue
+            if budget <= 0:
+                log.info(f"Migration paused after u/{checkpoint['last_user']} ({checkpoint['created']} notes created so far).")
+                return False
+            try:
+                created, complete = self.migrate_user(username, budget=budget)
+            except (prawcore.exceptions.NotFound, prawcore.exceptions.Forbidden, RedditAPIException) as e:
+                # Deleted or suspended accounts can't get notes
+                log.warning(f"Skipping migration of u/{username}: {repr(e)}")
+                checkpoint["skipped_users"] += 1
+            else:
+                checkpoint["created"] += created
+                budget -= created
+                if not complete:
+                    # Don't checkpoint this user so it is resumed next run
+                    log.info(f"Migration paused on u/{username} ({checkpoint['created']} notes created so far).")
+                    return False
+            checkpoint["last_user"] = username
+
+        checkpoint["done"] = True
+        checkpoint["finished"] = time.time()
+        log.info(f"Toolbox to mod notes migration finished: {checkpoint['created']} notes created, {checkpoint['skipped_users']} users skipped.")
+        return True
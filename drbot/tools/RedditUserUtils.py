@@ -40,3 +40,25 @@ class RedditUserUtils:
 
         log.debug(f"u/{reddit_user.name} is active")
         return UserStatus.ACTIVE
+
+    def get_user_entries(self, redditor_in: str | Redditor, include_removed: bool = False) -> list:
+        """The comments and posts of a user in our sub, newest first, e.g. to wipe them.
+        Posts come from a search of the sub (a request or two), instead of going through the user's whole history.
+        Search is indexed with a delay, so the newest posts also come from the first page of the user's submissions.
+        Search doesn't find comments, so they still come from the user's comment history
+        (both often cached already by the history check of AutobanHandler). Already removed entries are skipped by default."""
+        username = redditor_in if isinstance(redditor_in, str) else redditor_in.name
+        entries = {}
+        for post in reddit().sub.search(f'author:"{username}"', sort="new", syntax="lucene", limit=None):
+            # Search matches a bit loosely, double check
+            if post.author is not None and post.author.name.casefold() == username.casefold():
+                entries[post.fullname] = post
+        for post in Redditor(reddit(), username).submissions.new(limit=100):
+            if post.subreddit.display_name.casefold() == settings.subreddit.casefold():
+                entries.setdefault(post.fullname, post)
+        for comment in Redditor(reddit(), username).comments.new(limit=None):
+            if comment.subreddit.display_name.casefold() == settings.subreddit.casefold():
+                entries.setdefault(comment.fullname, comment)
+        if not include_removed:
+            entries = {fullname: item for fullname, item in entries.items() if not getattr(item, "removed", False)}
+        return sorted(entries.values(), key=lambda item: item.created_utc, reverse=True)
@@ -3,10 +3,14 @@ import prawcore
 from praw.models import ModNote, Submission, Comment
 
 from drbot import log
-import pandas as pd
 import base64
+import codecs
+import hashlib
+import re
 import zlib
 import json
+from typing import Iterable, Iterator, Tuple
+from datetime import datetime, timezone
 
 from praw import Reddit
 
@@ -27,47 +31,18 @@ from praw import Reddit
         - warnings: note types as list, where index is the same as note['w']
 """
 
-class Converter:
-    def __init__(self):
-        self.wiki_notes = dict()
-        self.cleaned_usernotes = dict()
-        self.combined_notes = dict()
-        self.df = pd.DataFrame()
-
-    def add(self, wiki, notes):
-        self.wiki_notes = wiki
-        self.cleaned_usernotes = notes
-        self.wiki_notes = self.combine_json()
-        self.df = pd.DataFrame.from_dict(self.cleaned_usernotes)
-
-    def empty_notes(func):
-        def f(self):
-            if not self.wiki_notes:
-                raise Exception(f"Not authenticated or no information provided.")
-            format_name = func(self)
-            log.warning(f"{format_name} file created in current directory")
-
-        return f
-
-    def combine_json(self):
-        self.wiki_notes['blob'] = self.cleaned_usernotes
-        return self.wiki_notes.copy()
-
-    def combinednotes(self):
-        return self.wiki_notes
-
-    @empty_notes
-    def json_format(self):
-        self.df.to_json('usernotes_json.json')
-        return "JSON"
-
-    @empty_notes
-    def csv_format(self):
-        self.df.to_csv('usernotes_csv.csv', encoding='utf-8', index=False)
-        return "CSV"
+# Characters that matter to BlobDecoder.iter_blob_users when skipping a value, inside and outside of strings
+_STRING_SPECIAL = re.compile(r'["\\]')
+_STRUCTURE = re.compile(r'["{}\[\]]')
+_SCALAR_END = re.compile(r'[,}\]\s]')
 
 
 class BlobDecoder:
+    # Size of the base64 slices fed to the decompressor, must be a multiple of 4
+    B64_CHUNK_SIZE = 64 * 1024
+    # Maximum amount of inflated bytes produced per decompression call
+    INFLATE_CHUNK_SIZE = 64 * 1024
+
     def pInflate(self, data) -> bytes:
         decompress = zlib.decompressobj(15)
         decompressed_data = decompress.decompress(data)
@@ -83,23 +58,162 @@ class BlobDecoder:
         self.cleaned_notes = dict()
         self.notelength = int
 
-    def blob_to_string(self, blob: str) -> dict:
-        """Base64 -> zlib-compressed -> string -> dict"""
-        # base64 decode blob
-        zlib_bytes = self.b64d(str.encode(blob))
-
-        # zlib-uncompress to byte
-        decompressed_bytes = self.pInflate(zlib_bytes)
-
-        # byte to string
-        clean_string = self.js_byte_to_string(decompressed_bytes)
+    def iter_blob_text(self, blob: str) -> Iterator[str]:
+        """Base64 -> zlib-compressed -> string, yielded as text chunks.
+        Only one chunk of each stage is alive at a time, so the full inflated blob never sits in memory."""
+        decompress = zlib.decompressobj(15)
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        for start in range(0, len(blob), self.B64_CHUNK_SIZE):
+            data = base64.b64decode(blob[start:start + self.B64_CHUNK_SIZE])
+            while True:
+                inflated = decompress.decompress(data, self.INFLATE_CHUNK_SIZE)
+                text = decoder.decode(inflated)
+                if text:
+                    yield text
+                data = decompress.unconsumed_tail
+                # A full output chunk means zlib may still hold buffered data for this input
+                if not data and len(inflated) < self.INFLATE_CHUNK_SIZE:
+                    break
+        text = decoder.decode(decompress.flush(), final=True)
+        if text:
+            yield text
+
+    def iter_blob_users(self, blob: str, usernames: Iterable[str] | None = None) -> Iterator[Tuple[str, dict]]:
+        """Incrementally parse the decoded blob and yield (username, notes) pairs.
+        If usernames is given, only those users are decoded into dicts: the notes of the others are skipped
+        by scanning their brackets and strings, and the parsing stops once all of them were found."""
+        wanted = None if usernames is None else set(usernames)
+        decoder = json.JSONDecoder()
+        chunks = self.iter_blob_text(blob)
+        buffer = ""
+        pos = 0
+        # Start of the value being parsed, kept in the buffer across fills so it can be decoded in one go
+        mark = None
+
+        def fill() -> bool:
+            # Drop what was already consumed and append the next chunk, returns False at the end of the stream
+            nonlocal buffer, pos, mark
+            chunk = next(chunks, None)
+            if chunk is None:
+                return False
+            offset = pos if mark is None else mark
+            buffer = buffer[offset:] + chunk
+            pos -= offset
+            if mark is not None:
+                mark = 0
+            return True
 
-        # Return dict
-        self.cleaned_notes = json.loads(clean_string)
+        def skip_whitespace():
+            nonlocal pos
+            while True:
+                while pos < len(buffer) and buffer[pos] in " \t\n\r":
+                    pos += 1
+                if pos < len(buffer) or not fill():
+                    return
+
+        def expect(char: str):
+            nonlocal pos
+            skip_whitespace()
+            if pos >= len(buffer) or buffer[pos] != char:
+                raise ValueError(f"Malformed TB blob, expected '{char}' at position {pos}")
+            pos += 1
+
+        def skip_value():
+            # Move pos past the next value without building it. The scan state survives fill(),
+            # so a value cut at the end of the buffer is resumed rather than scanned again.
+            nonlocal pos
+            skip_whitespace()
+            if pos >= len(buffer):
+                raise ValueError("Malformed TB blob, missing value")
+            scalar = buffer[pos] not in '"{['
+            depth = 0
+            in_string = False
+            while True:
+                if scalar:
+                    match = _SCALAR_END.search(buffer, pos)
+                    if match is not None:
+                        pos = match.start()
+                        return
+                    pos = len(buffer)
+                    if not fill():
+                        return
+                    continue
+                match = (_STRING_SPECIAL if in_string else _STRUCTURE).search(buffer, pos)
+                if match is None or (match.group() == "\\" and match.end() == len(buffer)):
+                    # Keep a trailing backslash so the escape is seen whole after the fill
+                    pos = len(buffer) if match is None else match.start()
+                    if not fill():
+                        raise ValueError("Malformed TB blob, truncated value")
+                    continue
+                char = match.group()
+                pos = match.end()
+                if char == "\\":
+                    pos += 1
+                elif char == '"':
+                    in_string = not in_string
+                    if not in_string and depth == 0:
+                        return
+                elif char in "{[":
+                    depth += 1
+                else:
+                    depth -= 1
+                    if depth == 0:
+                        return
+
+        def parse_value():
+            # Most values sit whole in the buffer and decode directly. One cut at the end of the buffer
+            # is scanned to its end first, so it's decoded once instead of after every fill.
+            nonlocal pos, mark
+            skip_whitespace()
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+                if end < len(buffer):
+                    pos = end
+                    return value
+            except json.JSONDecodeError:
+                pass
+            mark = pos
+            skip_value()
+            value, end = decoder.raw_decode(buffer, mark)
+            mark = None
+            if end != pos:
+                raise ValueError(f"Malformed TB blob, unexpected data at position {end}")
+            return value
+
+        expect("{")
+        skip_whitespace()
+        if pos < len(buffer) and buffer[pos] == "}":
+            return
+        while True:
+            username = parse_value()
+            if not isinstance(username, str):
+                raise ValueError(f"Malformed TB blob, unexpected key {username!r}")
+            expect(":")
+            if wanted is not None and username not in wanted:
+                skip_value()
+            else:
+                yield username, parse_value()
+                if wanted is not None:
+                    wanted.discard(username)
+                    if not wanted:
+                        return
+            skip_whitespace()
+            if pos < len(buffer) and buffer[pos] == "}":
+                return
+            expect(",")
+
+    def blob_to_users(self, blob: str, usernames: Iterable[str]) -> dict:
+        """Decode only the notes of the requested users."""
+        return dict(self.iter_blob_users(blob, usernames))
 
-        # sum of values to get total
-        note_count = [len(x['ns']) for x in self.cleaned_notes.values()]
-        self.notelength = sum(note_count)
+    def blob_to_string(self, blob: str) -> dict:
+        """Base64 -> zlib-compressed -> string -> dict, decoded as a stream"""
+        self.cleaned_notes = {}
+        self.notelength = 0
+        for username, notes in self.iter_blob_users(blob):
+            self.cleaned_notes[username] = notes
+            # sum of values to get total
+            self.notelength += len(notes['ns'])
 
         return self.cleaned_notes
 
@@ -110,10 +224,31 @@ class BlobDecoder:
         return self.notelength
 
 
+class BlobEncoder:
+    def blob_from_dict(self, notes: dict) -> str:
+        """dict -> string -> zlib-compressed -> Base64, the reverse of BlobDecoder.blob_to_string"""
+        data = json.dumps(notes, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+        return base64.b64encode(zlib.compress(data, 9)).decode("ascii")
+
+
 class ToolBoxManipulator:
+    # TB note type created when a modnote label has no matching type in the TB constants yet
+    DEFAULT_TB_LABELS = {
+        "SPAM_WARNING": "spamwarning",
+        "SPAM_WATCH": "spamwatch",
+        "PERMA_BAN": "permban",
+        "BAN": "ban",
+        "ABUSE_WARNING": "abusewarning",
+        "HELPFUL_USER": "gooduser",
+        "BOT_BAN": "botban",
+        "SOLID_CONTRIBUTOR": "solidcontributor",
+    }
+
     def __init__(self, reddit: Reddit, bot_name: str):
-        self.tb_converter = Converter()
+        self._tb_converter = None
         self.tb_decoder = BlobDecoder()
+        self.tb_encoder = BlobEncoder()
+        self.wiki_revision = None
         self.mod_notes = []
         self.mod_notes_constants = []
         self.tb_notes_version = 0
@@ -123,6 +258,15 @@ class ToolBoxManipulator:
         self.bot_name = bot_name
         self.refresh_tb()
 
+
+    @property
+    def tb_converter(self):
+        """CSV/JSON export of the notes, only loaded (with pandas) when needed."""
+        if self._tb_converter is None:
+            from drbot.tools.Converter import Converter
+            self._tb_converter = Converter()
+        return self._tb_converter
+
     @staticmethod
     def _get_index_from_val(entries: dict, val: str):
         if val in entries:
@@ -167,6 +311,8 @@ class ToolBoxManipulator:
                 return "HELPFUL_USER"
             case 'botban':
                 return "BOT_BAN"
+            case 'solidcontributor':
+                return "SOLID_CONTRIBUTOR"
             case 'non_signale':
                 # Cases where I've no idea what the category initially meant
                 return None
@@ -190,8 +336,7 @@ class ToolBoxManipulator:
     def get_note_date(self, note: dict):
         timest = self.get_note_timestamp(note)
         try:
-            dt = pd.to_datetime(int(timest), utc=True, unit='s')
-            return dt.date()
+            return datetime.fromtimestamp(int(timest), tz=timezone.utc).date()
         except:
             log.error(f"Failed to transform timestamp to date, sending default value")
             return "None"
@@ -247,7 +392,9 @@ class ToolBoxManipulator:
 
     def refresh_tb(self):
         try:
-            wiki = self.subreddit.wiki["usernotes"].content_md
+            page = self.subreddit.wiki["usernotes"]
+            wiki = page.content_md
+            self.wiki_revision = page.revision_id
             self.wiki_content = json.loads(wiki)
         except prawcore.exceptions.NotFound:
             raise Exception(f"NameError: r/{self.subreddit.display_name} is missing the `usernotes` wiki page!")
@@ -263,6 +410,109 @@ class ToolBoxManipulator:
             self.mod_notes = self.tb_decoder.blob_to_string(self.wiki_content["blob"])
             self.mod_notes_constants = self.wiki_content['constants']
 
+    def get_or_add_modo_index(self, modo: str) -> int:
+        index = self.get_index_from_modo(modo)
+        if index < 0:
+            self.mod_notes_constants["users"].append(modo)
+            index = len(self.mod_notes_constants["users"]) - 1
+        return index
+
+    def get_or_add_note_type_index(self, modnote_label: str | None) -> int:
+        """Index of the TB note type matching a modnote label, added to the constants if the sub has none yet."""
+        warnings = self.mod_notes_constants["warnings"]
+        if modnote_label is None and None in warnings:
+            return warnings.index(None)
+        for i, tb_label in enumerate(warnings):
+            if tb_label is not None and self.get_modnote_label_from_tb_label(tb_label) == modnote_label:
+                return i
+        warnings.append(self.DEFAULT_TB_LABELS.get(modnote_label))
+        return len(warnings) - 1
+
+    def get_tb_link_from_fullname(self, fullname: str | None) -> str:
+        """Shorthand TB link (l,submission_id[,comment_id]) for a comment or submission fullname."""
+        if not fullname:
+            return ""
+        if fullname.startswith("t3_"):
+            return f"l,{fullname[3:]}"
+        if fullname.startswith("t1_"):
+            try:
+                submission_id = self.reddit.comment(fullname[3:]).link_id[3:]
+            except Exception as e:
+                log.warning(f"Could not resolve submission of {fullname} for TB link: {repr(e)}")
+                return ""
+            return f"l,{submission_id},{fullname[3:]}"
+        return ""
+
+    def add_user_note(self, username: str, moderator: str, timestamp: int, modnote_label: str | None, text: str, link: str = "") -> dict:
+        """Add a note to the decoded model, keeping TB's newest first order."""
+        note = {
+            "n": text,
+            "t": int(timestamp),
+            "m": self.get_or_add_modo_index(moderator),
+            "l": link,
+            "w": self.get_or_add_note_type_index(modnote_label),
+        }
+        if username not in self.mod_notes:
+            self.mod_notes[username] = {"ns": []}
+        notes = self.mod_notes[username]["ns"]
+        i = 0
+        while i < len(notes) and notes[i]["t"] > note["t"]:
+            i += 1
+        notes.insert(i, note)
+        return note
+
+    def save_tb(self, reason: str) -> None:
+        """Encode the model once and write it as a single wiki revision.
+        Raises prawcore.exceptions.Conflict if the page was edited since it was loaded."""
+        self.wiki_content["blob"] = self.tb_encoder.blob_from_dict(self.mod_notes)
+        self.wiki_content["constants"] = self.mod_notes_constants
+        content = json.dumps(self.wiki_content, separators=(",", ":"), ensure_ascii=False)
+        self.subreddit.wiki["usernotes"].edit(content=content, reason=reason, previous=self.wiki_revision)
+
+    @staticmethod
+    def normalize_note_text(text: str) -> str:
+        return re.sub(r"\s+", " ", text or "").strip().casefold()
+
+    @classmethod
+    def fingerprint(cls, owner: str, date, label: str | None, text: str) -> str:
+        """Hash identifying a note by owner, date, label and normalized text.
+        date is None for notes migrated with the old "owner | content" format."""
+        key = "\x1f".join([str(owner), str(date), str(label), cls.normalize_note_text(text)])
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def get_note_fingerprints(self, note: dict) -> Tuple[str, str]:
+        """Fingerprints a TB note can be found under in a modnote index: dated one first, legacy one second."""
+        owner = self.get_note_owner(note)
+        label = self.get_note_modnote_label(note)
+        content = self.get_note_content(note)
+        return (self.fingerprint(owner, self.get_note_date(note), label, content),
+                self.fingerprint(owner, None, label, content))
+
+    def get_modnote_fingerprint(self, modnote: ModNote) -> str:
+        """Fingerprint of a reddit modnote, as it would be computed from the TB note it mirrors.
+        Notes created by the bot carry the original owner and date in their text."""
+        if modnote.moderator.name == self.bot_name:
+            parts = [part.strip() for part in modnote.note.split("|", 2)]
+            if len(parts) == 3 and re.fullmatch(r"\d{4}-\d{2}-\d{2}", parts[0]):
+                return self.fingerprint(parts[1], parts[0], modnote.label, parts[2])
+            if len(parts) >= 2:
+                # Old format was not starting with date but with owner
+                return self.fingerprint(parts[0], None, modnote.label, modnote.note.split("|", 1)[1])
+        date = datetime.fromtimestamp(modnote.created_at, tz=timezone.utc).date()
+        return self.fingerprint(modnote.moderator.name, date, modnote.label, modnote.note)
+
+    def build_modnote_index(self, modnotes) -> set:
+        index = set()
+        for modnote in modnotes:
+            if modnote is None:
+                # can return None even in iterator
+                continue
+            index.add(self.get_modnote_fingerprint(modnote))
+        return index
+
+    def is_note_in_index(self, note: dict, index: set) -> bool:
+        return any(fingerprint in index for fingerprint in self.get_note_fingerprints(note))
+
     def get_user_notes(self, username: str) -> []:
         ret = []
         if username in self.mod_notes:
@@ -1,2 +1,22 @@
-from drbot.tools.ToolBoxUtils import Converter
-from drbot.tools.ToolBoxUtils import BlobDecoder
\ No newline at end of file
+from importlib import import_module
+
+# Loaded on first use (PEP 562), so e.g. pandas is only imported if Converter is needed
+_LAZY = {
+    "Converter": "drbot.tools.Converter",
+    "BlobDecoder": "drbot.tools.ToolBoxUtils",
+    "BlobEncoder": "drbot.tools.ToolBoxUtils",
+}
+
+__all__ = list(_LAZY)
+
+
+def __getattr__(name: str):
+    if name in _LAZY:
+        value = getattr(import_module(_LAZY[name]), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY))
@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import atexit
+import gzip
+import json
+import os
+import queue
+import random
+import threading
+from collections import deque
+from drbot import log
+
+
+class Tracer:
+    """Records every (sampled) request made to reddit: endpoint, status, latency, rate-limit headers and the handler that made it.
+    Traces are kept in a ring buffer in memory and optionally written as JSON lines to rotating gzip files
+    by a background thread, so tracing never blocks the bot on disk. trace_report.py reads them back."""
+
+    # Traces kept in memory
+    BUFFER_SIZE = 10000
+    # Uncompressed bytes written to a file before rotating it
+    MAX_FILE_BYTES = 64 * 1024 * 1024
+    # Rotated files kept next to the current one (trace.jsonl.gz.1, .2...)
+    BACKUPS = 5
+    # Traces written between two flushes to disk
+    FLUSH_EVERY = 1000
+
+    def __init__(self) -> None:
+        self.sample_rate = 0.0
+        self.path = ""
+        self.buffer = deque(maxlen=Tracer.BUFFER_SIZE)
+        self._queue = None
+        self._writer = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0
+
+    def configure(self, sample_rate: float, path: str = "") -> None:
+        """Trace a sample_rate share of the requests (0 turns tracing off), writing them to path if it's not empty.
+        The file is only touched when tracing is on and there's something to write."""
+        self.sample_rate = sample_rate
+        if self.enabled and path != "" and self._writer is None:
+            self.path = path
+            self._queue = queue.SimpleQueue()
+            self._writer = threading.Thread(target=self._write, name="tracer", daemon=True)
+            self._writer.start()
+            atexit.register(self.close)
+        if self.enabled:
+            log.info(f"Tracing {sample_rate:.0%} of reddit requests{f' to {path}' if path != '' else ''}.")
+
+    def sampled(self) -> bool:
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def record(self, trace: dict) -> None:
+        self.buffer.append(trace)
+        if self._queue is not None:
+            self._queue.put(trace)
+
+    def recent(self) -> list[dict]:
+        return list(self.buffer)
+
+    def close(self) -> None:
+        """Flush the traces waiting to be written."""
+        if self._writer is not None:
+            self._queue.put(None)
+            self._writer.join(timeout=10)
+            self._writer = None
+
+    def _rotate(self) -> None:
+        for i in range(Tracer.BACKUPS - 1, 0, -1):
+            if os.path.isfile(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if os.path.isfile(self.path):
+            os.replace(self.path, f"{self.path}.1")
+
+    def _write(self) -> None:
+        written = os.path.getsize(self.path) * 10 if os.path.isfile(self.path) else 0  # Rough, the file is compressed
+        lines = 0
+        f = None  # Opened with the first trace, so a run without requests doesn't add an empty gzip member
+        try:
+            while True:
+                trace = self._queue.get()
+                if trace is None:
+                    break
+                if f is None:
+                    f = gzip.open(self.path, "at", encoding="utf-8")
+                line = json.dumps(trace) + "\n"
+                f.write(line)
+                written += len(line)
+                lines += 1
+                if lines % Tracer.FLUSH_EVERY == 0:
+                    f.flush()
+                if written > Tracer.MAX_FILE_BYTES:
+                    f.close()
+                    self._rotate()
+                    f = gzip.open(self.path, "at", encoding="utf-8")
+                    written = 0
+        except Exception as e:
+            log.error(f"Tracing stopped, couldn't write to {self.path}: {e}")
+            self._queue = None
+        finally:
+            if f is not None:
+                f.close()
+
+
+tracer = Tracer()
@@ -10,69 +10,68 @@ import logging
 import schedule
 import time
 from safe_schedule import SafeScheduler
+from schedule import CancelJob
 
 from prawcore import TooManyRequests
 
-from drbot import settings, log, reddit
-from drbot.stores import *
-from drbot.agents import *
-from drbot.handlers import *
+from drbot import settings, log, reddit, metrics, snapshot, actions
+from drbot import registry
+from drbot.stores import DataStore, WikiStore
 
 
-def main():
-    log.info(f"AutobanBOT for r/{settings.subreddit} starting up")
+def job_name(job) -> str:
+    """E.g. "ModlogAgent.run" for a job running modlog_agent.run, "PointsHandler.scan_all" for a handler job."""
+    func = job.job_func.func
+    if hasattr(func, "__self__"):
+        return f"{type(func.__self__).__name__}.{func.__name__}"
+    return getattr(func, "__qualname__", repr(func))
 
-    reddit.login()
 
-    data_store = DataStore()
-    schedule = SafeScheduler()
-    # Save locally every minute
-    schedule.every(15).minutes.do(data_store.save)
+def main():
+    log.info(f"AutobanBOT for r/{', r/'.join(settings.all_subreddits)} starting up")
+
+    if settings.metrics_port != 0:
+        metrics.serve(settings.metrics_port)
 
-    #if not settings.is_test_env:
-    # Modlog agent
+    # Skip what we already know from the last run, it's checked again once the bot is up
+    snapshot.load(settings.startup_snapshot_file)
 
-    modlog_agent = ModlogAgent(data_store)
-    modlog_agent.register(ModQueueCleanerHandler())
+    reddit.login()
 
-    modlog_agent.register(ModNotesHandler())
+    # Moderation actions left over by the last run are sent first
+    actions.open(settings.action_queue_file)
 
-    points_handler = PointsHandler()
-    modlog_agent.register(points_handler)
-    schedule.every(12).hours.do(points_handler.scan_all).tag("no_initial")
-    modlog_agent.register(AdminHandler())
-    config_handler = ConfigEditHandler()
-    modlog_agent.register(config_handler)
+    schedule = SafeScheduler(on_job_done=lambda job, seconds, overrun: metrics.record_job(job_name(job), seconds, overrun))
 
-    schedule.every(30).seconds.do(modlog_agent.run)
+    # Each sub has its own data store and agents, the reddit session and its caches are shared
+    for subreddit in settings.all_subreddits:
+        with settings.use_subreddit(subreddit):
+            data_store = DataStore()
+            # Save locally every minute
+            schedule.every(15).minutes.do(settings.bind(data_store.save))
 
-    # Comment agent
-    comment_agent = CommentAgent(data_store)
-    comment_agent.register(AutobanHandler())
-    comment_agent.register(SpecialUserStatusHandler())
-    poll_handler = PollHandler()
-    comment_agent.register(poll_handler)
-    schedule.every(12).hours.do(poll_handler.run_tally).tag("no_initial")
-    schedule.every(30).seconds.do(comment_agent.run)
+            # Agents and handlers turned on in the settings (see drbot/registry.py)
+            registry.build(data_store, schedule)
 
-    # Periodic scan of points (scheduled last so other stuff happens first)
+            #data_store.from_backup()
+            # Load from wiki last to load data into the existing agents' data stores
+            if settings.wiki_page != "":
+                wiki_store = WikiStore(data_store)
+                # Push save into wiki every 30mn to avoid spamming modlog
+                schedule.every(15).minutes.do(settings.bind(wiki_store.save))
 
-    #data_store.from_backup()
-    # Load from wiki last to load data into the existing agents' data stores
-    if settings.wiki_page != "":
-        wiki_store = WikiStore(data_store)
-        # Push save into wiki every 30mn to avoid spamming modlog
-        schedule.every(15).minutes.do(wiki_store.save)
-
-    #else:
-        # poll_handler = PollHandler()
-        # comment_agent = CommentAgent(data_store)
-        # comment_agent.register(PollHandler())
-        # schedule.every(30).seconds.do(poll_handler.run_tally)
-    #     pass
+    # Send the moderation actions queued by the handlers (for all subs)
+    schedule.every(5).seconds.do(actions.drain)
 
     # Load from local backup just in case
     #data_store.from_backup()
+    snapshot.save()
+
+    def revalidate_snapshot():
+        snapshot.revalidate()
+        return CancelJob  # Only once
+    schedule.every(1).minutes.do(revalidate_snapshot).tag("no_initial")
+
     # Run all jobs immediately except those that shouldn't be run initially
     cont = 1
     while cont == 1:
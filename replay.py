@@ -0,0 +1,146 @@
+"""
+Replays recorded or synthetic traffic through the bot's agents, against an offline stand-in of the Reddit API.
+The virtual clock advances by --step seconds between batches so a whole day goes through at full speed.
+Useful to measure the bot's throughput and compare two versions of it on the same traffic:
+
+    python replay.py --synthetic --comments 5000 --save-fixture day.json
+    python replay.py --fixture day.json --output before.json
+    python replay.py --fixture day.json --latency 0.2 --rate-limit 1000
+
+Uses the settings in data/ like the bot does, but never talks to reddit and keeps its data store in a scratch file.
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+from collections import Counter
+
+from drbot import settings, log, reddit, metrics, actions
+from drbot.log import console_handler
+from drbot.offline import FakeReddit, FakeSession, TrafficGenerator, ScratchDataStore
+from drbot.agents import ModlogAgent, CommentAgent
+from drbot.handlers import ModQueueCleanerHandler, ModNotesHandler, PointsHandler, AdminHandler, AutobanHandler, SpecialUserStatusHandler
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Replay reddit traffic through the bot against an offline stand-in of the API.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--fixture", help="JSON fixture to replay (see drbot/offline/TrafficGenerator.py for the format)")
+    source.add_argument("--synthetic", action="store_true", help="Generate synthetic traffic")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--comments", type=int, default=5000)
+    parser.add_argument("--submissions", type=int, default=200)
+    parser.add_argument("--duration", type=int, default=86400, help="Seconds of synthetic traffic")
+    parser.add_argument("--history", type=int, default=50, help="Items in each user's history outside of the sub")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save-fixture", help="Write the generated synthetic fixture to this file")
+    parser.add_argument("--step", type=int, default=30, help="Virtual seconds between batches (the bot runs every 30s)")
+    parser.add_argument("--latency", type=float, default=0.0, help="Simulated latency of each request, in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random variation of the latency, in seconds")
+    parser.add_argument("--rate-limit", type=int, default=None, help="Requests allowed per 10 minutes (unlimited by default)")
+    parser.add_argument("--log-level", default="WARNING", help="Console log level during the replay")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    return parser.parse_args()
+
+
+def load_fixture(args) -> dict:
+    if args.fixture:
+        with open(args.fixture, "r") as f:
+            return json.load(f)
+    generator = TrafficGenerator(settings.subreddit,
+                                 monitored_subs=[s["id"] for s in settings.monitored_subs],
+                                 removal_reasons=[r["id"] for r in settings.point_config],
+                                 wiki_page=settings.wiki_page,
+                                 seed=args.seed)
+    fixture = generator.generate(users=args.users, comments=args.comments, submissions=args.submissions,
+                                 duration=args.duration, history=args.history)
+    if args.save_fixture:
+        with open(args.save_fixture, "w") as f:
+            json.dump(fixture, f)
+    return fixture
+
+
+def count_replayed(fixture: dict) -> tuple[int, int]:
+    """Comments on the sub and modlog entries in the replayed period."""
+    start, end = fixture["start"], fixture["end"]
+    comments = sum(1 for t in fixture.get("things", []) if t["kind"] == "t1" and start < t["data"]["created_utc"] <= end
+                   and t["data"].get("subreddit", fixture["subreddit"]).lower() == fixture["subreddit"].lower())
+    entries = sum(1 for e in fixture.get("modlog", []) if start < e["created_utc"] <= end)
+    return comments, entries
+
+
+def main():
+    args = parse_args()
+    fixture = load_fixture(args)
+    if fixture["subreddit"].lower() != settings.subreddit.lower():
+        raise Exception(f"The fixture is for r/{fixture['subreddit']} but the settings are for r/{settings.subreddit}.")
+
+    backend = FakeReddit.from_fixture(fixture)
+    session = FakeSession(backend, latency=args.latency, jitter=args.jitter, rate_limit=args.rate_limit, seed=args.seed)
+    console_handler.setLevel(args.log_level)
+    reddit.login(session=session)
+
+    scratch = tempfile.NamedTemporaryFile(prefix="drbot_replay_", suffix=".json", delete=False)
+    scratch.close()
+    data_store = ScratchDataStore(scratch.name)
+
+    # Same wiring as main.py, minus the handlers that write local files (ConfigEditHandler) or run threads (PollHandler)
+    modlog_agent = ModlogAgent(data_store)
+    modlog_agent.register(ModQueueCleanerHandler())
+    modlog_agent.register(ModNotesHandler())
+    modlog_agent.register(PointsHandler())
+    modlog_agent.register(AdminHandler())
+    comment_agent = CommentAgent(data_store)
+    comment_agent.register(AutobanHandler())
+    comment_agent.register(SpecialUserStatusHandler())
+    agents = [modlog_agent, comment_agent]
+
+    setup_requests = sum(backend.requests.values())
+    agent_stats = {agent.name: {"batches": 0, "wall_seconds": 0.0} for agent in agents}
+    end = fixture["end"]
+    started = time.perf_counter()
+    while backend.now < end:
+        backend.now = min(end, backend.now + args.step)
+        for agent in agents:
+            t = time.perf_counter()
+            agent.run()
+            agent_stats[agent.name]["batches"] += 1
+            agent_stats[agent.name]["wall_seconds"] += time.perf_counter() - t
+        actions.drain()  # Queue kept in memory, as if the bot had no action_queue_file
+    wall = time.perf_counter() - started
+    os.remove(scratch.name)
+
+    comments, entries = count_replayed(fixture)
+    requests = sum(backend.requests.values()) - setup_requests
+    results = {
+        "fixture": args.fixture or f"synthetic (seed {args.seed})",
+        "virtual_seconds": end - fixture["start"],
+        "wall_seconds": round(wall, 3),
+        "comments": comments,
+        "modlog_entries": entries,
+        "items_per_second": round((comments + entries) / wall, 2) if wall > 0 else None,
+        "requests": requests,
+        "requests_per_item": round(requests / (comments + entries), 3) if comments + entries > 0 else None,
+        "simulated_latency_seconds": round(session.simulated_latency, 3),
+        "rate_limited": session.rate_limited,
+        "agents": agent_stats,
+        "requests_by_endpoint": dict(backend.requests.most_common()),
+        "actions": dict(Counter(a["action"] for a in backend.actions).most_common()),
+        "handlers": metrics.export()["agents"],
+    }
+
+    print(f"Replayed {results['virtual_seconds'] / 3600:.1f}h of traffic ({comments} comments, {entries} modlog entries) in {wall:.1f}s")
+    print(f"{results['items_per_second']} items/s, {requests} requests ({results['requests_per_item']} per item)")
+    for name, stats in agent_stats.items():
+        print(f"  {name}: {stats['batches']} batches, {stats['wall_seconds']:.1f}s")
+    print("Top endpoints: " + ", ".join(f"{k} ({v})" for k, v in backend.requests.most_common(8)))
+    print("Actions: " + (", ".join(f"{k} ({v})" for k, v in results["actions"].items()) or "none"))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import logging
+import time
 from traceback import format_exc
 import datetime
 
@@ -17,19 +18,31 @@ class SafeScheduler(Scheduler):
     whether other jobs will run or if they'll crash the entire script.
     """
 
-    def __init__(self, reschedule_on_failure=True):
+    def __init__(self, reschedule_on_failure=True, on_job_done=None):
         """
         If reschedule_on_failure is True, jobs will be rescheduled for their
         next run as if they had completed successfully. If False, they'll run
         on the next run_pending() tick.
+        on_job_done(job, seconds, overrun) is called after every run, overrun
+        being True when the job took longer than its interval.
         """
         self.reschedule_on_failure = reschedule_on_failure
+        self.on_job_done = on_job_done
         super().__init__()
 
     def _run_job(self, job):
+        start = time.perf_counter()
         try:
             super()._run_job(job)
         except Exception:
             logger.error(format_exc())
             job.last_run = datetime.datetime.now()
             job._schedule_next_run()
+        finally:
+            if self.on_job_done is not None:
+                seconds = time.perf_counter() - start
+                interval = datetime.timedelta(**{job.unit: job.interval}).total_seconds() if job.unit else None
+                overrun = interval is not None and seconds > interval
+                if overrun:
+                    logger.warning(f"Job {job} took {seconds:.1f}s, longer than its interval ({interval:.0f}s).")
+                self.on_job_done(job, seconds, overrun)
@@ -0,0 +1,181 @@
+"""
+Summarizes the request traces written by the bot (see trace_sample_rate in data/server_settings.toml)
+to find hot endpoints, the handlers making them and redundant calls:
+
+    python trace_report.py                                  # data/trace.jsonl.gz and its rotated files
+    python trace_report.py traces.jsonl.gz --window 300     # count repeats of a GET within 5 minutes as redundant
+    curl -s localhost:9464/trace > recent.jsonl && python trace_report.py recent.jsonl
+
+Redundant calls are only counted exactly with trace_sample_rate = 1.
+"""
+
+import argparse
+import glob
+import gzip
+import json
+import math
+import os
+import re
+from collections import Counter, defaultdict
+from urllib.parse import urlencode
+
+DEFAULT_TRACE_FILE = "data/trace.jsonl.gz"
+
+
+def trace_files(path: str) -> list[str]:
+    """A trace file and its rotated files, oldest first."""
+    rotated = [f for f in glob.glob(f"{glob.escape(path)}.*") if re.fullmatch(r"\d+", f.rsplit(".", 1)[1])]
+    rotated.sort(key=lambda f: int(f.rsplit(".", 1)[1]), reverse=True)
+    return rotated + ([path] if os.path.isfile(path) else [])
+
+
+def read_traces(path: str) -> list[dict]:
+    traces = []
+    with open(path, "rb") as f:
+        gzipped = f.read(2) == b"\x1f\x8b"
+    f = gzip.open(path, "rt", encoding="utf-8") if gzipped else open(path, "r", encoding="utf-8")
+    try:
+        for line in f:
+            if line.strip() != "":
+                traces.append(json.loads(line))
+    except (EOFError, json.JSONDecodeError):
+        pass  # File still being written or cut short by a crash, keep what was read
+    finally:
+        f.close()
+    return traces
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def handler(trace: dict) -> str:
+    return trace["handler"] or "(outside handlers)"
+
+
+def request(trace: dict) -> str:
+    """E.g. "GET /r/sub/about/banned/?user=foo"."""
+    params = {k: v for k, v in trace["params"].items() if k != "raw_json"}
+    return f"{trace['method']} {trace['path']}" + (f"?{urlencode(params)}" if len(params) > 0 else "")
+
+
+def redundant_calls(traces: list[dict], window: float) -> list[tuple[dict, dict]]:
+    """(call, previous identical call) for every GET repeating one made less than window seconds before."""
+    last = {}
+    repeats = []
+    for trace in traces:
+        if trace["method"] != "GET" or trace["status"] != 200:
+            continue
+        key = (trace["path"], tuple(sorted(trace["params"].items())))
+        if key in last and trace["time"] - last[key]["time"] < window:
+            repeats.append((trace, last[key]))
+        last[key] = trace
+    return repeats
+
+
+def report(traces: list[dict], window: float, top: int) -> dict:
+    traces = sorted(traces, key=lambda t: t["time"])
+    endpoints = defaultdict(list)
+    handlers = defaultdict(list)
+    for trace in traces:
+        endpoints[trace["endpoint"]].append(trace)
+        handlers[handler(trace)].append(trace)
+    remaining = [float(t["ratelimit_remaining"]) for t in traces if t.get("ratelimit_remaining") is not None]
+
+    repeats = redundant_calls(traces, window)
+    repeated_endpoints = Counter(t["endpoint"] for t, previous in repeats)
+    repeated_paths = Counter(request(t) for t, previous in repeats)
+    repeated_by = defaultdict(Counter)
+    for t, previous in repeats:
+        repeated_by[t["endpoint"]][f"{handler(previous)} -> {handler(t)}"] += 1
+
+    def summary(group: list[dict]) -> dict:
+        ms = [t["ms"] for t in group]
+        return {"requests": len(group),
+                "share": round(len(group) / len(traces), 4),
+                "seconds": round(sum(ms) / 1000, 3),
+                "mean_ms": round(sum(ms) / len(ms), 1),
+                "p95_ms": percentile(ms, 95),
+                "bytes": sum(t["bytes"] for t in group),
+                "errors": sum(1 for t in group if t["status"] >= 400)}
+
+    return {
+        "requests": len(traces),
+        "span_seconds": round(traces[-1]["time"] - traces[0]["time"], 3),
+        "seconds": round(sum(t["ms"] for t in traces) / 1000, 3),
+        "bytes": sum(t["bytes"] for t in traces),
+        "statuses": dict(Counter(t["status"] for t in traces).most_common()),
+        "rate_limited": sum(1 for t in traces if t["status"] == 429),
+        "min_ratelimit_remaining": min(remaining) if len(remaining) > 0 else None,
+        "endpoints": {e: summary(g) for e, g in sorted(endpoints.items(), key=lambda e: len(e[1]), reverse=True)[:top]},
+        "handlers": {h: summary(g) | {"top_endpoints": dict(Counter(t["endpoint"] for t in g).most_common(3))}
+                     for h, g in sorted(handlers.items(), key=lambda h: len(h[1]), reverse=True)},
+        "redundant": {
+            "window_seconds": window,
+            "requests": len(repeats),
+            "share": round(len(repeats) / len(traces), 4),
+            "endpoints": {e: {"requests": n, "share_of_endpoint": round(n / len(endpoints[e]), 4),
+                              "handlers": dict(repeated_by[e].most_common(3))}
+                          for e, n in repeated_endpoints.most_common(top)},
+            "paths": dict(repeated_paths.most_common(top)),
+        },
+    }
+
+
+def print_report(r: dict) -> None:
+    print(f"{r['requests']} requests over {r['span_seconds'] / 3600:.1f}h, {r['seconds']:.1f}s waiting on responses, "
+          f"{r['bytes'] / 1024 / 1024:.1f} MB received")
+    print("Statuses: " + ", ".join(f"{s} ({n})" for s, n in r["statuses"].items()))
+    if r["min_ratelimit_remaining"] is not None:
+        print(f"Rate limit: {r['rate_limited']} requests answered 429, lowest remaining budget {r['min_ratelimit_remaining']:.0f}")
+
+    def table(title: str, rows: dict) -> None:
+        print(f"\n{title:<48} {'requests':>9} {'share':>7} {'seconds':>9} {'mean':>9} {'p95':>9} {'MB':>8} {'errors':>7}")
+        for name, s in rows.items():
+            print(f"{name[:48]:<48} {s['requests']:>9} {s['share']:>7.1%} {s['seconds']:>9.1f} {s['mean_ms']:>7.1f}ms"
+                  f" {s['p95_ms']:>7.1f}ms {s['bytes'] / 1024 / 1024:>8.2f} {s['errors']:>7}")
+
+    table("Endpoint", r["endpoints"])
+    table("Handler", r["handlers"])
+
+    redundant = r["redundant"]
+    print(f"\nRedundant calls: {redundant['requests']} ({redundant['share']:.1%}) GETs repeated an identical one "
+          f"less than {redundant['window_seconds']:.0f}s before")
+    for e, s in redundant["endpoints"].items():
+        print(f"  {e[:48]:<48} {s['requests']:>9} ({s['share_of_endpoint']:.0%} of its calls), "
+              + ", ".join(f"{h} ({n})" for h, n in s["handlers"].items()))
+    if len(redundant["paths"]) > 0:
+        print("Most repeated:")
+        for path, n in redundant["paths"].items():
+            print(f"  {path} ({n} repeats)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize the bot's request traces.")
+    parser.add_argument("files", nargs="*", help=f"Trace files (default: {DEFAULT_TRACE_FILE} and its rotated files)")
+    parser.add_argument("--window", type=float, default=60, help="Seconds within which an identical GET counts as redundant")
+    parser.add_argument("--top", type=int, default=15, help="Number of endpoints and paths to show")
+    parser.add_argument("--handler", help="Only look at the requests of this handler")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    files = args.files or trace_files(DEFAULT_TRACE_FILE)
+    for f in files:
+        if not os.path.isfile(f):
+            parser.error(f"No such file: {f}")
+    traces = [t for f in files for t in read_traces(f)]
+    if args.handler:
+        traces = [t for t in traces if t["handler"] == args.handler]
+    if len(traces) == 0:
+        parser.exit(1, "No traces found. Set trace_sample_rate in data/server_settings.toml to record some.\n")
+
+    r = report(traces, args.window, args.top)
+    if args.json:
+        print(json.dumps(r, indent=2))
+    else:
+        print_report(r)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Works on the history checks the bot hands out when it can't keep up on its own (see shard_queue_file in
+data/server_settings.toml). Start as many as needed on the same host as the bot, each with its own reddit account
+so they don't share the rate limit, e.g.:
+
+    AUTOBANBOT_REFRESH_TOKEN=<token of another account> python worker.py
+
+Workers only read (user histories), the bot takes all the actions and sends the reports.
+"""
+
+import argparse
+import os
+import socket
+import time
+
+from praw.models import Redditor
+
+from drbot import settings, log, reddit
+from drbot.handlers import AutobanHandler
+from drbot.stores import JobQueue, MonitoredSubsMap
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Work on the history checks handed out by the bot.")
+    parser.add_argument("--queue", default=settings.shard_queue_file, help="Queue file (default: shard_queue_file from the settings)")
+    parser.add_argument("--name", default=f"{socket.gethostname()}-{os.getpid()}", help="Name of this worker in the queue")
+    parser.add_argument("--idle", type=float, default=1, help="Seconds to wait when there's nothing to do")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.queue == "":
+        raise Exception("No queue to work on, set shard_queue_file in the settings or pass --queue.")
+
+    reddit.login(moderator=False)
+    queue = JobQueue(args.queue)
+    maps = {}  # Sub -> its MonitoredSubsMap
+    log.info(f"Worker {args.name} waiting for history checks in {args.queue}.")
+
+    while True:
+        job = queue.claim(args.name, AutobanHandler.JOB_KIND)
+        if job is None:
+            time.sleep(args.idle)
+            continue
+        if job.subreddit.casefold() not in (s.casefold() for s in settings.all_subreddits):
+            log.error(f"Job {job.id} is for r/{job.subreddit}, which isn't in this worker's settings.")
+            queue.release(job.id)
+            time.sleep(args.idle)
+            continue
+
+        with settings.use_subreddit(job.subreddit):
+            settings.refresh()
+            if job.subreddit not in maps:
+                maps[job.subreddit] = MonitoredSubsMap()
+            maps[job.subreddit].refresh_values()
+            try:
+                found = AutobanHandler.find_trigger(maps[job.subreddit], Redditor(reddit(), job.payload["username"]))
+            except Exception as e:
+                if queue.fail(job.id, repr(e)):
+                    log.error(f"History check of u/{job.payload['username']} failed, it will be tried again later: {repr(e)}")
+                else:
+                    log.error(f"History check of u/{job.payload['username']} failed {JobQueue.MAX_ATTEMPTS} times, giving up: {repr(e)}")
+                continue
+        queue.finish(job.id, AutobanHandler.check_result(found))
+        log.debug(f"Checked u/{job.payload['username']} for r/{job.subreddit}.")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        log.info("Worker manually interrupted - shutting down...")